@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the dsv parser on synthetic transaction and dues files.
+
+Usage:
+    ./bench_dsv.py [-n lines] [-j workers] [--legacy]
+"""
+import argparse
+import random
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dsv import dsv_reader, dsv_record_dump, dsv_value_load, parallel_dsv_reader
+
+
+def legacy_dsv_record_load(line, delimiter=';'):
+    line = line.strip()
+    offset = 0
+    parsed = []
+    while offset < len(line):
+        value, parsed_chars = dsv_value_load(line[offset:], delimiter)
+        offset += parsed_chars
+        parsed.append(value)
+    return parsed
+
+
+def legacy_dsv_reader(data_source, delimiter=';'):
+    return map(lambda l: legacy_dsv_record_load(l, delimiter), data_source)
+
+
+def synthetic_transaction_lines(count: int, generator: random.Random):
+    start = datetime(2010, 1, 1)
+    for i in range(count):
+        subject = f"składka członkowska {generator.choice(['jan', 'anna', 'piotr'])} kowalski {i}"
+        if i % 20 == 0:
+            subject += "; miesiące 1\\2"
+        yield dsv_record_dump([
+            (start + timedelta(minutes=i)).isoformat(),
+            f"{70000000 + i}",
+            f"{generator.randrange(10 ** 25, 10 ** 26)}",
+            subject,
+            "Jan Kowalski ul. Długa 1 80-001 Gdańsk",
+            f"{generator.randint(1, 300)}.00",
+            "PLN",
+            "Credit",
+        ]) + "\n"
+
+
+def synthetic_dues_lines(count: int, generator: random.Random, history_length: int = 120):
+    for i in range(count):
+        history = [
+            f"{datetime(2010 + month // 12, month % 12 + 1, 5)},100,{generator.randint(-3, 3)}"
+            for month in range(history_length)
+        ]
+        yield dsv_record_dump([f"member{i}@example.com", generator.randint(-10, 3)] + history) + "\n"
+
+
+def benchmark(path: Path, reader) -> float:
+    with open(path) as data_source:
+        start = time.perf_counter()
+        records = sum(1 for _ in reader(data_source))
+        elapsed = time.perf_counter() - start
+    return records / elapsed
+
+
+def parallel_benchmark(path: Path, workers: int) -> float:
+    start = time.perf_counter()
+    records = sum(1 for _ in parallel_dsv_reader(path, workers))
+    return records / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    bench_cli_argparse = argparse.ArgumentParser()
+    bench_cli_argparse.add_argument("-n", action="store", dest="lines", type=int, default=1_000_000, required=False)
+    bench_cli_argparse.add_argument("--legacy", action="store_true", dest="legacy", default=False, required=False,
+                                    help="benchmark the character by character parser as well")
+    bench_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=0, required=False,
+                                    help="processes used by parallel_dsv_reader, 0 for all cpus")
+    args = bench_cli_argparse.parse_args()
+
+    generator = random.Random(0)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = {
+            'transactions': (Path(tmp_dir) / 'transactions.dsv', synthetic_transaction_lines),
+            'dues': (Path(tmp_dir) / 'dues.dsv', synthetic_dues_lines),
+        }
+        for name, (path, lines_generator) in files.items():
+            with open(path, 'w') as output_file:
+                output_file.writelines(lines_generator(args.lines, generator))
+
+            print(f"{name}: {benchmark(path, dsv_reader):,.0f} records/sec")
+            print(f"{name} (parallel): {parallel_benchmark(path, args.workers):,.0f} records/sec")
+            if args.legacy:
+                print(f"{name} (legacy): {benchmark(path, legacy_dsv_reader):,.0f} records/sec")
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark of parsing a synthetic bank export of MT940 statements by mt940_2_dsv.
+
+Usage:
+    ./bench_mt940.py [--statements N] [--transactions N] [-j N]
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+from mt940_2_dsv import deduplicated_dsv, mt940_to_dsv, parse_desc_tag, parse_mt940
+
+try:
+    import mt940
+except ImportError:
+    mt940 = None
+
+DESCRIPTIONS = [
+    ["^00PRZELEW OTRZYMANY", "^34000", "^20składka członkowska {name}", "^32{name}^33UL. DŁUGA 1 80-001 GDAŃSK",
+     "^3821203000451110000002182130"],
+    ["^00PRZELEW INTERNETOWY", "^34000", "^3010101049", "^20/TI/3456633635737/OKR/19M08^21/SFP/AKC/TXT/{name}",
+     "^32Urząd Skarbowy Augustów", "^3852101010490213402222000000"],
+    ["^00OPŁATA ZA RACHUNEK/PAKIET ^34000"],
+    ["^00PRZELEW OTRZYMANY", "^34000", "^20zwrot nadpłaty", "^32PL21203000451110000002182130^33{name}",
+     "^62-SP.K. DULĘBY 9 40-800 KATO^63WICE"],
+]
+NAMES = ['Jan Kowalski', 'Anna Nowak', 'Graffic Services Sp. Z O.o.', 'Łucja Żółć']
+
+
+def synthetic_statement(number: int, start: date, transactions: int, generator: random.Random) -> str:
+    lines = [":20:1", ":25:/PL 98160011270000000022771234", f":28C:{number:05d}/001",
+             f":60F:C{start:%y%m%d}PLN000002623569,48"]
+    for i in range(transactions):
+        day = start + timedelta(days=i * 28 // transactions)
+        sign = generator.choice('CD')
+        amount = f"{generator.randint(1, 500000) // 100:012d},{generator.randint(0, 99):02d}"
+        lines.append(f":61:{day:%y%m%d%m%d}{sign}N{amount}N240NONREF//CEN{day:%y%m%d}{i:07d}")
+        description = generator.choice(DESCRIPTIONS)
+        name = generator.choice(NAMES)
+        lines.append(f":86:{generator.randint(200, 999)}" + "\n".join(description).format(name=name))
+    lines.append(f":62F:C{start + timedelta(days=28):%y%m%d}PLN000001753385,79")
+    return "\n".join(lines) + "\n"
+
+
+if __name__ == "__main__":
+    bench_cli_argparse = argparse.ArgumentParser()
+    bench_cli_argparse.add_argument("--statements", action="store", dest="statements", type=int, default=1_000)
+    bench_cli_argparse.add_argument("--transactions", action="store", dest="transactions", type=int, default=50,
+                                    help="transactions of each statement")
+    bench_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=0, required=False,
+                                    help="processes parsing statement files, 0 for all cpus")
+    args = bench_cli_argparse.parse_args()
+
+    generator = random.Random(0)
+    statements = [synthetic_statement(i, date(2000, 1, 1) + timedelta(days=28 * i), args.transactions, generator)
+                  for i in range(args.statements)]
+    descriptions = [block.split(":", 1)[1] for statement in statements
+                    for block in statement.split("\n:") if block.startswith("86:")]
+
+    start = time.perf_counter()
+    for description in descriptions:
+        parse_desc_tag(description)
+    elapsed = time.perf_counter() - start
+    print(f"parse_desc_tag: {len(descriptions):,} :86: tags in {elapsed:,.2f}s, "
+          f"{len(descriptions) / elapsed:,.0f}/sec, {args.statements / elapsed:,.0f} statements/sec")
+
+    with tempfile.TemporaryDirectory(prefix='bench_mt940') as tmp_dir:
+        export_path = os.path.join(tmp_dir, 'export.STA')
+        with open(export_path, 'w', encoding='utf-8') as export_file:
+            export_file.writelines(statements)
+        start = time.perf_counter()
+        lines = sum(1 for _ in mt940_to_dsv(parse_mt940([export_path])))
+        elapsed = time.perf_counter() - start
+        if mt940 is not None:
+            start = time.perf_counter()
+            with open(export_path, encoding='utf-8') as export_file:
+                library_transactions = len(mt940.models.Transactions().parse(export_file.read()))
+            library_elapsed = time.perf_counter() - start
+
+        statement_paths = []
+        for i, statement in enumerate(statements):
+            statement_paths.append(os.path.join(tmp_dir, f"{i:05d}.STA"))
+            with open(statement_paths[-1], 'w', encoding='utf-8') as statement_file:
+                statement_file.write(statement)
+        files_elapsed = {}
+        for workers in (1, args.workers):
+            start = time.perf_counter()
+            sum(1 for _ in mt940_to_dsv(parse_mt940(statement_paths, workers)))
+            files_elapsed[workers] = time.perf_counter() - start
+        start = time.perf_counter()
+        deduplicated = sum(1 for _ in deduplicated_dsv(statement_paths + statement_paths, args.workers))
+        dedup_elapsed = time.perf_counter() - start
+    print(f"mt940_2_dsv: {args.statements:,} statements, {lines:,} transactions in {elapsed:,.2f}s, "
+          f"{args.statements / elapsed:,.0f} statements/sec")
+    if mt940 is not None:
+        print(f"mt940 library: {args.statements:,} statements, {library_transactions:,} transactions in "
+              f"{library_elapsed:,.2f}s, {args.statements / library_elapsed:,.0f} statements/sec")
+    for workers, elapsed in files_elapsed.items():
+        print(f"mt940_2_dsv -j {workers}: {args.statements:,} statement files in {elapsed:,.2f}s, "
+              f"{args.statements / elapsed:,.0f} statements/sec")
+    print(f"mt940_2_dsv --dedup -j {args.workers}: {2 * args.statements:,} statement files, {deduplicated:,} "
+          f"transactions in {dedup_elapsed:,.2f}s, {2 * args.statements / dedup_elapsed:,.0f} statements/sec")
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Benchmarks of skladkoinator replaying a synthetic event log.
+
+Usage:
+    ./bench_skladkoinator.py memory [--members N] [--years N]
+    ./bench_skladkoinator.py read [--members N] [--years N]
+    ./bench_skladkoinator.py replay [--members N] [--years N] [--repeats N]
+    ./bench_skladkoinator.py accrual [--members N] [--years N] [--paying-every MONTHS]
+    ./bench_skladkoinator.py partitioned [--members N] [--years N] [-p PARTITIONS]
+    ./bench_skladkoinator.py query [--members N] [--years N] [--queries N]
+"""
+import argparse
+import gc
+import random
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Iterable
+
+import data_structures
+import skladkoinator
+from data_structures import AccountState, Event, HouseRules
+from skladkoinator import DuesLedger, EventEngine, EventHandlers, partitioned_replay
+from dsv import dsv_reader, dsv_record_dump
+
+
+def synthetic_event_lines(members: int, years: int, start_year: int = 2010, paying_every: int = 1) -> Iterable[str]:
+    """
+    Event log of a club with `members` members joining during the first month and paying their dues every
+    `paying_every` months for `years` years.
+    """
+    yield dsv_record_dump([datetime(start_year, 1, 1), 'setDefaultDue', 100, '']) + "\n"
+    yield dsv_record_dump([datetime(start_year, 1, 1), 'setMaxPrepaidDuesCount', 12, '']) + "\n"
+    for member in range(members):
+        yield dsv_record_dump([datetime(start_year, 1, member % 28 + 1), 'newMember', f"member{member}@example.com",
+                               '']) + "\n"
+    for month in range(1, years * 12):
+        year, month = start_year + month // 12, month % 12 + 1
+        yield dsv_record_dump([datetime(year, month, 1), 'nextMonth', '', '']) + "\n"
+        if month % paying_every:
+            continue
+        for day in range(1, 29):
+            for member in range(day - 1, members, 28):
+                yield dsv_record_dump([datetime(year, month, day), 'transaction',
+                                       f"{100 * paying_every},member{member}@example.com", 'składka']) + "\n"
+
+
+def replay(lines: Iterable[str], lazy_accrual: bool = False):
+    engine = EventEngine(lazy_accrual=lazy_accrual)
+    engine.run(skladkoinator.event_reader(lines))
+    return engine.dues, engine.account_balance
+
+
+def reflective_replay(events: Iterable[Event], handlers: type = EventHandlers):
+    """replay looking handlers up by getattr for every event, as before EventEngine, with eager accrual"""
+    dues, rates, account_balance = {}, HouseRules(), AccountState()
+    for event in events:
+        try:
+            getattr(handlers, event.type, handlers.default)(event, dues, rates, account_balance)
+        except Exception as exc:
+            raise Exception(f"Exception '{exc}' happened during handling of event: {event.as_dsv()}")
+    return dues, account_balance
+
+
+def engine_replay(events: Iterable[Event], handlers: type = EventHandlers, lazy_accrual: bool = False):
+    engine = EventEngine(lazy_accrual=lazy_accrual, handlers=None if handlers is EventHandlers else {
+        name: getattr(handlers, name) for name in skladkoinator.BUILTIN_EVENT_HANDLERS})
+    engine.run(events)
+    return engine.dues, engine.account_balance
+
+
+class NoopEventHandlers:
+    """Handlers doing nothing, replays with them measure the dispatch alone"""
+
+    @staticmethod
+    def default(*_):
+        pass
+
+
+for event_type in skladkoinator.BUILTIN_EVENT_HANDLERS:
+    setattr(NoopEventHandlers, event_type, NoopEventHandlers.default)
+
+
+def best_replay_rate(lines: list, replay_method, repeats: int = 3) -> float:
+    """
+    events/sec of the fastest of `repeats` replays, events are decoded before each one (handlers change their args)
+    """
+    elapsed = []
+    for _ in range(repeats):
+        events = list(skladkoinator.event_reader(lines, lazy=False))
+        gc.collect()
+        start = time.perf_counter()
+        replay_method(events)
+        elapsed.append(time.perf_counter() - start)
+    return len(lines) / min(elapsed)
+
+
+def dict_backed(cls: type) -> type:
+    """Copy of a slotted class keeping its attributes in a per instance __dict__"""
+    namespace = {k: v for k, v in vars(cls).items() if k != '__slots__' and k not in cls.__slots__}
+    return type(cls.__name__, cls.__bases__, namespace)
+
+
+COMPACT_CLASSES = ('Hacker', 'Event', 'Transaction', 'DuesHistoryRecord', 'HackerDues')
+
+
+def use_classes(classes: dict):
+    for module in (data_structures, skladkoinator):
+        for name, cls in classes.items():
+            if hasattr(module, name):
+                setattr(module, name, cls)
+
+
+def memory_benchmark(members: int, years: int, classes: dict) -> (int, int, float):
+    use_classes(classes)
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    state = replay(synthetic_event_lines(members, years))
+    elapsed = time.perf_counter() - start
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del state
+    return retained, peak, elapsed
+
+
+def read_benchmark(lines: list, reader) -> float:
+    start = time.perf_counter()
+    events = sum(1 for _ in reader(lines))
+    return events / (time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    bench_cli_argparse = argparse.ArgumentParser()
+    subparsers = bench_cli_argparse.add_subparsers(dest='benchmark', required=True)
+    memory_cmd_parser = subparsers.add_parser('memory', help="tracemalloc of a replay with compact and dict backed "
+                                                             "data structures")
+    read_cmd_parser = subparsers.add_parser('read', help="events/sec of event_reader compared to the raw dsv scan")
+    replay_cmd_parser = subparsers.add_parser('replay', help="events/sec of replays dispatching by getattr and by "
+                                                             "EventEngine")
+    replay_cmd_parser.add_argument("--repeats", action="store", dest="repeats", type=int, default=3,
+                                   help="replays of each kind, the fastest one is reported")
+    accrual_cmd_parser = subparsers.add_parser('accrual', help="replay time with eager and lazy monthly accrual")
+    accrual_cmd_parser.add_argument("--paying-every", action="store", dest="paying_every", type=int, default=1,
+                                    help="months between payments of a member")
+    partitioned_cmd_parser = subparsers.add_parser('partitioned', help="serial and partitioned replay time")
+    partitioned_cmd_parser.add_argument("-p", action="store", dest="partitions", type=int, default=0,
+                                        help="replaying processes, 0 for all cpus")
+    query_cmd_parser = subparsers.add_parser('query', help="point in time balance lookups of a DuesLedger")
+    query_cmd_parser.add_argument("--queries", action="store", dest="queries", type=int, default=100_000)
+    for cmd_parser in (memory_cmd_parser, read_cmd_parser, replay_cmd_parser, accrual_cmd_parser,
+                       partitioned_cmd_parser, query_cmd_parser):
+        cmd_parser.add_argument("--members", action="store", dest="members", type=int, default=10_000)
+        cmd_parser.add_argument("--years", action="store", dest="years", type=int, default=10)
+    args = bench_cli_argparse.parse_args()
+
+    if args.benchmark == 'memory':
+        compact_classes = {name: getattr(data_structures, name) for name in COMPACT_CLASSES}
+        dict_backed_classes = {name: dict_backed(cls) for name, cls in compact_classes.items()}
+        results = {
+            'dict backed': memory_benchmark(args.members, args.years, dict_backed_classes),
+            'compact': memory_benchmark(args.members, args.years, compact_classes),
+        }
+        for name, (retained, peak, elapsed) in results.items():
+            print(f"{name}: retained {retained / 2 ** 20:,.1f} MiB, peak {peak / 2 ** 20:,.1f} MiB, "
+                  f"replay {elapsed:,.1f}s")
+        reduction = 1 - results['compact'][0] / results['dict backed'][0]
+        print(f"retained memory reduction: {reduction:.1%}")
+
+    elif args.benchmark == 'read':
+        lines = list(synthetic_event_lines(args.members, args.years))
+        readers = {
+            'raw dsv scan': dsv_reader,
+            'eager events': lambda event_lines: skladkoinator.event_reader(event_lines, lazy=False),
+            'lazy events': skladkoinator.event_reader,
+        }
+        for name, reader in readers.items():
+            print(f"{name}: {read_benchmark(lines, reader):,.0f} events/sec")
+
+    elif args.benchmark == 'replay':
+        # events are decoded up front and accrual is eager in both replays, so they differ in the dispatch only
+        lines = list(synthetic_event_lines(args.members, args.years))
+        replays = {
+            'getattr dispatch': reflective_replay,
+            'EventEngine': engine_replay,
+        }
+        for handlers, workload in ((NoopEventHandlers, 'dispatch only'), (EventHandlers, 'eager accrual')):
+            for name, replay_method in replays.items():
+                rate = best_replay_rate(lines, lambda events: replay_method(events, handlers), args.repeats)
+                print(f"{name} ({workload}): {rate:,.0f} events/sec")
+
+    elif args.benchmark == 'accrual':
+        lines = list(synthetic_event_lines(args.members, args.years, paying_every=args.paying_every))
+        for name, lazy_accrual in {'eager accrual': False, 'lazy accrual': True}.items():
+            start = time.perf_counter()
+            dues, _ = replay(lines, lazy_accrual)
+            for hacker_dues in dues.values():
+                hacker_dues.as_dsv()
+            print(f"{name}: replay and dump of {len(lines):,} events in {time.perf_counter() - start:,.2f}s")
+
+    elif args.benchmark == 'partitioned':
+        lines = list(synthetic_event_lines(args.members, args.years))
+        replays = {
+            'serial': lambda engine: engine.run(skladkoinator.event_reader(lines)),
+            'partitioned': lambda engine: partitioned_replay(engine, skladkoinator.event_reader(lines),
+                                                             args.partitions),
+        }
+        for name, replay_method in replays.items():
+            start = time.perf_counter()
+            replay_method(EventEngine())
+            print(f"{name}: replay of {len(lines):,} events in {time.perf_counter() - start:,.2f}s")
+
+    elif args.benchmark == 'query':
+        # sorted by date, as the ledger needs them
+        lines = sorted(synthetic_event_lines(args.members, args.years))
+        start = time.perf_counter()
+        ledger, engine = DuesLedger(), EventEngine()
+        engine.run(ledger.recorded(skladkoinator.event_reader(lines), engine.dues))
+        print(f"replay of {len(lines):,} events recorded in {time.perf_counter() - start:,.2f}s")
+
+        generator = random.Random(0)
+        first_day, last_day = datetime(2010, 1, 1).toordinal(), datetime(2010 + args.years, 1, 1).toordinal()
+        queries = [(f"member{generator.randrange(args.members)}@example.com",
+                    datetime.fromordinal(generator.randint(first_day, last_day))) for _ in range(args.queries)]
+        start = time.perf_counter()
+        for email, date in queries:
+            ledger.balance(email, date)
+        print(f"balance lookups: {args.queries / (time.perf_counter() - start):,.0f}/sec")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Benchmark of matching transactions to hackers in transactions2dues on synthetic members and transfers.
+
+Usage:
+    ./bench_transactions2dues.py [--members N] [--transactions N] [--legacy-sample N]
+
+Misspelled subjects of a tenth of the transactions are matched by HackerFuzzyIndex.
+"""
+import argparse
+import random
+import time
+
+from data_structures import Hacker, Transaction
+from transactions2dues import find_hacker_email, HackerFuzzyIndex, HackerNameIndex
+
+NAMES = ['Jan', 'Anna', 'Piotr', 'Katarzyna', 'Paweł', 'Małgorzata', 'Michał', 'Agnieszka', 'Łukasz', 'Ewa',
+         'Tomasz', 'Joanna', 'Krzysztof', 'Zofia', 'Grzegorz', 'Żaneta']
+LAST_NAME_SYLLABLES = ['kow', 'now', 'wiś', 'wój', 'ka', 'zie', 'lew', 'szym', 'dą', 'bro', 'ło', 'grab', 'pa']
+LAST_NAME_SUFFIXES = ['ski', 'ska', 'ak', 'czyk', 'ek', 'cki', 'wicz']
+
+
+def synthetic_hackers(count: int, generator: random.Random):
+    for i in range(count):
+        last_name = ''.join(generator.choice(LAST_NAME_SYLLABLES) for _ in range(generator.randint(1, 3)))
+        last_name += generator.choice(LAST_NAME_SUFFIXES)
+        yield Hacker(str(i), f"nick{i}", '2015-01-01', f"member{i}@example.com", generator.choice(NAMES),
+                     last_name.title(), 'members')
+
+
+def synthetic_transactions(count: int, hackers: list, generator: random.Random):
+    for i in range(count):
+        payer = generator.choice(hackers)
+        subject = f"składka członkowska {payer.name} {payer.last_name}"
+        address = f"{payer.name.upper()} {payer.last_name.upper()} UL. DŁUGA {i % 100} 80-001 GDAŃSK"
+        if i % 10 == 0:
+            subject, address = "Faktura 123/2020", "Graffic Services sp. z o.o."
+        yield Transaction('2020-01-01', str(i), '', subject, address, '100.00', 'PLN', 'Credit')
+
+
+def misspelled(transaction: Transaction, generator: random.Random) -> Transaction:
+    """The transaction with a letter of the subject dropped and the address cleared"""
+    position = generator.randrange(len("składka członkowska "), len(transaction.subject))
+    subject = transaction.subject[:position] + transaction.subject[position + 1:]
+    return Transaction(transaction.date, transaction.extra_details, '', subject, '', transaction.amount,
+                       transaction.currency, transaction.transaction_type)
+
+
+if __name__ == "__main__":
+    bench_cli_argparse = argparse.ArgumentParser()
+    bench_cli_argparse.add_argument("--members", action="store", dest="members", type=int, default=5_000)
+    bench_cli_argparse.add_argument("--transactions", action="store", dest="transactions", type=int, default=500_000)
+    bench_cli_argparse.add_argument("--legacy-sample", action="store", dest="legacy_sample", type=int, default=2_000,
+                                    help="transactions matched by find_hacker_email, it's too slow for all of them")
+    args = bench_cli_argparse.parse_args()
+
+    generator = random.Random(0)
+    hackers = list(synthetic_hackers(args.members, generator))
+    transactions = list(synthetic_transactions(args.transactions, hackers, generator))
+
+    start = time.perf_counter()
+    hacker_name_index = HackerNameIndex(hackers)
+    print(f"index of {args.members:,} members built in {time.perf_counter() - start:,.2f}s")
+    start = time.perf_counter()
+    emails = list(map(hacker_name_index.find_email, transactions))
+    elapsed = time.perf_counter() - start
+    print(f"HackerNameIndex: {args.transactions:,} transactions in {elapsed:,.2f}s, "
+          f"{args.transactions / elapsed:,.0f}/sec")
+
+    sample = transactions[:args.legacy_sample]
+    start = time.perf_counter()
+    legacy_emails = list(map(lambda t: find_hacker_email(t, hackers), sample))
+    elapsed = time.perf_counter() - start
+    print(f"find_hacker_email: {len(sample):,} transactions in {elapsed:,.2f}s, {len(sample) / elapsed:,.0f}/sec, "
+          f"about {args.transactions * elapsed / len(sample):,.0f}s for all")
+    assert legacy_emails == emails[:len(sample)], "HackerNameIndex and find_hacker_email found different hackers"
+
+    misspelled_transactions = [misspelled(t, generator) for t, email in zip(transactions, emails) if email]
+    misspelled_transactions = misspelled_transactions[:args.transactions // 10]
+    start = time.perf_counter()
+    hacker_fuzzy_index = HackerFuzzyIndex(hackers)
+    print(f"fuzzy index of {args.members:,} members built in {time.perf_counter() - start:,.2f}s")
+    start = time.perf_counter()
+    fuzzy_emails = list(map(lambda t: hacker_fuzzy_index.find(t)[0], misspelled_transactions))
+    elapsed = time.perf_counter() - start
+    print(f"HackerFuzzyIndex: {len(misspelled_transactions):,} misspelled transactions in {elapsed:,.2f}s, "
+          f"{len(misspelled_transactions) / elapsed:,.0f}/sec, {sum(map(bool, fuzzy_emails)):,} matched")
@@ -0,0 +1,162 @@
+import re
+import sys
+from typing import Iterable, List, Optional, Sequence
+
+from data_structures import Transaction, TransactionClassification
+from dsv import dsv_reader
+
+
+class ClassificationRuleException(Exception):
+    pass
+
+
+def normalize_account(account: str) -> str:
+    return ''.join((account or '').split())
+
+
+AMOUNT_SIGNS = ('', '+', '-')
+
+
+class ClassificationRule:
+    """
+    A transaction matches a rule when its subject and contractor address contain the rule's regexes, its amount has the
+    rule's sign and it came from one of the rule's accounts. Empty fields of a rule match every transaction.
+
+    Rules are kept in dsv files of `classification;subject;amount sign;accounts;contractor` records, where
+    classification is a TransactionClassification value, amount sign is '+', '-' or empty and accounts are comma
+    separated.
+    """
+    __slots__ = ('classification', 'subject', 'amount_sign', 'accounts', 'contractor')
+
+    def __init__(self, classification: TransactionClassification, subject: str = '', amount_sign: str = '',
+                 accounts: Iterable[str] = (), contractor: str = ''):
+        if amount_sign not in AMOUNT_SIGNS:
+            raise ClassificationRuleException(f"invalid amount sign {amount_sign!r} of {classification.value} rule")
+        for pattern in (subject, contractor):
+            try:
+                re.compile(pattern)
+            except re.error as e:
+                raise ClassificationRuleException(f"invalid regex {pattern!r} of {classification.value} rule") from e
+        self.classification = classification
+        self.subject = subject
+        self.amount_sign = amount_sign
+        self.accounts = frozenset(filter(None, map(normalize_account, accounts)))
+        self.contractor = contractor
+
+    @classmethod
+    def from_dsv(cls, record: List[str]):
+        classification, subject, amount_sign, accounts, contractor = (record + [''] * 4)[:5]
+        try:
+            classification = TransactionClassification(classification)
+        except ValueError as e:
+            raise ClassificationRuleException(f"unknown classification {classification!r}") from e
+        return cls(classification, subject, amount_sign, accounts.split(','), contractor)
+
+    def as_dsv(self) -> List[str]:
+        return [self.classification.value, self.subject, self.amount_sign, ','.join(sorted(self.accounts)),
+                self.contractor]
+
+
+DEFAULT_CLASSIFICATION_RULES = (
+    ClassificationRule(TransactionClassification.DUE, subject='sk.adka?'),
+    ClassificationRule(TransactionClassification.OTHER_OUTCOME, amount_sign='-'),
+    ClassificationRule(TransactionClassification.OTHER_INCOME, amount_sign='+'),
+)
+
+
+def load_classification_rules(data_source: Iterable[str]) -> List[ClassificationRule]:
+    return list(map(ClassificationRule.from_dsv, filter(None, dsv_reader(data_source))))
+
+
+def combined_regex(patterns: Sequence[str]):
+    """
+    A regex matching every text, with the group `r<i>` set when the text contains patterns[i]. Each pattern is
+    searched by a lookahead from the start of the text, so one match tells which of the patterns the text contains.
+    """
+    return re.compile(''.join(f"(?:(?=.*?(?:{pattern}))(?P<r{i}>))?" for i, pattern in enumerate(patterns)),
+                      re.IGNORECASE | re.DOTALL)
+
+
+def rules_regex(rules: Sequence[ClassificationRule], field: str):
+    """
+    Sorted distinct `field` patterns of rules and their combined_regex. A pattern valid alone may break the combined
+    regex, like one with a global inline flag, the exception names the first rule whose pattern does.
+    """
+    patterns = sorted(set(getattr(rule, field) for rule in rules if getattr(rule, field)))
+    try:
+        return patterns, combined_regex(patterns)
+    except re.error as e:
+        error = e
+    for end in range(1, len(patterns) + 1):
+        try:
+            combined_regex(patterns[:end])
+        except re.error as e:
+            error = e
+            break
+    rule = next(rule for rule in rules if getattr(rule, field) == patterns[end - 1])
+    raise ClassificationRuleException(f"regex {patterns[end - 1]!r} of {rule.classification.value} rule breaks the "
+                                      f"combined {field} regex: {error}") from error
+
+
+class TransactionClassifier:
+    """
+    Classification of transactions by the first rule they match, UNKNOWN with a warning when there is none. Subject and
+    contractor regexes of all rules are compiled into one regex each, so a transaction is matched against them in
+    two passes, whatever the number of rules. Regexes are case insensitive.
+    """
+
+    def __init__(self, rules: Sequence[ClassificationRule] = DEFAULT_CLASSIFICATION_RULES):
+        self.rules = list(rules)
+        subjects, self.subject_regex = rules_regex(self.rules, 'subject')
+        contractors, self.contractor_regex = rules_regex(self.rules, 'contractor')
+        # (classification, subject group, amount sign, accounts, contractor group) of rules, None fields match all
+        self.table = []
+        for rule in self.rules:
+            subject_group = self.subject_regex.groupindex[f"r{subjects.index(rule.subject)}"] if rule.subject else None
+            contractor_group = self.contractor_regex.groupindex[f"r{contractors.index(rule.contractor)}"] \
+                if rule.contractor else None
+            self.table.append((rule.classification, subject_group, rule.amount_sign or None, rule.accounts or None,
+                               contractor_group))
+        self.match_contractor = bool(contractors)
+        self.match_account = any(rule.accounts for rule in self.rules)
+
+    def match(self, transaction: Transaction) -> Optional[TransactionClassification]:
+        """Classification of the first rule matching the transaction, None when there is none"""
+        subject = self.subject_regex.match(transaction.subject or '')
+        contractor = self.contractor_regex.match(transaction.contractor_address or '') \
+            if self.match_contractor else None
+        account = normalize_account(transaction.contractor_account_number) if self.match_account else None
+        amount = transaction.amount
+        sign = '+' if amount is not None and amount > 0 else '-' if amount is not None and amount < 0 else ''
+        for classification, subject_group, amount_sign, accounts, contractor_group in self.table:
+            if subject_group is not None and subject.group(subject_group) is None:
+                continue
+            if amount_sign is not None and amount_sign != sign:
+                continue
+            if accounts is not None and account not in accounts:
+                continue
+            if contractor_group is not None and contractor.group(contractor_group) is None:
+                continue
+            return classification
+        return None
+
+    def classify(self, transaction: Transaction) -> TransactionClassification:
+        classification = self.match(transaction)
+        if classification is None:
+            sys.stderr.write(f"cannot classify transaction: {transaction}\n")
+            return TransactionClassification.UNKNOWN
+        return classification
+
+    def is_due(self, transaction: Transaction) -> bool:
+        return self.match(transaction) is TransactionClassification.DUE
+
+
+def transaction_classifier(rules_path: Optional[str] = None) -> TransactionClassifier:
+    """Classifier of rules from the dsv file at `rules_path`, of DEFAULT_CLASSIFICATION_RULES without it"""
+    if rules_path is None:
+        return TransactionClassifier()
+    with open(rules_path, encoding='utf-8') as rules_file:
+        return TransactionClassifier(load_classification_rules(rules_file))
+
+
+DEFAULT_TRANSACTION_CLASSIFIER = TransactionClassifier()
@@ -1,74 +1,209 @@
 #!/usr/bin/env python3
+import os
 from datetime import datetime, date
 from decimal import Decimal
+from hashlib import sha256
 
-from data_structures import Transaction, TransactionClassification
-from dsv import dsv_reader, dsv_record_dump
-from transactions2dues import is_due
+from data_structures import parse_datetime, Transaction, TransactionClassification
+from dsv import dsv_reader, dsv_record_load, DsvWriter
+from transactions2dues import parse_transactions
+from classification_rules import DEFAULT_TRANSACTION_CLASSIFIER, transaction_classifier, TransactionClassifier
+from monthly_totals import MonthlyTotals, PERIODS
 from collections import OrderedDict
-from typing import Iterable
+from typing import Dict, Iterable, List, Optional, Tuple
 
 
-def ERR(msg):
-    raise Exception(msg)
+class ClassificatorStateException(Exception):
+    pass
 
 
-def WARN(msg):
-    sys.stderr.write(msg)
-    sys.stderr.write("\n")
-
-
-classificators = OrderedDict([
-    (TransactionClassification.DUE, is_due),
-
-    (TransactionClassification.OTHER_OUTCOME, lambda t: t.amount < 0),
-    (TransactionClassification.OTHER_INCOME, lambda t: t.amount > 0),
-    (TransactionClassification.UNKNOWN, lambda t: WARN(f"cannot classify transaction: {t}"))
-
-])
+# fields read by the classification rules and the monthly report
+CLASSIFIED_FIELDS = ('date', 'contractor_account_number', 'subject', 'contractor_address', 'amount')
 
 
 def year_month(dt: datetime) -> date:
     return date(dt.year, dt.month, 1)
 
 
-def classify_transaction(transaction: Transaction) -> (date, TransactionClassification, Decimal):
-    for classification, classificator in classificators.items():
-        if classificator(transaction):
-            return year_month(transaction.date), classification, transaction.amount
-    ERR(f"no classificator matched transaction: {transaction}")
+def classify_transaction(transaction: Transaction, classifier: TransactionClassifier = DEFAULT_TRANSACTION_CLASSIFIER
+                         ) -> (date, TransactionClassification, Decimal):
+    return year_month(transaction.date), classifier.classify(transaction), transaction.amount
 
 
-def generate_monthly_report(transactions: Iterable[Transaction]):
-    monthly_report = OrderedDict()
-    for month, classification, amount in map(classify_transaction, transactions):
-        if month not in monthly_report:
-            monthly_report[month] = {}
-        if classification not in monthly_report[month]:
-            monthly_report[month][classification] = 0
-        monthly_report[month][classification] += amount
+def generate_monthly_report(transactions: Iterable[Transaction],
+                            classifier: TransactionClassifier = DEFAULT_TRANSACTION_CLASSIFIER):
+    return MonthlyTotals(map(lambda t: classify_transaction(t, classifier), transactions)).report()
 
-    return monthly_report
 
+def monthly_details_as_dsv(totals: dict) -> str:
+    details = ""
+    for classification, amount in totals.items():
+        details += f"{classification.value}={amount},"
+    return details
 
-def monthly_report_as_dsv(report: dict):
-    for month in sorted(report.keys()):
-        details = ""
-        for classification, amount in report[month].items():
-            details += f"{classification.value}={amount},"
-        month_data = [
-            month.isoformat(),
-            details
-        ]
-        yield dsv_record_dump(month_data)
-        yield "\n"
 
+def monthly_report_as_dsv(report: dict, last: int = None):
+    """Records of periods of the report, with `last` only of that many last periods, the latest one first"""
+    periods = sorted(report.keys())
+    if last is not None:
+        periods = periods[:-last - 1:-1] if last else []
+    for period in periods:
+        yield [
+            str(period),
+            monthly_details_as_dsv(report[period])
+        ]
 
-def classificator_main(input_file, output_file):
-    transactions = map(lambda record: Transaction(*record), dsv_reader(input_file))
-    monthly_report = generate_monthly_report(transactions)
 
-    output_file.writelines(monthly_report_as_dsv(monthly_report))
+def monthly_details(details: str) -> dict:
+    """Totals of classifications of a month from the details of monthly_report_as_dsv"""
+    totals = {}
+    for total in filter(None, details.split(',')):
+        classification, amount = total.split('=')
+        totals[TransactionClassification(classification)] = Decimal(amount)
+    return totals
+
+
+def rules_fingerprint(classifier: TransactionClassifier) -> str:
+    return sha256('\n'.join(map(lambda rule: repr(rule.as_dsv()), classifier.rules)).encode('utf-8')).hexdigest()
+
+
+class MonthlyReportState:
+    """
+    Totals of months of a monthly report along with digests of the transactions they were classified from, the
+    fingerprint of classification rules and the watermark, the month of the last transaction. Saved as a dsv file of
+    records tagged by their first value:
+
+        classificator state;<version>
+        rules;<fingerprint>
+        watermark;<month of the last transaction>
+        month;<month>;<sha256>;<classification>=<amount>,...
+    """
+    HEADER = ['classificator state', '1']
+
+    def __init__(self, rules: str = '', watermark: Optional[date] = None, months: Dict[date, Tuple[str, dict]] = None):
+        self.rules = rules
+        self.watermark = watermark
+        self.months = months if months is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as state_file:
+            records = list(filter(None, dsv_reader(state_file)))
+        if not records or records[0] != cls.HEADER:
+            raise ClassificatorStateException(f"not a classificator state: {path}")
+        state = cls()
+        for record in records[1:]:
+            kind, values = record[0], record[1:] + ['', '', '']
+            if kind == 'rules':
+                state.rules = values[0]
+            elif kind == 'watermark':
+                state.watermark = year_month(parse_datetime(values[0])) if values[0] else None
+            elif kind == 'month':
+                state.months[parse_datetime(values[0]).date()] = (values[1], monthly_details(values[2]))
+        return state
+
+    def dump(self) -> Iterable[list]:
+        yield self.HEADER
+        yield ['rules', self.rules]
+        yield ['watermark', self.watermark.isoformat() if self.watermark else '']
+        for month, (digest, totals) in sorted(self.months.items()):
+            yield ['month', month.isoformat(), digest, monthly_details_as_dsv(totals)]
+
+    def save(self, path):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as state_file, DsvWriter(state_file) as writer:
+                writer.writerows(self.dump())
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+    def report(self) -> OrderedDict:
+        return OrderedDict((month, totals) for month, (_, totals) in sorted(self.months.items()))
+
+
+def transaction_months(data_source: Iterable[str], start: str = '') -> Iterable[Tuple[date, str, List[str]]]:
+    """
+    (month, sha256 of lines, lines) of transactions of each month of lines sorted by date, one month at a time, only
+    dates of transactions are parsed. Lines of dates before `start`, an ISO date, are skipped without parsing them.
+    """
+    month, digest, lines = None, None, []
+    for line in data_source:
+        if not line.strip():
+            continue
+        if line < start:
+            if month is not None:
+                raise ClassificatorStateException(f"transactions aren't sorted by date: {line.strip()}")
+            continue
+        line_month = year_month(parse_datetime(dsv_record_load(line, columns=(0,))[0]))
+        if line_month != month:
+            if month is not None:
+                if line_month < month:
+                    raise ClassificatorStateException(f"transactions aren't sorted by date: {line.strip()}")
+                yield month, digest.hexdigest(), lines
+            month, digest, lines = line_month, sha256(), []
+        digest.update(line.strip().encode('utf-8') + b'\n')
+        lines.append(line)
+    if month is not None:
+        yield month, digest.hexdigest(), lines
+
+
+def incremental_monthly_report(data_source: Iterable[str], state: MonthlyReportState,
+                               classifier: TransactionClassifier = DEFAULT_TRANSACTION_CLASSIFIER
+                               ) -> MonthlyReportState:
+    """
+    State of the monthly report of transaction lines of `data_source`, the whole history of transactions sorted by
+    date, like the output of parse_transactions.sh. The history is expected to only grow: lines of months before the
+    watermark of `state` are skipped without parsing them and their totals are kept. Months from the watermark on are
+    hashed, one at a time, and only transactions of months that aren't in `state` with the same digest are parsed and
+    classified. All months are when the classification rules have changed.
+    """
+    rules = rules_fingerprint(classifier)
+    known_months = state.months if state.rules == rules else {}
+    start = state.watermark if known_months else None
+    updated = MonthlyReportState(rules)
+    if start is not None:
+        updated.months = {month: known for month, known in known_months.items() if month < start}
+    for month, digest, lines in transaction_months(data_source, start.isoformat() if start is not None else ''):
+        if month in known_months and known_months[month][0] == digest:
+            updated.months[month] = known_months[month]
+        else:
+            transactions = parse_transactions(lines, fields=CLASSIFIED_FIELDS)
+            updated.months[month] = (digest, generate_monthly_report(transactions, classifier)[month])
+    updated.watermark = max(updated.months, default=None)
+    return updated
+
+
+def load_monthly_report(data_source: Iterable[str]) -> OrderedDict:
+    """Monthly report from the records of monthly_report_as_dsv"""
+    report = OrderedDict()
+    for month, details in map(lambda record: (record + [''])[:2], filter(None, dsv_reader(data_source))):
+        report[parse_datetime(month).date()] = monthly_details(details)
+    return report
+
+
+def classificator_main(input_file, output_file, workers: int = 1, rules_path=None, state_path=None,
+                       period: str = 'month', last: int = None, monthly_report_input: bool = False):
+    """
+    Report of totals of classifications of transactions of `input_file` by `period`, see MonthlyTotals.report. With
+    `monthly_report_input` the input file is a monthly report instead of transactions.
+    """
+    if monthly_report_input:
+        monthly_report = load_monthly_report(input_file)
+    elif state_path is not None:
+        classifier = transaction_classifier(rules_path)
+        state = MonthlyReportState.load(state_path) if os.path.exists(state_path) else MonthlyReportState()
+        state = incremental_monthly_report(input_file, state, classifier)
+        state.save(state_path)
+        monthly_report = state.report()
+    else:
+        transactions = parse_transactions(input_file, fields=CLASSIFIED_FIELDS, workers=workers)
+        monthly_report = generate_monthly_report(transactions, transaction_classifier(rules_path))
+    report = monthly_report if period == 'month' else MonthlyTotals.from_report(monthly_report).report(period)
+
+    with DsvWriter(output_file) as writer:
+        writer.writerows(monthly_report_as_dsv(report, last))
 
 
 if __name__ == "__main__":
@@ -78,8 +213,24 @@ if __name__ == "__main__":
     hacker_cli_argparse = argparse.ArgumentParser()
     hacker_cli_argparse.add_argument("-if", action="store", dest="input_file", default="-", required=False)
     hacker_cli_argparse.add_argument("-of", action="store", dest="output_file", default="-", required=False)
+    hacker_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=1, required=False,
+                                     help="processes parsing the input file, 0 for all cpus, 1 parses it serially, "
+                                          "not used with --state")
+    hacker_cli_argparse.add_argument("--rules", action="store", dest="rules_file", default=None, required=False,
+                                     help="dsv file of transaction classification rules, see ClassificationRule")
+    hacker_cli_argparse.add_argument("--state", action="store", dest="state_file", default=None, required=False,
+                                     help="file of monthly totals, input transactions have to be sorted by date and "
+                                          "only months from the last one of the previous run are read again")
+    hacker_cli_argparse.add_argument("--period", action="store", dest="period", choices=PERIODS, default="month",
+                                     required=False, help="totals of months, quarters, years or rolling months")
+    hacker_cli_argparse.add_argument("--last", action="store", dest="last", type=int, default=None, required=False,
+                                     help="only the last periods, the latest one first")
+    hacker_cli_argparse.add_argument("--monthly-report", action="store_true", dest="monthly_report_input",
+                                     default=False, required=False,
+                                     help="the input file is a monthly report instead of transactions")
 
     args = hacker_cli_argparse.parse_args()
     input_file = sys.stdin if args.input_file == '-' else open(args.input_file)
     output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
-    classificator_main(input_file, output_file)
+    classificator_main(input_file, output_file, args.workers, args.rules_file, args.state_file, args.period, args.last,
+                       args.monthly_report_input)
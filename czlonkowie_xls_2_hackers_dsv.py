@@ -1,4 +1,4 @@
-from dsv import dsv_reader, dsv_generator
+from dsv import dsv_reader, DsvWriter
 from sys import stdout, stderr, stdin
 r=dsv_reader(stdin, delimiter=',')
 c=list(r)[1:]
@@ -23,7 +23,7 @@ pm = filter(lambda m: m[source_fields.index('membership_declaration')].strip()!=
 hackers=[]
 for m in pm:
     kwargs=dict()
-    for f in Hacker.fields:
+    for f in Hacker.columns:
         try:
             kwargs[f] = m[source_fields.index(f)]
         except (ValueError, IndexError):
@@ -34,4 +34,5 @@ for m in pm:
     if hackers[-1].entry_date == None:
         stderr.write(f"missing entry date for \"{hackers[-1].as_dsv()}\"\n")
 
-stdout.writelines(dsv_generator(hackers))
\ No newline at end of file
+with DsvWriter(stdout) as writer:
+    writer.writerows(hackers)
@@ -1,7 +1,9 @@
+import copy
+import sys
 from datetime import datetime
 from decimal import Decimal
 from enum import Enum
-from functools import reduce
+from functools import lru_cache, reduce
 from typing import AnyStr, List
 from dataclasses import dataclass
 from datetime import datetime
@@ -9,8 +11,16 @@ from datetime import datetime
 from dsv import dsv_record_dump, dsv_record_load
 
 
+@lru_cache(maxsize=1 << 14)
+def parse_datetime(date: str) -> datetime:
+    """datetime.fromisoformat caching results, dates repeat a lot in event logs and statements"""
+    return datetime.fromisoformat(date)
+
+
 class Hacker:
-    fields = {'hid', 'nick', 'entry_date', 'email', 'name', 'last_name', 'groups'}
+    __slots__ = ('hid', 'nick', 'entry_date', 'email', 'name', 'last_name', 'groups')
+    # fields in the order of dsv columns and of constructor arguments
+    columns = __slots__
 
     def __init__(self, hid: str, nick: str, entry_date: str, email: str, name: str, last_name: str, groups: [set, str]):
         self.hid = hid
@@ -30,12 +40,49 @@ class Hacker:
 
 
 class Event:
+    __slots__ = ('_date', 'type', '_args', '_args_str', 'comment')
+
     def __init__(self, date: [str or datetime], type: str, args_str: str, comment: str = None):
-        self.date = date if isinstance(date, datetime) else datetime.fromisoformat(date)
-        self.type = type
-        self.args = list(map(lambda arg: arg.strip(), args_str.split(',')))
+        self._date = date if isinstance(date, datetime) else parse_datetime(date)
+        self.type = sys.intern(type)
+        self._args = list(map(lambda arg: arg.strip(), args_str.split(',')))
+        self._args_str = None
         self.comment = comment or ''
 
+    @classmethod
+    def lazy(cls, date: [str or datetime], type: str, args_str: str, comment: str = None):
+        """
+        Event keeping its raw fields, the date is parsed (and cached) on first access to `date` and args are split
+        on first access to `args`.
+        """
+        event = cls.__new__(cls)
+        event._date = date
+        event.type = sys.intern(type)
+        event._args = None
+        event._args_str = args_str
+        event.comment = sys.intern(comment) if comment else ''
+        return event
+
+    @property
+    def date(self) -> datetime:
+        if isinstance(self._date, str):
+            self._date = parse_datetime(self._date)
+        return self._date
+
+    @property
+    def args(self) -> List[str]:
+        if self._args is None:
+            self._args = list(map(lambda arg: arg.strip(), self._args_str.split(',')))
+            self._args_str = None
+        return self._args
+
+    def with_args(self, args: List[str]):
+        """Copy of the event with other args"""
+        event = copy.copy(self)
+        event._args = list(args)
+        event._args_str = None
+        return event
+
     def as_dsv(self):
         return dsv_record_dump([
             self.date, self.type, ','.join(self.args), self.comment
@@ -69,15 +116,20 @@ class HouseRules:
 
 @dataclass(frozen=True, order=True)
 class DuesHistoryRecord:
+    __slots__ = ('date', 'dues_balance', 'transaction_amount')
     date: datetime
     dues_balance: Decimal
     transaction_amount: Decimal
 
     def __init__(self, date, dues_balance: Decimal, transaction_amount: Decimal):
-        object.__setattr__(self, 'date', date if isinstance(date, datetime) else datetime.fromisoformat(date))
+        object.__setattr__(self, 'date', date if isinstance(date, datetime) else parse_datetime(date))
         object.__setattr__(self, 'transaction_amount',  transaction_amount)
         object.__setattr__(self, 'dues_balance', dues_balance)
 
+    def __reduce__(self):
+        # frozen, so it cannot be restored by setting the slots one by one
+        return self.__class__, (self.date, self.dues_balance, self.transaction_amount)
+
     def as_dsv(self, delimiter=';') -> str:
         return dsv_record_dump([self.date, self.transaction_amount, self.dues_balance], delimiter=delimiter)
 
@@ -87,15 +139,33 @@ class DuesHistoryRecord:
 
 
 class HackerDues:
-    balance = Decimal(0)
-    email = None
-    dues_history: List[DuesHistoryRecord] = None
+    """
+    Dues balance of a hacker. With an accrual `clock` attached (see skladkoinator.AccrualClock) monthly charges are
+    applied to the balance when it's read, `accrued` is the number of clock months already applied.
+    """
+    __slots__ = ('entry_date', '_balance', 'email', 'dues_history', 'clock', 'accrued')
+    dues_history: List[DuesHistoryRecord]
 
     def __init__(self, entry_date: datetime, email: AnyStr, balance: Decimal = 0):
         self.entry_date = entry_date
-        self.balance = balance
+        self._balance = balance
         self.email = email
         self.dues_history = []
+        self.clock = None
+        self.accrued = 0
+
+    @property
+    def balance(self):
+        if self.clock is not None and self.accrued < self.clock.month:
+            self._balance = self.clock.charge(self._balance, self.entry_date, self.accrued)
+            self.accrued = self.clock.month
+        return self._balance
+
+    @balance.setter
+    def balance(self, balance):
+        if self.clock is not None:
+            self.accrued = self.clock.month
+        self._balance = balance
 
     def __str__(self):
         return f"{self.__class__.__name__}(email={self.email}, balance={self.balance})"
@@ -135,6 +205,8 @@ class AccountState:
 
 @dataclass(order=True)
 class Transaction:
+    __slots__ = ('date', 'extra_details', 'contractor_account_number', 'subject', 'contractor_address', 'amount',
+                 'currency', 'transaction_type')
     date: datetime
     extra_details: str
     contractor_account_number: str
@@ -143,14 +215,20 @@ class Transaction:
     amount: Decimal
     currency: str
     transaction_type: str
-
-    def __init__(self, date, extra_details, contractor_account_number, subject, contractor_address, amount, currency, transaction_type ):
-        self.date = date if isinstance(date, datetime) else datetime.fromisoformat(date)
+    columns = __slots__
+
+    def __init__(self, date=None, extra_details=None, contractor_account_number=None, subject=None,
+                 contractor_address=None, amount=None, currency=None, transaction_type=None):
+        """
+        All fields are required for a transaction read from a statement, fields left as None mark a transaction
+        loaded only partially (see dsv_reader columns).
+        """
+        self.date = date if date is None or isinstance(date, datetime) else parse_datetime(date)
         self.extra_details = extra_details
         self.contractor_account_number = contractor_account_number
         self.subject = subject
         self.contractor_address = contractor_address
-        self.amount = Decimal(amount)
+        self.amount = amount if amount is None else Decimal(amount)
         self.currency = currency
         self.transaction_type = transaction_type
 
@@ -1,8 +1,32 @@
-from typing import List, Iterable
+import io
+import mmap
+import os
+import re
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Iterable, Sequence
+
+
+ESCAPE_SEQUENCES = {
+    'a': '\a',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+    'v': '\v'
+}
+
+
+@lru_cache(maxsize=None)
+def dsv_escape_table(delimiter=';'):
+    return str.maketrans({delimiter: '\\' + delimiter, '\n': '\\n', '\\': '\\\\'})
 
 
 def dsv_escape(string, delimiter=';'):
-    return str(string).replace('\\', '\\\\').replace('\n', '\\n').replace(delimiter, f'\{delimiter}')
+    return str(string).translate(dsv_escape_table(delimiter))
 
 
 def dsv_record_dump(elements, delimiter=';'):
@@ -10,15 +34,6 @@ def dsv_record_dump(elements, delimiter=';'):
 
 
 def dsv_value_load(line, delimiter=';'):
-    escape_sequences = {
-        'a': '\a',
-        'b': '\b',
-        'f': '\f',
-        'n': '\n',
-        'r': '\r',
-        't': '\t',
-        'v': '\v'
-    }
     escape=False
     offset=0
     value=''
@@ -26,7 +41,7 @@ def dsv_value_load(line, delimiter=';'):
         c = line[offset]
         offset+=1
         if escape:
-            value += escape_sequences.get(c, c)
+            value += ESCAPE_SEQUENCES.get(c, c)
             escape = False
         elif c=='\\':
             escape=True
@@ -37,26 +52,310 @@ def dsv_value_load(line, delimiter=';'):
     return value, offset
 
 
-def dsv_record_load(line, delimiter=';'):
-    line=line.strip()
+@lru_cache(maxsize=None)
+def dsv_tokenizer(delimiter=';'):
+    """
+    Regex matching everything that ends a chunk of plain text in a dsv record: an escape sequence (the escaped
+    character is captured, empty for a trailing backslash) or a delimiter (nothing is captured).
+    """
+    return re.compile(r'\\(.?)|' + re.escape(delimiter), re.DOTALL)
+
+
+def dsv_escaped_record_load(line, delimiter=';', values_limit: int = None):
+    """
+    Parse a stripped record containing escape sequences in a single scan, plain text between the escape sequences
+    and delimiters is copied by slicing. With `values_limit` the scan stops after that many values.
+    """
+    record = []
+    value = []
+    value_start = 0
     offset = 0
-    parsed = []
-    while offset < len(line):
-        value, parsed_chars = dsv_value_load(line[offset:], delimiter)
-        offset += parsed_chars
-        parsed.append(value)
-    return parsed
+    for token in dsv_tokenizer(delimiter).finditer(line):
+        value.append(line[offset:token.start()])
+        offset = token.end()
+        escaped = token.group(1)
+        if escaped is None:
+            record.append(''.join(value))
+            if len(record) == values_limit:
+                return record
+            value = []
+            value_start = offset
+        else:
+            value.append(ESCAPE_SEQUENCES.get(escaped, escaped))
+    if value_start < len(line):
+        value.append(line[offset:])
+        record.append(''.join(value))
+    return record
+
 
+def dsv_record_project(line, columns: Sequence[int], delimiter=';'):
+    """
+    Load only values from `columns` of a stripped record, in the order of `columns`. The line isn't scanned past the
+    last requested value, values missing in the record are empty.
+    """
+    values_count = max(columns) + 1
+    record = line.split(delimiter, values_count)
+    scanned_length = len(line) - len(record[-1]) if len(record) > values_count else len(line)
+    if line.find('\\', 0, scanned_length) != -1:
+        record = dsv_escaped_record_load(line, delimiter, values_count)
+    return [record[column] if column < len(record) else '' for column in columns]
+
+
+def dsv_record_load(line, delimiter=';', columns: Sequence[int] = None):
+    line=line.strip()
+    if columns is not None:
+        return dsv_record_project(line, columns, delimiter)
+    if '\\' in line:
+        return dsv_escaped_record_load(line, delimiter)
+    if not line:
+        return []
+    record = line.split(delimiter)
+    if not record[-1]:
+        # a trailing delimiter doesn't start a new value
+        record.pop()
+    return record
 
-def dsv_reader(data_source: Iterable[str], delimiter=';') -> Iterable[List[str]]:
+
+def dsv_reader(data_source: Iterable[str], delimiter=';', columns: Sequence[int] = None) -> Iterable[List[str]]:
+    if columns is not None:
+        columns = list(columns)
+        return map(lambda l: dsv_record_project(l.strip(), columns, delimiter), data_source)
     return map(lambda l: dsv_record_load(l, delimiter), data_source)
 
 
-def interleave_list_with_element(the_list: Iterable, element):
-    for list_element in the_list:
-        yield list_element
-        yield element
+DSV_CHUNK_SIZE = 4 << 20
+
+
+def dsv_chunks(path, chunk_size: int = DSV_CHUNK_SIZE) -> Iterable[tuple]:
+    """
+    (start, end) byte ranges of about `chunk_size` covering the file. Dumped values never contain a raw newline, so
+    ranges end right after a newline and every record belongs to exactly one of them.
+    """
+    with open(path, 'rb') as data_file:
+        size = os.fstat(data_file.fileno()).st_size
+        if size == 0:
+            return
+        with mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            start = 0
+            while start < size:
+                end = data.find(b'\n', min(start + chunk_size, size) - 1) + 1 or size
+                yield start, end
+                start = end
+
+
+def dsv_chunk_load(path, start: int, end: int, delimiter=';', columns: Sequence[int] = None) -> List[List[str]]:
+    with open(path, 'rb') as data_file:
+        data_file.seek(start)
+        data = data_file.read(end - start)
+    # decoded like a file opened in text mode, including universal newlines
+    return list(dsv_reader(io.TextIOWrapper(io.BytesIO(data)), delimiter, columns))
+
+
+def parallel_dsv_reader(path, workers: int = None, delimiter=';', columns: Sequence[int] = None,
+                        chunk_size: int = DSV_CHUNK_SIZE) -> Iterable[List[str]]:
+    """
+    dsv_reader of a file parsed in chunks by a pool of `workers` processes (all cpus by default). Records are
+    returned in the file order, at most two chunks per worker are parsed ahead of the consumer.
+    """
+    workers = workers or os.cpu_count()
+    columns = None if columns is None else list(columns)
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for start, end in dsv_chunks(path, chunk_size):
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().result()
+            pending.append(executor.submit(dsv_chunk_load, path, start, end, delimiter, columns))
+        while pending:
+            yield from pending.popleft().result()
+
+
+def dsv_file_reader(data_source: Iterable[str], delimiter=';', columns: Sequence[int] = None,
+                    workers: int = 1) -> Iterable[List[str]]:
+    """
+    dsv_reader of an opened file, parallel_dsv_reader is used when more than one worker is requested and the file
+    is a regular file (not a pipe or stdin). Workers ship parsed records back to the calling process, which costs
+    more than parsing them on a single cpu, so the default of one worker parses serially.
+    """
+    path = getattr(data_source, 'name', None)
+    if workers != 1 and isinstance(path, str) and os.path.isfile(path):
+        return parallel_dsv_reader(path, workers, delimiter, columns)
+    return dsv_reader(data_source, delimiter, columns)
+
+
+DSV_WRITER_BUFFER_SIZE = 1 << 20
+
+
+class DsvWriter:
+    """
+    Buffered dsv output. Records are collected and written in chunks of about `buffer_size` characters, one record
+    per line. A record can be an object with an `as_dsv` method (or the method given in `method`), an already dumped
+    record or a list of fields.
+    """
+
+    def __init__(self, output_file, delimiter: str = ';', method: str = 'as_dsv',
+                 buffer_size: int = DSV_WRITER_BUFFER_SIZE):
+        self.output_file = output_file
+        self.delimiter = delimiter
+        self.method = method
+        self.buffer_size = buffer_size
+        self.buffer = []
+        self.buffered = 0
+
+    def dump(self, record) -> str:
+        if isinstance(record, str):
+            return record
+        method = getattr(record, self.method, None)
+        if method is not None:
+            return method()
+        escape_table = dsv_escape_table(self.delimiter)
+        return self.delimiter.join(map(lambda value: str(value).translate(escape_table), record))
+
+    def writerow(self, record):
+        line = self.dump(record)
+        self.buffer.append(line)
+        self.buffered += len(line) + 1
+        if self.buffered >= self.buffer_size:
+            self.flush()
+
+    def writerows(self, records: Iterable):
+        for record in records:
+            self.writerow(record)
+
+    def flush(self):
+        if self.buffer:
+            self.buffer.append('')
+            self.output_file.write('\n'.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.flush()
+
+
+class DsvIndex:
+    """
+    Byte offsets of records of a dsv file, keyed by the value of the `key_column`.
+
+    The index is kept in a sidecar file (`<path>.<key_column>.idx` by default) holding a header with the size and
+    mtime of the indexed file followed by `key;offset[;offset...]` records sorted by key. The sidecar is rebuilt when
+    the indexed file changes. Both files are memory mapped, a lookup bisects the sidecar and reads only the records
+    it returns, so it touches a few pages no matter how big the indexed file is.
+    """
+    HEADER = 'dsv index'
+
+    def __init__(self, path, key_column: int, delimiter: str = ';', index_path=None):
+        self.path = Path(path)
+        self.key_column = key_column
+        self.delimiter = delimiter
+        self.index_path = Path(index_path) if index_path else self.path.with_name(f"{self.path.name}.{key_column}.idx")
+        self.data = self.map(self.path)
+        self.index = None
+        self.index_start = 0
+        # used only when the sidecar file cannot be written
+        self.offsets = None
+        self.open_index()
+
+    @staticmethod
+    def map(path: Path) -> [mmap.mmap, bytes]:
+        with open(path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return b''
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def header(self) -> List[str]:
+        stat = self.path.stat()
+        return [self.HEADER, str(stat.st_size), str(stat.st_mtime_ns), str(self.key_column), self.delimiter]
+
+    def open_index(self):
+        header = self.header()
+        try:
+            with open(self.index_path, encoding='utf-8') as index_file:
+                is_valid = dsv_record_load(index_file.readline()) == header
+        except OSError:
+            is_valid = False
+        if not is_valid:
+            offsets = self.build()
+            try:
+                self.save(header, offsets)
+            except OSError:
+                self.offsets = offsets
+                return
+        self.index = self.map(self.index_path)
+        self.index_start = self.index.find(b'\n') + 1
+
+    def build(self) -> Dict[str, List[int]]:
+        offsets = {}
+        offset = 0
+        columns = [self.key_column]
+        while offset < len(self.data):
+            end = self.line_end(self.data, offset)
+            line = self.data[offset:end].decode('utf-8').strip()
+            if line:
+                key, = dsv_record_project(line, columns, self.delimiter)
+                offsets.setdefault(key, []).append(offset)
+            offset = end + 1
+        return offsets
+
+    def save(self, header: List[str], offsets: Dict[str, List[int]]):
+        temporary_path = self.index_path.with_name(f"{self.index_path.name}.{os.getpid()}.tmp")
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as index_file, DsvWriter(index_file) as writer:
+                writer.writerow(header)
+                writer.writerows(map(lambda key: [key] + offsets[key], sorted(offsets)))
+            os.replace(temporary_path, self.index_path)
+        finally:
+            if temporary_path.exists():
+                temporary_path.unlink()
+
+    @staticmethod
+    def line_end(data, offset: int) -> int:
+        end = data.find(b'\n', offset)
+        return len(data) if end == -1 else end
+
+    def index_record(self, offset: int) -> (List[str], int):
+        end = self.line_end(self.index, offset)
+        return dsv_record_load(self.index[offset:end].decode('utf-8')), end
+
+    def lookup(self, key: str) -> List[int]:
+        """Offsets of records with the key, in file order"""
+        if self.index is None:
+            return (self.offsets or {}).get(key, [])
+        low, high = self.index_start, len(self.index)
+        while low < high:
+            middle = (low + high) // 2
+            start = self.index.rfind(b'\n', low, middle) + 1 or low
+            record, end = self.index_record(start)
+            if record[0] < key:
+                low = end + 1
+            else:
+                high = start
+        if low >= len(self.index):
+            return []
+        record, _ = self.index_record(low)
+        return list(map(int, record[1:])) if record[0] == key else []
+
+    def __contains__(self, key: str) -> bool:
+        return bool(self.lookup(key))
+
+    def read_line(self, offset: int) -> str:
+        return self.data[offset:self.line_end(self.data, offset)].decode('utf-8')
+
+    def lines(self, key: str) -> List[str]:
+        return list(map(self.read_line, self.lookup(key)))
+
+    def records(self, key: str) -> List[List[str]]:
+        return list(dsv_reader(self.lines(key), self.delimiter))
+
+    def close(self):
+        for mapped in (self.data, self.index):
+            if isinstance(mapped, mmap.mmap):
+                mapped.close()
 
+    def __enter__(self):
+        return self
 
-def dsv_generator(data_source: Iterable, method='as_dsv'):
-    return interleave_list_with_element(map(lambda r: getattr(r, method)(), data_source), "\n")
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -14,10 +14,13 @@ mkdir -p "${EMAIL_TEMP_DIR}"
 
 # calculate dues and generate monthly income/outcome report
 "${SCRIPT_DIR}"/parse_transactions.sh $TRANSACTIONS | \
-  tee >("${SCRIPT_DIR}"/classificator.py -if=- -of="${MONTHLY_REPORT}") | \
-  "${SCRIPT_DIR}"/transactions2dues.py --hackers $HACKERS_FILE 2>$NOT_DUES_FILE | \
-  cat $HOUSE_RULES - | sort | \
-  "${SCRIPT_DIR}"/skladkoinator.py > "${DUES_REPORT}"
+  tee >("${SCRIPT_DIR}"/classificator.py -if=- -of="${MONTHLY_REPORT}" \
+    ${CLASSIFICATION_RULES:+--rules="${CLASSIFICATION_RULES}"} \
+    ${CLASSIFICATOR_STATE:+--state="${CLASSIFICATOR_STATE}"}) | \
+  "${SCRIPT_DIR}"/transactions2dues.py --hackers $HACKERS_FILE ${ACCOUNTS_FILE:+--accounts="${ACCOUNTS_FILE}"} \
+    ${CLASSIFICATION_RULES:+--rules="${CLASSIFICATION_RULES}"} 2>$NOT_DUES_FILE | \
+  "${SCRIPT_DIR}"/skladkoinator.py -if="${HOUSE_RULES}" -if=- ${DUES_CHECKPOINT:+--checkpoint="${DUES_CHECKPOINT}"} \
+  > "${DUES_REPORT}"
 
 "${SCRIPT_DIR}"/mail_generator.py -if="${DUES_REPORT}" --output_dir="${EMAIL_TEMP_DIR}"
 
@@ -27,7 +30,7 @@ emails_count="$(ls -1 "${EMAIL_TEMP_DIR}")"
 
 not_sent_emails_count="$(ls -1 "${EMAIL_TEMP_DIR}" | wc -l)"
 hackers_count="$(wc -l < "${HACKERS_FILE}")"
-last_3_months_report="$(sort -r "${MONTHLY_REPORT}" | head -n3 )"
+last_3_months_report="$("${SCRIPT_DIR}"/classificator.py -if="${MONTHLY_REPORT}" --monthly-report --last=3)"
 
 echo "
 Hackers count: ${hackers_count}
@@ -8,9 +8,14 @@ SOURCE_FOLDER="./test_email"
 
 HACKERS_FILE="hackers.dsv"
 HOUSE_RULES="house_rules.dsv"
+# classification;subject;amount sign;accounts;contractor records, built in rules when empty
+CLASSIFICATION_RULES=""
 TRANSACTIONS="transactions/*"
 OUT="out"
 NOT_DUES_FILE="${OUT}/not_dues.dsv"
 MONTHLY_REPORT="${OUT}/monthly_report.dsv"
+CLASSIFICATOR_STATE="${OUT}/classificator_state.dsv"
 DUES_REPORT="${OUT}/membership_fees_report.dsv"
+DUES_CHECKPOINT="${OUT}/skladkoinator_checkpoint.dsv"
+ACCOUNTS_FILE="${OUT}/hacker_accounts.dsv"
 EMAIL_TEMP_DIR="${OUT}/emails_to_send/"
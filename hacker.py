@@ -1,8 +1,11 @@
 #!/bin/env python3
 from data_structures import Hacker, Event
-from dsv import dsv_reader, dsv_generator
+from dsv import dsv_reader, DsvIndex, DsvWriter
 from collections import namedtuple
-from typing import Callable, Iterable, Set
+from functools import lru_cache
+from operator import attrgetter
+from typing import Callable, Iterable, Optional, Sequence, Set, Tuple
+import re
 
 def hacker_init(hid: str, nick: str, entry_date: str, email: str, name: str, last_name: str, groups: [set, str]):
     groups = groups or set()
@@ -16,8 +19,34 @@ def hacker_pattern(hid: str = None, nick: str = None, entry_date: str = None, em
     return hacker_init(hid, nick, entry_date, email, name, last_name, groups)
 
 
-def hacker_reader(data_source: Iterable[str], filter_method: [None, Callable[[Hacker], bool]] = None):
-    return filter(filter_method, map(lambda d: hacker_init(*d), dsv_reader(data_source)))
+def hacker_reader(data_source: Iterable[str], filter_method: [None, Callable[[Hacker], bool]] = None,
+                  fields: Sequence[str] = None):
+    """
+    Read hackers from dsv records, with `fields` only those fields are decoded and the other ones are left as None.
+    """
+    if fields is None:
+        hackers = map(lambda d: hacker_init(*d), dsv_reader(data_source))
+    else:
+        columns = list(map(Hacker.columns.index, fields))
+        hackers = map(lambda d: hacker_pattern(**dict(zip(fields, d))), dsv_reader(data_source, columns=columns))
+    return filter(filter_method, hackers)
+
+
+# fields identifying a hacker, a registry can be indexed by any of them
+INDEXED_FIELDS = ('hid', 'email', 'nick')
+
+
+def hacker_index_reader(path: str, pattern: Hacker) -> [None, Iterable[Hacker]]:
+    """
+    Hackers which can match the pattern, looked up in the registry index by the first of hid/email/nick the pattern
+    matches exactly. None when the pattern doesn't match any of those fields exactly.
+    """
+    for field in INDEXED_FIELDS:
+        value = getattr(pattern, field, None)
+        if value and '*' not in value:
+            with DsvIndex(path, Hacker.columns.index(field)) as index:
+                return list(map(lambda d: hacker_init(*d), index.records(value)))
+    return None
 
 
 def hacker_record_collide(hacker: Hacker, new_hacker: Hacker) -> bool:
@@ -67,52 +96,74 @@ def hacker_pass(hackers: Iterable[Hacker], *args, **kwargs) -> Iterable[Hacker]:
     return hackers
 
 
+@lru_cache(maxsize=256)
+def compile_pattern(pattern: str) -> Tuple[int, Callable[[Optional[str]], bool]]:
+    """
+    (cost, matcher) of a pattern of '*' wildcards, the matcher is an exact, prefix, suffix or substring test when the
+    pattern needs no more and a regex otherwise. Cheaper matchers have lower costs, no value matches None.
+    """
+    parts = re.sub(r'\*+', '*', pattern).split('*')
+    if len(parts) == 1:
+        return 0, lambda val: val == pattern
+    if not any(parts):
+        return 1, lambda val: val is not None
+    if len(parts) == 2:
+        prefix, suffix = parts
+        if not suffix:
+            return 1, lambda val: val is not None and val.startswith(prefix)
+        if not prefix:
+            return 1, lambda val: val is not None and val.endswith(suffix)
+        return 1, lambda val: (val is not None and len(val) >= len(prefix) + len(suffix) and val.startswith(prefix)
+                               and val.endswith(suffix))
+    if len(parts) == 3 and not parts[0] and not parts[2]:
+        return 2, lambda val: val is not None and parts[1] in val
+    regex = re.compile('.*'.join(map(re.escape, parts)), re.DOTALL)
+    return 3, lambda val: val is not None and regex.fullmatch(val) is not None
+
+
 def patter_matches(val: str, pattern: str):
     if pattern is None:
         return True
-    if val is None:
-        return False
-
-    offset = 0
-    was_wildcard = False
-    for pattern_part in pattern.split('*'):
-        if pattern_part == '':
-            was_wildcard = True
-            continue
-        new_offset = val.find(pattern_part, offset)
-        if not was_wildcard and new_offset != offset:
-            return False
-        offset = new_offset + len(pattern_part)
-        was_wildcard = True
+    return compile_pattern(pattern)[1](val)
 
-    if pattern[-1] != '*' and offset != len(val):
-        return False
-    return True
 
+# fields of hacker patterns, from the most selective ones, checks of equal costs run in that order
+QUERY_FIELDS = ('hid', 'email', 'nick', 'last_name', 'name', 'entry_date')
 
-def hacker_match_groups(hacker_groups: Set[str], pattern_groups: Set[str]) -> str:
-    if not pattern_groups:
-        return True
-    if not hacker_groups and pattern_groups:
-        return False
-    return bool(pattern_groups - hacker_groups)
 
+class HackerQuery:
+    """
+    Hacker pattern compiled once, its field patterns become matchers checked from the cheapest and most selective ones.
+    Groups of a matching hacker include all groups of the pattern, a '*' group matches any groups.
+    """
+    __slots__ = ('checks', 'groups')
 
-def hacker_matches(hacker: Hacker, pattern: Hacker):
-    for field in Hacker.fields ^ {'groups'}:
-        pattern_field_val = getattr(pattern, field, None)
-        hacker_field_val = getattr(hacker, field, None)
-        if pattern_field_val and not patter_matches(hacker_field_val, pattern_field_val):
-            return False
-
-    if pattern.groups:
-        if hacker.groups:
-            if pattern.groups - hacker.groups:
-                return False
-        else:
-            if pattern.groups != '*':
+    def __init__(self, pattern: Hacker):
+        checks = []
+        for position, field in enumerate(QUERY_FIELDS):
+            field_pattern = getattr(pattern, field, None)
+            if field_pattern:
+                cost, matcher = compile_pattern(field_pattern)
+                checks.append((cost, position, attrgetter(field), matcher))
+        self.checks = [(getter, matcher) for _, _, getter, matcher in sorted(checks, key=lambda c: c[:2])]
+        self.groups = frozenset(pattern.groups or ()) - {'*'}
+
+    def matches(self, hacker: Hacker) -> bool:
+        for getter, matcher in self.checks:
+            if not matcher(getter(hacker)):
                 return False
-    return True
+        return not self.groups or self.groups <= (hacker.groups or set())
+
+
+@lru_cache(maxsize=256)
+def cached_hacker_query(fields: Tuple[Optional[str], ...], groups: frozenset) -> HackerQuery:
+    """HackerQuery of a pattern of `fields`, values of QUERY_FIELDS, and of `groups`, compiled once for each of them"""
+    return HackerQuery(hacker_pattern(**dict(zip(QUERY_FIELDS, fields)), groups=set(groups)))
+
+
+def hacker_matches(hacker: Hacker, pattern: Hacker):
+    return cached_hacker_query(tuple(getattr(pattern, field, None) for field in QUERY_FIELDS),
+                               frozenset(pattern.groups or ())).matches(hacker)
 
 
 def hacker_assign_to_groups(current_hackers: Iterable[Hacker], groups: [str, set], hid: str = None,
@@ -121,7 +172,7 @@ def hacker_assign_to_groups(current_hackers: Iterable[Hacker], groups: [str, set
     for h in current_hackers:
         if hacker_match(h, hid, email, nick):
             hackers_edited += 1
-            updated_hacker_data = {f: getattr(h, f) for f in Hacker.fields}
+            updated_hacker_data = {f: getattr(h, f) for f in Hacker.columns}
             updated_hacker_data['groups'] = h.groups | groups
             yield Hacker(*updated_hacker_data.values())
         else:
@@ -132,8 +183,9 @@ def hacker_assign_to_groups(current_hackers: Iterable[Hacker], groups: [str, set
 
 def hacker_remove_group(current_hackers: Iterable[Hacker], groups: Set[str], pattern: Hacker):
     hacker_found = False
+    query = HackerQuery(pattern)
     for h in current_hackers:
-        if hacker_matches(h, pattern):
+        if query.matches(h):
             hacker_found = True
             hacker_data = h._asdict()
             hacker_data['groups'] = hacker_data['groups'] - groups
@@ -153,7 +205,7 @@ def mkCallRequest(function: Callable, *args, **kwargs) -> CallRequest:
 def hacker_cli_args2filter_call(args_namespace):
     args = vars(args_namespace)
     pattern_kwargs = {
-        k: args[k] for k in Hacker.fields if args.get(k, None)
+        k: args[k] for k in Hacker.columns if args.get(k, None)
     }
     return mkCallRequest(hacker_pattern, **pattern_kwargs)
 
@@ -200,9 +252,9 @@ def hacker2event(hacker: Hacker) -> Event:
     return Event(date=hacker.entry_date, type="newMember", args_str=hacker.email)
 
 
-def event_generator(hackers: Iterable[Hacker]):
+def event_generator(hackers: Iterable[Hacker]) -> Iterable[Event]:
     hackers = sorted(hackers, key=lambda h: h.entry_date)
-    return dsv_generator(map(hacker2event, hackers))
+    return map(hacker2event, hackers)
 
 
 if __name__ == "__main__":
@@ -210,7 +262,7 @@ if __name__ == "__main__":
     args = hacker_cli_argparse.parse_args()
     input_file = sys.stdin if args.input_file == '-' else open(args.input_file)
     output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
-    formatter = dsv_generator if args.format == 'dsv' else event_generator
+    formatter = hacker_pass if args.format == 'dsv' else event_generator
     func = getattr(args, 'func', None)
     if not func:
         sys.stderr.write("missing/wrong function\n")
@@ -219,4 +271,8 @@ if __name__ == "__main__":
     pattern = func(args)
     pattern = pattern.function(*pattern.args, **pattern.kwargs)
 
-    output_file.writelines(formatter(hacker_reader(input_file, lambda hacker: hacker_matches(hacker, pattern))))
+    hackers = hacker_index_reader(args.input_file, pattern) if args.input_file != '-' else None
+    if hackers is None:
+        hackers = hacker_reader(input_file)
+    with DsvWriter(output_file) as writer:
+        writer.writerows(formatter(filter(HackerQuery(pattern).matches, hackers)))
@@ -2,6 +2,7 @@
 
 import argparse
 from data_structures import HackerDues
+from dsv import DsvIndex
 from decimal import Decimal
 from enum import Enum
 from pathlib import Path
@@ -60,11 +61,20 @@ if __name__ == "__main__":
     hacker_cli_argparse = argparse.ArgumentParser()
     hacker_cli_argparse.add_argument("-if", action="store", dest="input_file", default="-", required=False)
     hacker_cli_argparse.add_argument("--output_dir", action="store", dest="output_dir", default=".", required=False)
+    hacker_cli_argparse.add_argument("-e", action="store", dest="email", default=None, required=False,
+                                     help="generate email only for that hacker")
 
     args = hacker_cli_argparse.parse_args()
     input_file = sys.stdin if args.input_file == '-' else open(args.input_file)
     output_dir = Path(args.output_dir)
 
-    for hacker_dues in map(HackerDues.from_dsv, input_file):
+    dues_lines = input_file
+    if args.email and args.input_file != '-':
+        with DsvIndex(args.input_file, 0) as dues_index:
+            dues_lines = dues_index.lines(args.email)
+    elif args.email:
+        dues_lines = filter(lambda line: HackerDues.from_dsv(line).email == args.email, input_file)
+
+    for hacker_dues in map(HackerDues.from_dsv, dues_lines):
         with open(output_dir / hacker_dues.email, 'w') as output_file:
             output_file.write(generate_email(hacker_dues))
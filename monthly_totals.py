@@ -0,0 +1,175 @@
+from array import array
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from itertools import accumulate
+from typing import Dict, Iterable, List, Tuple
+
+from data_structures import TransactionClassification
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class MonthlyTotalsException(Exception):
+    pass
+
+
+MINOR_UNIT_DIGITS = 2
+CLASSIFICATIONS = list(TransactionClassification)
+CLASSIFICATION_POSITIONS = {classification: position for position, classification in enumerate(CLASSIFICATIONS)}
+
+PERIODS = ('month', 'quarter', 'year', 'rolling3', 'rolling12')
+
+
+def month_index(month: date) -> int:
+    return month.year * 12 + month.month - 1
+
+
+def index_month(index: int) -> date:
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def decimal_places(amount: Decimal) -> int:
+    """Decimal places of the amount, at least MINOR_UNIT_DIGITS"""
+    return max(-amount.as_tuple().exponent, MINOR_UNIT_DIGITS)
+
+
+def major_units(minor: int, digits: int, places: int) -> Decimal:
+    """Amount of `minor` units of 10^-`digits`, with `places` decimal places, enough for it to be exact"""
+    return Decimal(minor).scaleb(-digits).quantize(Decimal(1).scaleb(-places))
+
+
+class MonthlyTotals:
+    """
+    Totals and counts of transactions of months × classifications, in integer minor units. They are kept in arrays of
+    rows of consecutive months from the first one, numpy arrays when numpy is installed and lists otherwise, along
+    with prefix sums of the rows, so totals of any range of months take two lookups. Classifications of a range are
+    reported in the order of their first transactions, which is kept for each month too.
+
+    Minor units are of MINOR_UNIT_DIGITS decimal places, or more when an amount has more of them, so totals are exact
+    sums. Totals have as many decimal places as the most precise of their amounts, at least MINOR_UNIT_DIGITS.
+    """
+    UNSEEN = 2 ** 63 - 1
+
+    def __init__(self, classified: Iterable[Tuple[date, TransactionClassification, Decimal]]):
+        months, classifications, amounts, places = array('q'), array('q'), array('q'), array('q')
+        self.digits = MINOR_UNIT_DIGITS
+        for month, classification, amount in classified:
+            amount_places = decimal_places(amount)
+            if amount_places > self.digits:
+                amounts = array('q', map((10 ** (amount_places - self.digits)).__mul__, amounts))
+                self.digits = amount_places
+            months.append(month_index(month))
+            classifications.append(CLASSIFICATION_POSITIONS[classification])
+            amounts.append(int(amount.scaleb(self.digits)))
+            places.append(amount_places)
+        self.first = min(months) if months else 0
+        self.size = max(months) - self.first + 1 if months else 0
+        width = len(CLASSIFICATIONS)
+
+        if numpy is not None:
+            cells = (numpy.frombuffer(months, dtype=numpy.int64) - self.first) * width
+            cells += numpy.frombuffer(classifications, dtype=numpy.int64)
+            totals = numpy.zeros(self.size * width, dtype=numpy.int64)
+            numpy.add.at(totals, cells, numpy.frombuffer(amounts, dtype=numpy.int64))
+            counts = numpy.bincount(cells, minlength=self.size * width).astype(numpy.int64)
+            first_seen = numpy.full(self.size * width, self.UNSEEN, dtype=numpy.int64)
+            numpy.minimum.at(first_seen, cells, numpy.arange(len(cells), dtype=numpy.int64))
+            cell_places = numpy.full(self.size * width, MINOR_UNIT_DIGITS, dtype=numpy.int64)
+            numpy.maximum.at(cell_places, cells, numpy.frombuffer(places, dtype=numpy.int64))
+            self.totals = totals.reshape(self.size, width)
+            self.counts = counts.reshape(self.size, width)
+            self.first_seen = first_seen.reshape(self.size, width)
+            self.places = cell_places.reshape(self.size, width)
+            zeros = numpy.zeros((1, width), dtype=numpy.int64)
+            self.prefix_totals = numpy.concatenate((zeros, numpy.cumsum(self.totals, axis=0)))
+            self.prefix_counts = numpy.concatenate((zeros, numpy.cumsum(self.counts, axis=0)))
+        else:
+            self.totals = [[0] * width for _ in range(self.size)]
+            self.counts = [[0] * width for _ in range(self.size)]
+            self.first_seen = [[self.UNSEEN] * width for _ in range(self.size)]
+            self.places = [[MINOR_UNIT_DIGITS] * width for _ in range(self.size)]
+            for position, (month, classification, amount, amount_places) in enumerate(zip(months, classifications,
+                                                                                         amounts, places)):
+                row = month - self.first
+                self.totals[row][classification] += amount
+                self.counts[row][classification] += 1
+                self.first_seen[row][classification] = min(self.first_seen[row][classification], position)
+                self.places[row][classification] = max(self.places[row][classification], amount_places)
+            add_rows = lambda a, b: list(map(int.__add__, a, b))
+            self.prefix_totals = list(accumulate(self.totals, add_rows, initial=[0] * width))
+            self.prefix_counts = list(accumulate(self.counts, add_rows, initial=[0] * width))
+
+    @classmethod
+    def from_report(cls, report: Dict[date, dict]):
+        """Totals of a monthly report, a classification present in a month counts as one transaction"""
+        return cls((month, classification, amount) for month, totals in report.items()
+                   for classification, amount in totals.items())
+
+    def rows(self, start: int, end: int) -> Tuple[int, int]:
+        return min(max(start - self.first, 0), self.size), min(max(end - self.first, 0), self.size)
+
+    def row(self, prefix, start: int, end: int) -> List[int]:
+        start, end = self.rows(start, end)
+        if numpy is not None:
+            return (prefix[end] - prefix[start]).tolist()
+        return list(map(int.__sub__, prefix[end], prefix[start]))
+
+    def first_seen_row(self, start: int, end: int) -> List[int]:
+        start, end = self.rows(start, end)
+        if start == end:
+            return [self.UNSEEN] * len(CLASSIFICATIONS)
+        if numpy is not None:
+            return self.first_seen[start:end].min(axis=0).tolist()
+        return list(map(min, zip(*self.first_seen[start:end])))
+
+    def places_row(self, start: int, end: int) -> List[int]:
+        start, end = self.rows(start, end)
+        if start == end:
+            return [MINOR_UNIT_DIGITS] * len(CLASSIFICATIONS)
+        if numpy is not None:
+            return self.places[start:end].max(axis=0).tolist()
+        return list(map(max, zip(*self.places[start:end])))
+
+    def range_totals(self, start: date, end: date) -> Dict[TransactionClassification, Decimal]:
+        """Totals of classifications of transactions of months from `start` up to `end`, not including it"""
+        return self.index_range_totals(month_index(start), month_index(end))
+
+    def index_range_totals(self, start: int, end: int) -> Dict[TransactionClassification, Decimal]:
+        totals = self.row(self.prefix_totals, start, end)
+        counts = self.row(self.prefix_counts, start, end)
+        first_seen = self.first_seen_row(start, end)
+        places = self.places_row(start, end)
+        return {CLASSIFICATIONS[position]: major_units(totals[position], self.digits, places[position])
+                for position in sorted(range(len(CLASSIFICATIONS)), key=first_seen.__getitem__) if counts[position]}
+
+    def months(self) -> List[int]:
+        """Indexes of months with transactions"""
+        if numpy is not None:
+            return (numpy.flatnonzero(self.counts.any(axis=1)) + self.first).tolist()
+        return [self.first + offset for offset, counts in enumerate(self.counts) if any(counts)]
+
+    def report(self, period: str = 'month') -> OrderedDict:
+        """
+        Totals of periods with transactions: months, quarters, years or the rolling 3 or 12 months up to and
+        including each month, keyed by dates of months or by labels of quarters and years.
+        """
+        report = OrderedDict()
+        for month in self.months():
+            if period == 'month':
+                report[index_month(month)] = self.index_range_totals(month, month + 1)
+            elif period == 'quarter':
+                start = month - month % 3
+                report[f"{month // 12}-Q{month % 12 // 3 + 1}"] = self.index_range_totals(start, start + 3)
+            elif period == 'year':
+                start = month - month % 12
+                report[str(month // 12)] = self.index_range_totals(start, start + 12)
+            elif period.startswith('rolling') and period[len('rolling'):].isdigit():
+                report[index_month(month)] = self.index_range_totals(month + 1 - int(period[len('rolling'):]),
+                                                                     month + 1)
+            else:
+                raise MonthlyTotalsException(f"unknown period {period}")
+        return report
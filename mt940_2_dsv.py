@@ -1,72 +1,83 @@
 #!/usr/bin/env python3
 import sys
-import mt940
+import calendar
+import heapq
+import mmap
+import os
 import re
+import sqlite3
+import tempfile
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
 from sys import stderr
 from datetime import datetime
+from decimal import Decimal
+from classification_rules import normalize_account
+from data_structures import Transaction
 from dsv import dsv_record_dump
 import argparse
-from typing import Iterable
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class MT940Exception(Exception):
+    pass
+
+
+# fields of :86: subfields, '' for ignored ones, all other subfields are reported as failed to parse
+DESC_SUBFIELDS = {
+    '00': '',
+    '20': 'subject', '21': 'subject', '22': 'subject', '23': 'subject',
+    '24': 'subject', '25': 'subject', '26': 'subject', '27': 'subject',
+    '30': 'contractors_bank_account',
+    '31': 'contractors_account_number',
+    '32': 'contractors_address', '33': 'contractors_address',
+    '34': '',
+    '38': 'contractors_full_account_number',
+    '62': 'additional_description', '63': 'additional_description',
+}
+# subfields with values of the whole rest of their line, others end at the next '^'
+WHOLE_LINE_SUBFIELDS = {'00', '30', '31', '34', '38'}
+# fields set to the value of their last subfield, values of subfields of other fields are joined
+LAST_VALUE_FIELDS = {'contractors_account_number', 'contractors_full_account_number'}
 
 
 def parse_desc_tag(desc_tag_contents):
-    desc = {
-        'transaction_code': '',
-        'description': '',
-        'additional_description': '',
-        'subject': '',
-        'contractors_bank_account': '',
-        'contractors_account_number': '',
-        'contractors_full_account_number': '',
-        'contractors_address': ''
-    }
-    lines = desc_tag_contents.splitlines() + [None, ]
-    desc['transaction_code'] = lines[0][0:3]
-    lines[0] = lines[0][3:]
-    l = lines[0]
-    while l:
-        if l.startswith('^00'):
-            l = lines.pop(0)
-        elif l.startswith('^30'):
-            desc['contractors_bank_account'] += l[3:].strip()
-            l = lines.pop(0)
-        elif l.startswith('^38'):
-            desc['contractors_full_account_number'] = l[3:]
-            l = lines.pop(0)
-        elif l.startswith('^31'):
-            desc['contractors_account_number'] = l[3:]
-            l = lines.pop(0)
-        elif l.startswith('^34'):
-            l = lines.pop(0)
-            pass
-        elif re.match('^\^2[01234567]', l):
-            l = l[3:]
-            parts = l.split('^', 1)
-            desc['subject'] += parts[0]
-            if len(parts) > 1:
-                l = f"^{parts[1]}"
-            else:
-                l = lines.pop(0)
-        elif re.match('^\^6[23]', l):
-            l = l[3:]
-            parts = l.split('^', 1)
-            desc['additional_description'] += parts[0]
-            if len(parts) > 1:
-                l = f"^{parts[1]}"
-            else:
-                l = lines.pop(0)
-        elif re.match('^\^3[23]', l):
-            l = l[3:]
-            parts = l.split('^', 1)
-            desc['contractors_address'] += parts[0]
-            if len(parts) > 1:
-                l = f"^{parts[1]}"
-            else:
-                l = lines.pop(0)
-        else:
-            stderr.write(f"failed to parse '{l}'\n")
-            l=lines.pop(0)
+    """
+    Fields of a :86: tag. Lines are split once on '^' and the two digit codes of subfields are looked up in
+    DESC_SUBFIELDS, fragments of fields are joined at the end. A blank line ends the tag.
+    """
+    lines = desc_tag_contents.splitlines()
+    fragments = {'': [], 'subject': [], 'contractors_bank_account': [], 'contractors_account_number': [],
+                 'contractors_address': [], 'contractors_full_account_number': [], 'additional_description': []}
+    transaction_code = lines[0][0:3] if lines else ''
+    if lines:
+        lines[0] = lines[0][3:]
+    for line in lines:
+        if not line:
+            break
+        parts = line.split('^')
+        if parts[0]:
+            stderr.write(f"failed to parse '{line}'\n")
+            continue
+        for i in range(1, len(parts)):
+            part = parts[i]
+            code = part[:2]
+            field = DESC_SUBFIELDS.get(code)
+            if field is None:
+                stderr.write(f"failed to parse '^{'^'.join(parts[i:])}'\n")
+                break
+            if code in WHOLE_LINE_SUBFIELDS:
+                value = '^'.join(parts[i:])[2:]
+                if field == 'contractors_bank_account':
+                    fragments[field].append(value.strip())
+                elif field in LAST_VALUE_FIELDS:
+                    fragments[field] = [value]
+                break
+            fragments[field].append(part[2:])
 
+    desc = {field: ''.join(values) for field, values in fragments.items() if field}
+    desc['transaction_code'] = transaction_code
+    desc['description'] = ''
     if 0 == len(desc['contractors_full_account_number']):
         desc['contractors_full_account_number'] = desc['contractors_bank_account'] + desc['contractors_account_number']
 
@@ -89,29 +100,354 @@ def format_date(date):
     return datetime(date.year, date.month, date.day, 0, 0, 0).isoformat()
 
 
-def mt940_to_dsv(transactions: Iterable) -> Iterable[str]:
+# the reader follows the mt940 library (4.23), which was used before, tag patterns are its patterns
+TAG_REGEX = re.compile(r'^:(?P<full_tag>(?P<tag>[0-9]{2}|NS)(?P<sub_tag>[A-Z])?):')
+KNOWN_TAGS = {'13', '20', '21', '25', '28', '34', '60', '61', '62', '64', '65', '86', '90', 'NS'}
+TAG_FLAGS = re.IGNORECASE | re.VERBOSE | re.UNICODE
+STATEMENT_NUMBER_REGEX = re.compile(r'''
+    (?P<statement_number>\d{1,5})  # 5n
+    (?:/?(?P<sequence_number>\d{1,5}))?  # [/5n]
+    $''', TAG_FLAGS)
+BALANCE_REGEX = re.compile(r'''^
+    (?P<status>[DC])  # 1!a Debit/Credit
+    (?P<year>\d{2})  # 6!n Value Date (YYMMDD)
+    (?P<month>\d{2})
+    (?P<day>\d{2})
+    (?P<currency>.{3})  # 3!a Currency
+    (?P<amount>[0-9,]{0,16})  # 15d Amount (includes decimal sign, so 16)
+    ''', TAG_FLAGS)
+STATEMENT_LINE_REGEX = re.compile(r'''^
+    (?P<year>\d{2})  # 6!n Value Date (YYMMDD)
+    (?P<month>\d{2})
+    (?P<day>\d{2})
+    (?P<entry_month>\d{2})?  # [4!n] Entry Date (MMDD)
+    (?P<entry_day>\d{2})?
+    (?P<status>[A-Z]?[DC])  # 2a Debit/Credit Mark
+    (?P<funds_code>[A-Z])? # [1!a] Funds Code (3rd character of the currency code, if needed)
+    \n? # some banks put newlines here
+    (?P<amount>[\d,]{1,15})  # 15d Amount
+    (?P<id>[A-Z][A-Z0-9 ]{3})?  # 1!a3!c Transaction Type Identification Code
+    (?P<customer_reference>.{0,16})  # 16x Customer Reference
+    (//(?P<bank_reference>.{0,23}))?  # [//23x] Bank Reference
+    (\n?(?P<extra_details>.{0,34}))?  # [34x] Supplementary Details
+    $''', TAG_FLAGS)
+# balance tags the currency of transactions is taken from, in order
+CURRENCY_TAGS = ('60F', '60', '60M', '64', '65', '62F', '62', '62M')
+# contents of :86: tags longer than that many lines are cut
+TRANSACTION_DETAILS_LINES = 9
+TRANSACTION_DETAILS_LINE_LENGTH = 65
+
+
+def fix_bnp_statement_number(statement_number: str) -> str:
+    """0668-2019/BPL -> 0668/2019, 12/2020/M -> 12/2020"""
+    return re.sub(r'/[^0-9].*$', '', statement_number.replace('-', '/', 1), count=1)
+
+
+def mt940_tags(lines: Iterable[str]) -> Iterable[Tuple[str, str]]:
+    """
+    (tag, contents) of tags of MT940 lines, without carriage returns, trailing whitespace, blank lines and '-'
+    separators. Lines looking like tags of unknown ids continue the contents of a :86: tag.
+    """
+    tag, contents = None, []
+    for line in lines:
+        line = line.replace('\r', '').rstrip()
+        if not line or line.strip() == '-':
+            continue
+        match = TAG_REGEX.match(line)
+        if match and match.group('tag') not in KNOWN_TAGS:
+            if tag is None or tag[:2] != '86':
+                raise MT940Exception(f"unknown tag in line: {line}")
+            match = None
+        if match:
+            if tag is not None:
+                yield tag, '\n'.join(contents).strip()
+            tag, contents = match.group('full_tag'), [line[match.end():]]
+        elif tag is not None:
+            contents.append(line)
+    if tag is not None:
+        yield tag, '\n'.join(contents).strip()
+
+
+def transaction_details(contents: str) -> str:
+    """Contents of a :86: tag cut to the length of TRANSACTION_DETAILS_LINES lines"""
+    end = 0
+    for _ in range(TRANSACTION_DETAILS_LINES - 1):
+        end = min(end + TRANSACTION_DETAILS_LINE_LENGTH, len(contents))
+        if contents.startswith('\r', end):
+            end += 1
+        if contents.startswith('\n', end):
+            end += 1
+    return contents[:end + TRANSACTION_DETAILS_LINE_LENGTH]
+
+
+def statement_line(contents: str, currency: Optional[str]) -> dict:
+    """Fields of a :61: tag, dates of February 29 and 30 of years without them become the last day of February"""
+    match = STATEMENT_LINE_REGEX.match(contents)
+    if match is None:
+        raise MT940Exception(f"unable to parse :61:{contents}")
+    fields = match.groupdict()
+    year, month, day = 2000 + int(fields['year']), int(fields['month']), int(fields['day'])
+    if month == 2:
+        day = min(day, calendar.monthrange(year, 2)[1])
+    fields['date'] = datetime(year, month, day)
+    if fields['entry_month'] and fields['entry_day']:
+        fields['entry_date'] = datetime(year, int(fields['entry_month']), int(fields['entry_day']))
+    amount = Decimal(fields['amount'].replace(',', '.'))
+    fields['amount'] = -amount if fields['status'] == 'D' else amount
+    fields['currency'] = currency
+    return fields
+
+
+def mt940_transactions(lines: Iterable[str]) -> Iterable[Transaction]:
+    """
+    Transactions of :61: tags and their :86: details of MT940 lines. Like in the mt940 library a :61: tag without a
+    transaction type identification code doesn't start a new transaction, its fields replace fields of the previous
+    one, and :86: tags add lines to the details of the last transaction. Statement numbers of :28C: are fixed up
+    like by fix_bnp_statement_number. Transactions without an entry date are dated by their value date.
+    """
+    currencies: Dict[str, str] = {}
+    transaction = None
+    for tag, contents in mt940_tags(lines):
+        tag_id = tag[:2]
+        if tag_id == '28':
+            if STATEMENT_NUMBER_REGEX.match(fix_bnp_statement_number(contents)) is None:
+                raise MT940Exception(f"unable to parse :{tag}:{contents}")
+        elif tag_id in ('60', '62', '64', '65'):
+            balance = BALANCE_REGEX.match(contents)
+            if balance is None:
+                raise MT940Exception(f"unable to parse :{tag}:{contents}")
+            currencies[tag if tag in CURRENCY_TAGS else tag_id] = balance.group('currency')
+        elif tag_id == '61':
+            currency = next(filter(None, map(currencies.get, CURRENCY_TAGS)), None)
+            fields = statement_line(contents, currency)
+            if transaction is None or not transaction['id']:
+                transaction = {**(transaction or {}), **fields}
+            else:
+                yield mt940_transaction(transaction)
+                transaction = fields
+        elif tag_id == '86' and transaction is not None:
+            details = transaction_details(contents)
+            if 'transaction_details' in transaction:
+                transaction['transaction_details'] += '\n' + details.strip()
+            else:
+                transaction['transaction_details'] = details
+    if transaction is not None:
+        yield mt940_transaction(transaction)
+
+
+def mt940_transaction(fields: dict) -> Transaction:
+    desc = parse_desc_tag(fields.get('transaction_details', ''))
+    return Transaction(fields.get('entry_date', fields['date']), fields['extra_details'],
+                       desc['contractors_full_account_number'], desc['subject'], desc['contractors_address'],
+                       fields['amount'], fields['currency'], transaction_type(fields['status']))
+
+
+def mt940_file_lines(path, encoding: str = 'utf-8') -> Iterable[str]:
+    """Lines of a memory mapped file"""
+    with open(path, 'rb') as mt940_file:
+        if os.fstat(mt940_file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(mt940_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+            for line in iter(mapped_file.readline, b''):
+                yield line.decode(encoding)
+
+
+def mt940_dsv_record(t: Transaction) -> str:
+    return dsv_record_dump([
+        format_date(t.date),
+        t.extra_details,
+        t.contractor_account_number,
+        t.subject,
+        t.contractor_address,
+        t.amount,
+        t.currency,
+        t.transaction_type,
+    ])
+
+
+def mt940_to_dsv(transactions: Iterable[Transaction]) -> Iterable[str]:
     for t in transactions:
-        t = t.data
-        desc = parse_desc_tag(t['transaction_details'])
-        yield dsv_record_dump([
-            format_date(t['entry_date']),
-            t['extra_details'],
-            desc['contractors_full_account_number'],
-            desc['subject'],
-            desc['contractors_address'],
-            t['amount'].amount,
-            t['amount'].currency,
-            transaction_type(t['status']),
-        ]) + "\n"
-
-
-def parse_mt940(files: Iterable[str]) -> Iterable:
-    handlers = []
+        yield mt940_dsv_record(t) + "\n"
+
+
+def transaction_fingerprint(t: Transaction) -> str:
+    """
+    Transactions of overlapping statements have equal fingerprints, of their date, id, amount and account regardless of
+    whitespace and of the format of amounts. Transactions without an id, like bank fees, are told apart by subjects.
+    """
+    extra_details = ' '.join((t.extra_details or '').split())
+    fingerprint = [t.date.date().isoformat(), extra_details, f"{t.amount.normalize():f}",
+                   normalize_account(t.contractor_account_number)]
+    if not extra_details:
+        fingerprint.append(' '.join((t.subject or '').split()))
+    return dsv_record_dump(fingerprint)
+
+
+def statement_transactions(lines: Iterable[str]) -> List[Transaction]:
+    return list(mt940_transactions(lines))
+
+
+def statement_records(lines: Iterable[str]) -> List[Tuple[str, str]]:
+    """
+    (dsv record, fingerprint) of transactions of a statement sorted by records, which start with their dates. Equal
+    fingerprints of a statement are numbered, so equal transactions of one statement, like two equal fees of a day,
+    are all kept while the same ones of an overlapping statement are still repeated.
+    """
+    occurrences = Counter()
+    records = []
+    for t in mt940_transactions(lines):
+        fingerprint = transaction_fingerprint(t)
+        occurrence = occurrences[fingerprint]
+        occurrences[fingerprint] += 1
+        records.append((mt940_dsv_record(t), f"{fingerprint}#{occurrence}" if occurrence else fingerprint))
+    return sorted(records)
+
+
+def parse_mt940_file(parse: Callable[[Iterable[str]], list], path) -> list:
+    return parse(mt940_file_lines(path))
+
+
+def parallel_parse_mt940_files(files: Iterable[str], parse: Callable[[Iterable[str]], list],
+                               workers: int = None) -> Iterable[list]:
+    """
+    parse_mt940_files by a pool of `workers` processes (all cpus by default), one file per task. Results are returned
+    in the order of files, at most two files per worker are parsed ahead of the consumer. Stdin is parsed by the
+    calling process once results of files before it are returned.
+    """
+    workers = workers or os.cpu_count()
+    with ProcessPoolExecutor(workers) as executor:
+        pending = deque()
+        for file in files:
+            if file == '-':
+                while pending:
+                    yield pending.popleft().result()
+                yield parse(sys.stdin)
+                continue
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(parse_mt940_file, parse, file))
+        while pending:
+            yield pending.popleft().result()
+
+
+def parse_mt940_files(files: Iterable[str], parse: Callable[[Iterable[str]], list],
+                      workers: int = 1, min_size: int = 0) -> Iterable[list]:
+    """
+    Results of `parse` of lines of each of files in their order, '-' stands for stdin. Files are opened one at a time,
+    when parsed. A pool of more than one worker is used for files of at least `min_size` bytes in total, smaller ones
+    are parsed serially with a warning. `parse` has to be a module level function for a pool.
+    """
+    if workers != 1:
+        files = list(files)
+        size = sum(os.path.getsize(file) for file in files if file != '-')
+        if size >= min_size:
+            yield from parallel_parse_mt940_files(files, parse, workers)
+            return
+        stderr.write(f"parsing {size} bytes of statement files serially, {workers} workers are used from {min_size} "
+                     f"bytes\n")
     for file in files:
-        handlers.append(sys.stdin if file == '-' else open(file, 'r'))
+        yield parse(sys.stdin if file == '-' else mt940_file_lines(file))
+
+
+def parse_mt940(files: Iterable[str], workers: int = 1, min_size: int = 0) -> Iterable[Transaction]:
+    """Transactions of files in their order, '-' stands for stdin"""
+    for transactions in parse_mt940_files(files, statement_transactions, workers, min_size):
+        yield from transactions
+
+
+class FingerprintSet:
+    """
+    Fingerprints of transactions seen so far, in memory or, for archives too large for that, in an sqlite database of a
+    temporary file.
+    """
+
+    def __init__(self, on_disk: bool = False):
+        self.fingerprints = set()
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='mt940_2_dsv') if on_disk else None
+        self.db = None
+        if self.tmp_dir is not None:
+            self.db = sqlite3.connect(os.path.join(self.tmp_dir.name, 'fingerprints.sqlite'))
+            self.db.execute('PRAGMA journal_mode = OFF')
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE fingerprints (fingerprint TEXT PRIMARY KEY) WITHOUT ROWID')
+
+    def add(self, fingerprint: str) -> bool:
+        """Adds the fingerprint, False when it was already there"""
+        if self.db is not None:
+            return self.db.execute('INSERT OR IGNORE INTO fingerprints VALUES (?)', (fingerprint,)).rowcount == 1
+        if fingerprint in self.fingerprints:
+            return False
+        self.fingerprints.add(fingerprint)
+        return True
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.tmp_dir.cleanup()
+            self.db, self.tmp_dir = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class StatementRecords:
+    """
+    (dsv record, fingerprint) of transactions of statements, iterated in the order of records. Sorted records of
+    statements are kept in memory and merged, or, for archives too large for that, spilled one statement at a time to an
+    sqlite database of a temporary file which sorts them.
+    """
+
+    def __init__(self, on_disk: bool = False):
+        self.statements = []
+        self.tmp_dir = tempfile.TemporaryDirectory(prefix='mt940_2_dsv') if on_disk else None
+        self.db = None
+        if self.tmp_dir is not None:
+            self.db = sqlite3.connect(os.path.join(self.tmp_dir.name, 'records.sqlite'))
+            self.db.execute('PRAGMA journal_mode = OFF')
+            self.db.execute('PRAGMA synchronous = OFF')
+            self.db.execute('CREATE TABLE records (record TEXT, fingerprint TEXT)')
+
+    def add(self, records: List[Tuple[str, str]]):
+        if self.db is not None:
+            self.db.executemany('INSERT INTO records VALUES (?, ?)', records)
+        else:
+            self.statements.append(records)
+
+    def __iter__(self) -> Iterable[Tuple[str, str]]:
+        if self.db is not None:
+            return iter(self.db.execute('SELECT record, fingerprint FROM records ORDER BY record, fingerprint'))
+        return heapq.merge(*self.statements)
+
+    def close(self):
+        if self.db is not None:
+            self.db.close()
+            self.tmp_dir.cleanup()
+            self.db, self.tmp_dir = None, None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
 
-    for handler in handlers:
-        yield from mt940.parse(handler)
+def deduplicated_dsv(files: Iterable[str], workers: int = 1, on_disk: bool = False, min_size: int = 0
+                     ) -> Iterable[str]:
+    """
+    Dsv records of transactions of files merged by date, from statements sorted by workers, with only the first
+    transaction of each fingerprint. Records of the same date are in the order of sort(1) of the C locale. Any file
+    may hold the earliest transactions, so all of them are parsed before the first record is returned: records of
+    all statements are kept in memory, unless `on_disk`, when they are spilled to disk along with fingerprints.
+    """
+    with StatementRecords(on_disk) as records, FingerprintSet(on_disk) as seen:
+        for statement in parse_mt940_files(files, statement_records, workers, min_size):
+            records.add(statement)
+        for record, fingerprint in records:
+            if seen.add(fingerprint):
+                yield record + "\n"
 
 
 if __name__ == "__main__":
@@ -139,10 +475,23 @@ if __name__ == "__main__":
     hacker_cli_argparse = argparse.ArgumentParser(description=desc)
     hacker_cli_argparse.add_argument("-if", action="store", nargs='+', dest="input_files", default="-", required=False)
     hacker_cli_argparse.add_argument("-of", action="store", dest="output_file", default="-", required=False)
+    hacker_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=1, required=False,
+                                     help="processes parsing the input files, 0 for all cpus")
+    hacker_cli_argparse.add_argument("--parallel-min-size", action="store", dest="min_size", type=int, default=0,
+                                     required=False, help="bytes of input files below which -j is ignored and they "
+                                                          "are parsed serially")
+    hacker_cli_argparse.add_argument("--dedup", action="store_true", dest="dedup", default=False, required=False,
+                                     help="merge transactions by date and skip repeated ones of overlapping statements")
+    hacker_cli_argparse.add_argument("--on-disk-dedup", action="store_true", dest="on_disk", default=False,
+                                     required=False, help="keep records and fingerprints of --dedup in temporary "
+                                                          "sqlite files instead of memory")
 
     args = hacker_cli_argparse.parse_args()
     output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
 
-    output_file.writelines(mt940_to_dsv(parse_mt940(args.input_files)))
+    if args.dedup or args.on_disk:
+        output_file.writelines(deduplicated_dsv(args.input_files, args.workers, args.on_disk, args.min_size))
+    else:
+        output_file.writelines(mt940_to_dsv(parse_mt940(args.input_files, args.workers, args.min_size)))
 
 
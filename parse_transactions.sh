@@ -11,25 +11,21 @@ For more informatin on the ooutput format check mt940_parser.py --help .
 \t$0 ./*.STA
 \tcat <input file> | $0
 
-Output format can be sorted by date using sort(1).
+Transactions are sorted by date, repeated ones of overlapping statements are skipped.
 "
     exit;
 fi
 
-function fix_bnp_transactions_record () {
-    # :28C:0668-2019/BPL -> :28C:0668/2019
-    # :28C:12/2020/M -> :28C:12/2020
-    sed -e '/^:28C:/{s/-/\//;s/\/[^0-9].*$//}'
-}
-
-
 if [[ "$#" -lt 1 ]] ; then
-    fix_bnp_transactions_record | python3 mt940_2_dsv.py | sort | uniq
+    python3 "${SCRIPT_DIR}/"mt940_2_dsv.py --dedup
     exit;
 fi
 
-for mt940_file in "$@" ; do
-    fix_bnp_transactions_record < "$mt940_file"  | python3 "${SCRIPT_DIR}/"mt940_2_dsv.py
-done \
-| sort | uniq
+# statement files are parsed by a process pool of all cpus when there are more than one
+WORKERS=1
+if [[ "$(nproc 2> /dev/null || echo 1)" -gt 1 ]] ; then
+    WORKERS=0
+fi
+
+python3 "${SCRIPT_DIR}/"mt940_2_dsv.py --dedup -j "${WORKERS}" -if "$@"
 
@@ -1,19 +1,34 @@
 #!/usr/bin/env python3
 import argparse
-from typing import Mapping
-from datetime import timedelta
+import multiprocessing
+import os
+import sys
+import zlib
+from bisect import bisect_left, bisect_right
+from hashlib import sha256
+from itertools import chain, islice
+from typing import Callable, Dict, List, Mapping
+from datetime import datetime, timedelta
 from typing import Iterable
 
-from data_structures import Event, HouseRules, HackerDues, AccountState, DuesHistoryRecord
-from dsv import dsv_reader, dsv_generator
-from decimal import Decimal
-from functools import partial
+from data_structures import Event, HouseRules, HackerDues, AccountState, DuesHistoryRecord, parse_datetime
+from dsv import dsv_file_reader, dsv_reader, DsvWriter
+from sort_events import merge_events, open_event_sources, sort_events
+from decimal import Decimal, Rounded, localcontext
 
 
 class EventReaderException(Exception):
     pass
 
 
+class EventHandlingException(Exception):
+    pass
+
+
+class CheckpointException(Exception):
+    pass
+
+
 class UnknownEventException(Exception):
     def __init__(self,event_name: str):
         self.event_name = event_name
@@ -26,6 +41,71 @@ class UnknownEventException(Exception):
 ONE_MONTH = timedelta(days=30)
 
 
+class AccrualClock:
+    """
+    Dates of the nextMonth events replayed so far. A nextMonth event only appends its date, members are charged
+    when their balance is read, for every month dated more than ONE_MONTH after their entry date.
+    """
+    __slots__ = ('ticks', 'month')
+
+    def __init__(self):
+        self.ticks = []
+        self.month = 0
+
+    def tick(self, date: datetime):
+        self.ticks.append(date)
+        self.month += 1
+
+    def reset(self):
+        self.ticks = []
+        self.month = 0
+
+    def charge(self, balance, entry_date: datetime, accrued: int, month: int = None):
+        """`balance` after the charges for months from the `accrued` one to `month` (the current one by default)"""
+        month = self.month if month is None else month
+        # ticks are kept in order, so months out of the grace period are a suffix of them
+        charges = max(month - bisect_right(self.ticks, entry_date + ONE_MONTH, accrued, month), 0)
+        # a single charge is the subtraction nextMonth does, so it's rounded the same way without checking it
+        if charges <= 1 or not isinstance(balance, Decimal):
+            return balance - charges
+        with localcontext() as context:
+            context.traps[Rounded] = True
+            try:
+                return balance - charges
+            except Rounded:
+                pass
+        # the balance doesn't fit the context precision, charge it month by month to round it as nextMonth would
+        for _ in range(charges):
+            balance -= 1
+        return balance
+
+
+class AccruingDues(dict):
+    """
+    Dues of hackers charged lazily by an AccrualClock. Dues are attached to the clock when they are set, so they
+    have to be added with item assignment.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.clock = AccrualClock()
+
+    def __setitem__(self, email: str, hacker_dues: HackerDues):
+        hacker_dues.clock = self.clock
+        hacker_dues.accrued = self.clock.month
+        super().__setitem__(email, hacker_dues)
+
+    def next_month(self, date: datetime):
+        ticks = self.clock.ticks
+        if ticks and date < ticks[-1]:
+            # an out of order month would break the order of ticks, settle everybody and start over
+            for hacker_dues in self.values():
+                hacker_dues.balance
+                hacker_dues.accrued = 0
+            self.clock.reset()
+        self.clock.tick(date)
+
+
 class EventHandlers:
 
     @staticmethod
@@ -49,6 +129,9 @@ class EventHandlers:
         Decrement dues balance for all hackers.
         Event args: None
         """
+        if isinstance(dues, AccruingDues):
+            dues.next_month(event.date)
+            return
         for due_record in dues.values():
             if event.date - due_record.entry_date > ONE_MONTH:
                 due_record.balance -= 1
@@ -151,40 +234,628 @@ class EventHandlers:
         raise UnknownEventException(event.type)
 
 
-def is_line_not_empty(line: str):
-    return len(line) != 0
-
-
-def event_reader(event_source: Iterable[str]) -> Iterable[Event]:
-    for event_data in filter(is_line_not_empty, dsv_reader(event_source)):
+def event_reader(event_source: Iterable[str], workers: int = 1, lazy: bool = True) -> Iterable[Event]:
+    """
+    Events read from dsv records. Lazy events are decoded only as far as handlers read them, so an invalid date or
+    argument is reported when its event is handled rather than when it is read.
+    """
+    make_event = Event.lazy if lazy else Event
+    # empty records come from blank lines
+    for event_data in filter(None, dsv_file_reader(event_source, workers=workers)):
         try:
-            yield Event(*event_data)
+            yield make_event(*event_data)
         except Exception as e:
             raise EventReaderException(f"failed to read event line: {event_data}:\n{e}")
 
 
+EventHandler = Callable[[Event, Mapping[str, HackerDues], HouseRules, AccountState], None]
+
+# handlers registered with the event_handler decorator
+registered_event_handlers: Dict[str, EventHandler] = {}
+
+
+def event_handler(event_type: str = None):
+    """
+    Decorator registering a handler of events of `event_type` (the handler name by default) in every EventEngine
+    created afterwards. House rules can add their own events that way, without editing EventHandlers.
+    """
+    def register(handler: EventHandler) -> EventHandler:
+        registered_event_handlers[sys.intern(event_type or handler.__name__)] = handler
+        return handler
+    return register
+
+
+def builtin_event_handlers() -> Dict[str, EventHandler]:
+    return {
+        sys.intern(name): getattr(EventHandlers, name)
+        for name, handler in vars(EventHandlers).items() if isinstance(handler, staticmethod) and name != 'default'
+    }
+
+
+# handlers of EventHandlers by event type, built once and shared by engines and handle_event
+BUILTIN_EVENT_HANDLERS = builtin_event_handlers()
+
+
+class EventEngine:
+    """
+    Replays events on the dues state. Handlers are resolved once, when the engine is created, into a dict keyed
+    by the (interned) event type. With `lazy_accrual` and no `dues` given, monthly charges are accrued lazily by
+    AccruingDues, which pays off for ledgers of members paying rarely. Reading a balance costs more then, so nextMonth
+    charging everybody at once is the default.
+    """
+
+    def __init__(self, dues: Mapping[str, HackerDues] = None, rates: HouseRules = None,
+                 account_balance: AccountState = None, handlers: Mapping[str, EventHandler] = None,
+                 lazy_accrual: bool = False):
+        if dues is None:
+            dues = AccruingDues() if lazy_accrual else {}
+        self.dues = dues
+        self.rates = HouseRules() if rates is None else rates
+        self.account_balance = AccountState() if account_balance is None else account_balance
+        self.handlers = {**BUILTIN_EVENT_HANDLERS, **registered_event_handlers, **(handlers or {})}
+        self.last_event_date = None
+
+    def register(self, event_type: str = None):
+        """Decorator registering a handler of events of `event_type` (the handler name by default) in this engine"""
+        def register(handler: EventHandler) -> EventHandler:
+            self.handlers[sys.intern(event_type or handler.__name__)] = handler
+            return handler
+        return register
+
+    def run(self, events: Iterable[Event]):
+        handler, default = self.handlers.get, EventHandlers.default
+        dues, rates, account_balance = self.dues, self.rates, self.account_balance
+        # the event being handled, None while the next one is read, so errors of the event source pass through
+        event = handled = None
+        try:
+            for event in events:
+                handled = event
+                handler(event.type, default)(event, dues, rates, account_balance)
+                handled = None
+        except Exception as exc:
+            if handled is None:
+                raise
+            raise EventHandlingException(
+                f"Exception '{exc}' happened during handling of event: {handled.as_dsv()}") from exc
+        if event is not None:
+            self.last_event_date = event.date
+
+    def handle(self, event: Event):
+        self.run((event, ))
+
+
 def handle_event(event: Event, dues: Mapping[str, HackerDues], rates: HouseRules, account_balance: AccountState):
+    handler = registered_event_handlers.get(event.type) or BUILTIN_EVENT_HANDLERS.get(event.type, EventHandlers.default)
     try:
-        return getattr(EventHandlers, event.type, EventHandlers.default)(event, dues, rates, account_balance)
+        handler(event, dues, rates, account_balance)
     except Exception as exc:
-        raise Exception(f"Exception '{exc}' happened during handling of event: {event.as_dsv()}")
+        raise EventHandlingException(
+            f"Exception '{exc}' happened during handling of event: {event.as_dsv()}") from exc
+
+
+# position of the member email in args of events touching a single member, the others are global
+MEMBER_EVENT_ARGS = {
+    'newMember': -1,
+    'setHackerDue': 1,
+    'dueSet': 0,
+    'dueAdd': 0,
+    'transaction': 1,
+    'assertHackerDueBalanceEquals': 0,
+    'assertHackerDueRateEquals': 0,
+}
+GLOBAL_EVENTS = {'nextMonth', 'setDefaultDue', 'setMaxPrepaidDuesCount', 'assertDefaultDueRateEquals'}
+# global events changing HouseRules, applied to the engine once its partitions are replayed
+HOUSE_RULES_EVENTS = {'setHackerDue', 'setDefaultDue', 'setMaxPrepaidDuesCount'}
+# events sent to a partition at once, it's what a partition buffers besides the pipe
+PARTITION_BATCH_SIZE = 1024
+
+
+def event_partition(email: str, partitions: int) -> int:
+    return zlib.crc32(email.encode('utf-8')) % partitions
+
+
+def is_partitionable(engine: EventEngine) -> bool:
+    """Whether the engine has only the builtin handlers, which partitioned_replay knows how to route"""
+    return engine.handlers.keys() == BUILTIN_EVENT_HANDLERS.keys() and \
+        all(map(lambda event_type: engine.handlers[event_type] is BUILTIN_EVENT_HANDLERS[event_type],
+                BUILTIN_EVENT_HANDLERS))
+
+
+def settled_dues(dues: Mapping[str, HackerDues]) -> List[tuple]:
+    """(email, dues) pairs with monthly charges applied and detached from the accrual clock"""
+    for hacker_dues in dues.values():
+        hacker_dues.balance = hacker_dues.balance
+        hacker_dues.clock = None
+    return list(dues.items())
+
+
+def replay_partition(connection, dues: List[tuple], house_rules: tuple, lazy_accrual: bool):
+    """
+    Replay of the (sequence, event, quoted) batches received from `connection`, up to None, on the partition `dues`.
+    The partition has an accrual clock of its own, starting when it does. Sends back the settled dues and the
+    sequence, message and exception of the first event which failed. `quoted` is the event as read when the
+    partition got a part of it.
+    """
+    HouseRules.default_rate, rates, max_prepaid_dues_count = house_rules
+    HouseRules.rates.clear()
+    HouseRules.rates.update(rates)
+    engine = EventEngine(lazy_accrual=lazy_accrual)
+    engine.rates.max_prepaid_dues_count = max_prepaid_dues_count
+    for email, hacker_dues in dues:
+        engine.dues[email] = hacker_dues
+    received = None
+
+    def partition_events():
+        nonlocal received
+        for batch in iter(connection.recv, None):
+            for received in batch:
+                yield received[1]
+
+    error = None
+    try:
+        engine.run(partition_events())
+    except EventHandlingException as exc:
+        sequence, _, quoted = received
+        message = str(exc) if quoted is None else \
+            f"Exception '{exc.__cause__}' happened during handling of event: {quoted}"
+        error = sequence, message, exc.__cause__
+        # the rest of the log is still sent
+        for _ in iter(connection.recv, None):
+            pass
+    connection.send((settled_dues(engine.dues), error))
+    connection.close()
+
+
+def partitioned_replay(engine: EventEngine, events: Iterable[Event], partitions: int = None,
+                       batch_size: int = PARTITION_BATCH_SIZE):
+    """
+    engine.run of events replayed by `partitions` processes (all cpus by default). Events of a member are streamed
+    in batches to the partition of their email, global events to every partition, so the log isn't held in memory.
+    Dues of partitions are merged in the order the serial replay would add them and attached to the engine accrual
+    clock, which ticks on nextMonth events as they are read. Engines with handlers of their own are replayed serially.
+    """
+    partitions = partitions or os.cpu_count()
+    if partitions == 1 or not is_partitionable(engine):
+        engine.run(events)
+        return
+
+    partition_dues = [[] for _ in range(partitions)]
+    for email, hacker_dues in settled_dues(engine.dues):
+        partition_dues[event_partition(email, partitions)].append((email, hacker_dues))
+    members_order = dict.fromkeys(engine.dues)
+    engine.dues.clear()
+    house_rules = (HouseRules.default_rate, dict(engine.rates.rates), engine.rates.max_prepaid_dues_count)
+    lazy_accrual = isinstance(engine.dues, AccruingDues)
+    connections, workers = [], []
+    for dues in partition_dues:
+        connection, worker_connection = multiprocessing.Pipe()
+        worker = multiprocessing.Process(target=replay_partition,
+                                         args=(worker_connection, dues, house_rules, lazy_accrual))
+        worker.start()
+        worker_connection.close()
+        connections.append(connection)
+        workers.append(worker)
+
+    batches = [[] for _ in range(partitions)]
+
+    def send(partition: int, item: tuple):
+        batch = batches[partition]
+        batch.append(item)
+        if len(batch) >= batch_size:
+            connections[partition].send(batch)
+            batches[partition] = []
+
+    house_rules_events = []
+    event = reader_error = results = None
+    try:
+        try:
+            for sequence, event in enumerate(events):
+                if event.type in GLOBAL_EVENTS:
+                    for partition in range(partitions):
+                        send(partition, (sequence, event, None))
+                    if lazy_accrual and event.type == 'nextMonth':
+                        engine.dues.next_month(event.date)
+                elif event.type == 'assertHackersExist':
+                    emails_by_partition = {}
+                    for email in event.args:
+                        emails_by_partition.setdefault(event_partition(email, partitions), []).append(email)
+                    quoted = event.as_dsv()
+                    for partition, emails in emails_by_partition.items():
+                        send(partition, (sequence, event.with_args(emails), quoted))
+                else:
+                    try:
+                        email = event.args[MEMBER_EVENT_ARGS[event.type]]
+                    except (KeyError, IndexError):
+                        # unknown or invalid event, it fails the same way in any partition
+                        email = ''
+                    if event.type == 'newMember':
+                        members_order.setdefault(email)
+                    send(event_partition(email, partitions), (sequence, event, None))
+                if event.type == 'transaction':
+                    engine.account_balance.register_transaction(event)
+                elif event.type in HOUSE_RULES_EVENTS:
+                    # handlers may change args of the event, which isn't sent yet
+                    house_rules_events.append(event.with_args(event.args))
+        except EventReaderException as exc:
+            # raised unless an event before the unreadable one fails
+            reader_error = exc
+        for connection, batch in zip(connections, batches):
+            if batch:
+                connection.send(batch)
+            connection.send(None)
+        results = list(map(lambda connection: connection.recv(), connections))
+    finally:
+        for connection, worker in zip(connections, workers):
+            if results is None:
+                worker.terminate()
+            worker.join()
+            connection.close()
+
+    errors = [error for _, error in results if error is not None]
+    if errors:
+        _, message, exc = min(errors, key=lambda error: error[0])
+        raise EventHandlingException(message) from exc
+
+    merged_dues = {}
+    for dues, _ in results:
+        merged_dues.update(dues)
+    for email in members_order:
+        engine.dues[email] = merged_dues[email]
+    for house_rules_event in house_rules_events:
+        engine.handlers[house_rules_event.type](house_rules_event, engine.dues, engine.rates, engine.account_balance)
+    if reader_error:
+        raise reader_error
+    if event is not None:
+        engine.last_event_date = event.date
+
+
+class ReplayPosition:
+    """Count and sha256 of the event source lines replayed so far"""
+    __slots__ = ('lines', 'digest')
+
+    def __init__(self):
+        self.lines = 0
+        self.digest = sha256()
+
+    def update(self, line: str):
+        self.lines += 1
+        self.digest.update(line.encode('utf-8'))
+
+    def track(self, event_source: Iterable[str]) -> Iterable[str]:
+        for line in event_source:
+            self.update(line)
+            yield line
+
+
+class Checkpoint:
+    """
+    State of an EventEngine after replaying the first `lines` lines of an event source, `digest` is the sha256 of
+    these lines. Saved as a dsv file of records tagged by their first value:
+
+        skladkoinator checkpoint;<version>
+        position;<lines>;<sha256>;<last event date>
+        default_rate;<rate>
+        max_prepaid_dues_count;<count>
+        rate;<email>;<rate>
+        account_balance;<balance>
+        member;<dues key>;<entry date>;<email>;<balance>[;<date>;<dues balance>;<transaction amount>...]
+    """
+    HEADER = ['skladkoinator checkpoint', '1']
+
+    def __init__(self, records: List[List[str]]):
+        if not records or records[0] != self.HEADER:
+            raise CheckpointException("not a skladkoinator checkpoint")
+        self.records = records
+        position = next(filter(lambda record: record[0] == 'position', records), None)
+        if position is None:
+            raise CheckpointException("checkpoint without a position")
+        position += [''] * (4 - len(position))
+        self.lines, self.digest = int(position[1]), position[2]
+        self.last_event_date = parse_datetime(position[3]) if position[3] else None
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as checkpoint_file:
+            return cls(list(filter(None, dsv_reader(checkpoint_file))))
+
+    def restore(self, engine: EventEngine):
+        for record in self.records[1:]:
+            kind, values = record[0], record[1:]
+            if kind == 'default_rate':
+                HouseRules.default_rate = Decimal(values[0])
+            elif kind == 'max_prepaid_dues_count':
+                engine.rates.max_prepaid_dues_count = float(values[0]) if values[0] == 'inf' else int(values[0])
+            elif kind == 'rate':
+                engine.rates[values[0]] = Decimal(values[1])
+            elif kind == 'account_balance':
+                engine.account_balance.balance = Decimal(values[0])
+            elif kind == 'member':
+                key, entry_date, email, balance = values[:4]
+                hacker_dues = HackerDues(parse_datetime(entry_date) if entry_date else None, email,
+                                         Decimal(balance))
+                history = values[4:]
+                for offset in range(0, len(history), 3):
+                    date, dues_balance, amount = history[offset:offset + 3]
+                    hacker_dues.dues_history.append(DuesHistoryRecord(date, Decimal(dues_balance), Decimal(amount)))
+                engine.dues[key] = hacker_dues
+        engine.last_event_date = self.last_event_date
+
+    @classmethod
+    def dump(cls, engine: EventEngine, position: ReplayPosition) -> Iterable[list]:
+        yield cls.HEADER
+        yield ['position', position.lines, position.digest.hexdigest(), engine.last_event_date or '']
+        yield ['default_rate', HouseRules.default_rate]
+        yield ['max_prepaid_dues_count', engine.rates.max_prepaid_dues_count]
+        for email, rate in engine.rates.rates.items():
+            yield ['rate', email, rate]
+        yield ['account_balance', engine.account_balance.get_balance()]
+        for key, hacker_dues in engine.dues.items():
+            record = ['member', key, hacker_dues.entry_date or '', hacker_dues.email, hacker_dues.balance]
+            for history_record in hacker_dues.dues_history:
+                record += [history_record.date, history_record.dues_balance, history_record.transaction_amount]
+            yield record
+
+    @classmethod
+    def save(cls, path, engine: EventEngine, position: ReplayPosition):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as checkpoint_file, DsvWriter(checkpoint_file) as writer:
+                writer.writerows(cls.dump(engine, position))
+            os.replace(temporary_path, path)
+        finally:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+
+def checkpointed_replay(engine: EventEngine, event_source: Iterable[str], checkpoint_path,
+                        partitions: int = 1) -> ReplayPosition:
+    """
+    Replay of `event_source` resumed from the checkpoint at `checkpoint_path`, when there is one and the event source
+    starts with the lines it was made from. Otherwise all events are replayed. The checkpoint is updated afterwards.
+    With more than one of `partitions` the replay is a partitioned_replay.
+    """
+    position = ReplayPosition()
+    try:
+        checkpoint = Checkpoint.load(checkpoint_path)
+    except FileNotFoundError:
+        checkpoint = None
+    except (OSError, ValueError, CheckpointException) as e:
+        print(f"ignoring checkpoint {checkpoint_path}: {e}", file=sys.stderr)
+        checkpoint = None
+
+    if checkpoint is not None:
+        seekable = getattr(event_source, 'seekable', lambda: False)()
+        prefix = []
+        for line in islice(event_source, checkpoint.lines):
+            position.update(line)
+            if not seekable:
+                prefix.append(line)
+        if position.lines == checkpoint.lines and position.digest.hexdigest() == checkpoint.digest:
+            checkpoint.restore(engine)
+        else:
+            print(f"events changed since checkpoint {checkpoint_path}, replaying all of them", file=sys.stderr)
+            position = ReplayPosition()
+            if seekable:
+                event_source.seek(0)
+            else:
+                event_source = chain(prefix, event_source)
+
+    partitioned_replay(engine, event_reader(position.track(event_source)), partitions)
+    Checkpoint.save(checkpoint_path, engine, position)
+    return position
+
+
+class LedgerException(Exception):
+    pass
 
 
-if __name__ == "__main__":
-    import sys
+# events setting the balance of the member from MEMBER_EVENT_ARGS, recorded in the ledger
+BALANCE_EVENTS = {'newMember', 'dueSet', 'dueAdd', 'transaction'}
+
+
+class MemberLedger:
+    """
+    Balances of a member after events changing it, sorted by date. `months` is the number of months the ledger
+    clock had ticked when the balance was recorded, `entry_dates` the entry date the member had then.
+    """
+    __slots__ = ('dates', 'balances', 'months', 'entry_dates')
+
+    def __init__(self):
+        self.dates = []
+        self.balances = []
+        self.months = []
+        self.entry_dates = []
+
+    def append(self, hacker_dues: HackerDues, date: datetime, month: int):
+        self.dates.append(date)
+        self.balances.append(hacker_dues.balance)
+        self.months.append(month)
+        self.entry_dates.append(hacker_dues.entry_date)
+
+
+class DuesLedger:
+    """
+    Balances of members over time, recorded while events are replayed:
+
+        ledger = DuesLedger()
+        engine.run(ledger.recorded(events, engine.dues))
+        ledger.balance('adam@example.com', datetime(2020, 3, 31))
 
+    Every member has a MemberLedger of balances set by events, monthly charges are counted from the dates of
+    nextMonth events (the ledger clock) the way AccrualClock does it. A balance at a date is a bisect of the member
+    ledger and of the clock. Monthly snapshots of balances of all members are computed once and cached.
+
+    Only builtin events are understood and the events have to be sorted by date (as example_pipeline.sh sorts
+    them), a balance at a date is the balance after all events of that date.
+    """
+
+    def __init__(self):
+        self.members: Dict[str, MemberLedger] = {}
+        self.clock = AccrualClock()
+        self.last_date = None
+        self.month_snapshots: Dict[int, Dict[str, Decimal]] = {}
+
+    def recorded(self, events: Iterable[Event], dues: Mapping[str, HackerDues]) -> Iterable[Event]:
+        """
+        `events` passed through to EventEngine.run. An event is recorded when the engine asks for the next one, so
+        after its handler has changed `dues`, the dues of the engine.
+        """
+        for event in events:
+            if self.last_date is not None and event.date < self.last_date:
+                raise LedgerException(f"events have to be sorted by date, {event.as_dsv()} is after {self.last_date}")
+            self.last_date = event.date
+            # read before the handler, newMember pops the email from args
+            email = event.args[MEMBER_EVENT_ARGS[event.type]] if event.type in BALANCE_EVENTS else None
+            yield event
+            if event.type == 'nextMonth':
+                self.clock.tick(event.date)
+            elif email in dues:
+                self.members.setdefault(email, MemberLedger()).append(dues[email], event.date, self.clock.month)
+
+    def month(self, date: datetime) -> int:
+        """Number of months ticked until the end of the day `date`"""
+        return bisect_right(self.clock.ticks, date)
+
+    def balance_at(self, member: MemberLedger, date: datetime, month: int):
+        position = bisect_right(member.dates, date) - 1
+        if position < 0:
+            return None
+        return self.clock.charge(member.balances[position], member.entry_dates[position], member.months[position],
+                                 month)
+
+    def balance(self, email: str, date: datetime):
+        """Balance of the member after all events dated `date` or earlier, None if not a member by then"""
+        member = self.members.get(email)
+        return None if member is None else self.balance_at(member, date, self.month(date))
+
+    def balances(self, date: datetime) -> Dict[str, Decimal]:
+        """Balances of all members at `date`"""
+        month = self.month(date)
+        balances = map(lambda member: (member[0], self.balance_at(member[1], date, month)), self.members.items())
+        return {email: balance for email, balance in balances if balance is not None}
+
+    def arrears(self, date: datetime) -> Dict[str, Decimal]:
+        """Balances of members in arrears (with a negative balance) at `date`"""
+        return {email: balance for email, balance in self.balances(date).items() if balance < 0}
+
+    def history(self, email: str, start: datetime = None, end: datetime = None) -> List[tuple]:
+        """(date, balance) of events changing the balance of the member between `start` and `end` (inclusive)"""
+        member = self.members.get(email)
+        if member is None:
+            return []
+        first = 0 if start is None else bisect_left(member.dates, start)
+        last = len(member.dates) if end is None else bisect_right(member.dates, end)
+        return list(zip(member.dates[first:last], member.balances[first:last]))
+
+    def snapshot(self, month: int) -> Dict[str, Decimal]:
+        """Balances of all members right after the `month` (counting from 1) was ticked by nextMonth"""
+        if month not in self.month_snapshots:
+            balances = map(lambda member: (member[0], self.member_snapshot(member[1], month)), self.members.items())
+            self.month_snapshots[month] = {email: balance for email, balance in balances if balance is not None}
+        return self.month_snapshots[month]
+
+    def member_snapshot(self, member: MemberLedger, month: int):
+        # the last balance recorded before the month was ticked
+        position = bisect_right(member.months, month - 1) - 1
+        if position < 0:
+            return None
+        return self.clock.charge(member.balances[position], member.entry_dates[position], member.months[position],
+                                 month)
+
+    def snapshots(self, start: datetime = None, end: datetime = None) -> Iterable[tuple]:
+        """(date, balances) of months ticked between `start` and `end` (inclusive)"""
+        first = 0 if start is None else bisect_left(self.clock.ticks, start)
+        last = self.clock.month if end is None else self.month(end)
+        for month in range(first + 1, last + 1):
+            yield self.clock.ticks[month - 1], self.snapshot(month)
+
+
+def query_rows(ledger: DuesLedger, emails: List[str] = None, dates: List[datetime] = (), start: datetime = None,
+               end: datetime = None, monthly: bool = False, arrears: bool = False) -> Iterable[list]:
+    """
+    date;email;balance records answering a query: balances at `dates`, monthly snapshots between `start` and `end`
+    or, without any of these, balance changes between `start` and `end`. Of all members unless `emails` are given.
+    """
+    def member_rows(date: datetime, balances: Mapping[str, Decimal]) -> Iterable[list]:
+        for email in (balances if emails is None else emails):
+            balance = balances.get(email)
+            if balance is not None and (not arrears or balance < 0):
+                yield [date, email, balance]
+
+    for date in dates:
+        if emails is None:
+            yield from member_rows(date, ledger.balances(date))
+        else:
+            yield from member_rows(date, {email: ledger.balance(email, date) for email in emails})
+    if monthly:
+        for date, balances in ledger.snapshots(start, end):
+            yield from member_rows(date, balances)
+    if not dates and not monthly:
+        for email in (ledger.members if emails is None else emails):
+            for date, balance in ledger.history(email, start, end):
+                if not arrears or balance < 0:
+                    yield [date, email, balance]
+
+
+if __name__ == "__main__":
     hacker_cli_argparse = argparse.ArgumentParser()
-    hacker_cli_argparse.add_argument("-if", action="store", dest="input_file", default="-", required=False)
+    hacker_cli_argparse.add_argument("-if", action="append", dest="input_files", default=None, required=False,
+                                     help="event file, stdin by default. Events of many files are sorted together")
     hacker_cli_argparse.add_argument("-of", action="store", dest="output_file", default="-", required=False)
+    hacker_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=1, required=False,
+                                     help="processes parsing the input file, 0 for all cpus, 1 parses it serially")
+    hacker_cli_argparse.add_argument("--lazy-accrual", action="store_true", dest="lazy_accrual", default=False,
+                                     required=False, help="charge members when their balance is read instead of on "
+                                                          "every nextMonth event, faster when members pay rarely")
+    hacker_cli_argparse.add_argument("--checkpoint", action="store", dest="checkpoint", default=None, required=False,
+                                     help="state file to resume the replay from and save it to, events are read by a "
+                                          "single process then")
+    hacker_cli_argparse.add_argument("-p", action="store", dest="partitions", type=int, default=1, required=False,
+                                     help="processes replaying events partitioned by member, 0 for all cpus")
+    hacker_cli_argparse.add_argument("--sort", action="store_true", dest="sort", default=False, required=False,
+                                     help="sort events by date (see sort_events.py)")
+    hacker_cli_argparse.add_argument("--merge", action="store_true", dest="merge", default=False, required=False,
+                                     help="merge events of already sorted files")
+
+    subparsers = hacker_cli_argparse.add_subparsers(dest='command', help='subcommands')
+    query_cmd_parser = subparsers.add_parser('query', help="balances of members over time, the whole event log is "
+                                                           "replayed by a single process")
+    query_cmd_parser.add_argument("-e", action="append", dest="emails", default=None, required=False,
+                                  help="member email, all members by default")
+    query_cmd_parser.add_argument("-d", action="append", dest="dates", type=parse_datetime, default=[],
+                                  required=False, help="balances after all events of the date")
+    query_cmd_parser.add_argument("--from", action="store", dest="start", type=parse_datetime, default=None,
+                                  required=False)
+    query_cmd_parser.add_argument("--to", action="store", dest="end", type=parse_datetime, default=None,
+                                  required=False)
+    query_cmd_parser.add_argument("--monthly", action="store_true", dest="monthly", default=False, required=False,
+                                  help="balances right after every nextMonth between --from and --to")
+    query_cmd_parser.add_argument("--arrears", action="store_true", dest="arrears", default=False, required=False,
+                                  help="only negative balances")
 
     args = hacker_cli_argparse.parse_args()
-    input_file = sys.stdin if args.input_file == '-' else open(args.input_file)
+    input_files = open_event_sources(args.input_files or ['-'])
+    if args.merge:
+        input_file = merge_events(input_files)
+    elif args.sort or len(input_files) > 1:
+        input_file = sort_events(input_files)
+    else:
+        input_file, = input_files
     output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
 
-    dues_rates = HouseRules()
-    dues_record = {}
-    account_balance = AccountState()
-    event_handler = partial(handle_event, dues=dues_record, rates=dues_rates, account_balance=account_balance)
-    list(map(event_handler, event_reader(input_file)))
-
-    output_file.writelines(dsv_generator(dues_record.values()))
+    engine = EventEngine(lazy_accrual=args.lazy_accrual)
+    if args.command == 'query':
+        ledger = DuesLedger()
+        engine.run(ledger.recorded(event_reader(input_file, args.workers), engine.dues))
+        with DsvWriter(output_file) as writer:
+            writer.writerows(query_rows(ledger, args.emails, args.dates, args.start, args.end, args.monthly,
+                                        args.arrears))
+        sys.exit(0)
+
+    if args.checkpoint:
+        checkpointed_replay(engine, input_file, args.checkpoint, args.partitions)
+    else:
+        partitioned_replay(engine, event_reader(input_file, args.workers), args.partitions)
+
+    with DsvWriter(output_file) as writer:
+        writer.writerows(engine.dues.values())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import argparse
+import heapq
+import os
+import sys
+import tempfile
+from itertools import chain
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Sequence
+
+from data_structures import parse_datetime
+from dsv import dsv_record_load
+
+
+# order of events of the same date, events of other types go after them
+DEFAULT_EVENT_PRIORITY = (
+    'setDefaultDue',
+    'setMaxPrepaidDuesCount',
+    'setHackerDue',
+    'newMember',
+    'nextMonth',
+    'dueSet',
+    'dueAdd',
+    'transaction',
+)
+
+SORT_BUFFER_LINES = 1 << 18
+
+
+class SortEventsException(Exception):
+    pass
+
+
+def event_lines(event_source: Iterable[str]) -> Iterable[str]:
+    """Non blank lines of an event source, each ending with a newline"""
+    for line in event_source:
+        if line.strip():
+            yield line if line.endswith('\n') else line + '\n'
+
+
+def event_priorities(event_types: Sequence[str] = DEFAULT_EVENT_PRIORITY) -> Dict[str, int]:
+    """Priorities of event types, events of types missing in the dict go after the listed ones"""
+    return {event_type: priority for priority, event_type in enumerate(event_types)}
+
+
+def event_sort_key(event_types: Sequence[str] = DEFAULT_EVENT_PRIORITY) -> Callable[[str], tuple]:
+    """
+    Sort key of event lines: the event date, the position of the event type in `event_types` and finally the line
+    itself, so events are ordered the same way whatever order they are read in.
+    """
+    priorities = event_priorities(event_types)
+    unlisted = len(priorities)
+
+    def sort_key(line: str) -> tuple:
+        date, event_type = dsv_record_load(line, columns=(0, 1))
+        try:
+            return parse_datetime(date), priorities.get(event_type, unlisted), line
+        except ValueError as e:
+            raise SortEventsException(f"invalid date of event: {line.strip()}") from e
+    return sort_key
+
+
+def sorted_keys(event_source: Iterable[str], sort_key: Callable[[str], tuple]) -> Iterable[tuple]:
+    """
+    Sort keys of lines of an already sorted event source, checking it really is sorted by date and event type
+    priority. Events with the same date and priority can come in any order, they keep it when merged.
+    """
+    previous = None
+    for key in map(sort_key, event_lines(event_source)):
+        if previous is not None and key[:2] < previous[:2]:
+            raise SortEventsException(f"events aren't sorted, {key[2].strip()} is after {previous[2].strip()}")
+        previous = key
+        yield key
+
+
+def merge_events(event_sources: Iterable[Iterable[str]],
+                 event_types: Sequence[str] = DEFAULT_EVENT_PRIORITY) -> Iterable[str]:
+    """Lines of already sorted event sources merged into one sorted stream, reading one line of each at a time"""
+    sort_key = event_sort_key(event_types)
+    return map(itemgetter(2), heapq.merge(*map(lambda source: sorted_keys(source, sort_key), event_sources)))
+
+
+def sort_events(event_sources: Iterable[Iterable[str]], event_types: Sequence[str] = DEFAULT_EVENT_PRIORITY,
+                buffer_lines: int = SORT_BUFFER_LINES) -> Iterable[str]:
+    """
+    Lines of event sources sorted by event_sort_key. At most `buffer_lines` lines are kept in memory, longer input
+    is sorted in runs of that many lines spilled to temporary files and merged.
+    """
+    sort_key = event_sort_key(event_types)
+    with tempfile.TemporaryDirectory(prefix='sort_events') as tmp_dir:
+        runs = []
+        buffer = []
+        for line in chain.from_iterable(map(event_lines, event_sources)):
+            buffer.append(sort_key(line))
+            if len(buffer) >= buffer_lines:
+                buffer.sort()
+                run_path = os.path.join(tmp_dir, f"run{len(runs)}")
+                with open(run_path, 'w', encoding='utf-8') as run_file:
+                    run_file.writelines(map(itemgetter(2), buffer))
+                runs.append(run_path)
+                buffer = []
+        buffer.sort()
+
+        run_files = [open(run_path, encoding='utf-8') for run_path in runs]
+        try:
+            yield from map(itemgetter(2), heapq.merge(buffer, *map(lambda f: map(sort_key, f), run_files)))
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+
+def open_event_sources(paths: Sequence[str]) -> list:
+    return list(map(lambda path: sys.stdin if path == '-' else open(path), paths))
+
+
+if __name__ == "__main__":
+    hacker_cli_argparse = argparse.ArgumentParser()
+    hacker_cli_argparse.add_argument("-if", action="append", dest="input_files", default=None, required=False,
+                                     help="event file, can be given many times, stdin by default")
+    hacker_cli_argparse.add_argument("-of", action="store", dest="output_file", default="-", required=False)
+    hacker_cli_argparse.add_argument("-m", action="store_true", dest="merge", default=False, required=False,
+                                     help="merge already sorted files")
+    hacker_cli_argparse.add_argument("-t", action="store", dest="event_types", default=','.join(DEFAULT_EVENT_PRIORITY),
+                                     required=False, help="comma separated order of events of the same date")
+    hacker_cli_argparse.add_argument("-S", action="store", dest="buffer_lines", type=int, default=SORT_BUFFER_LINES,
+                                     required=False, help="lines sorted in memory")
+
+    args = hacker_cli_argparse.parse_args()
+    input_files = open_event_sources(args.input_files or ['-'])
+    output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
+    event_types = list(filter(None, map(str.strip, args.event_types.split(','))))
+
+    if args.merge:
+        output_file.writelines(merge_events(input_files, event_types))
+    else:
+        output_file.writelines(sort_events(input_files, event_types, args.buffer_lines))
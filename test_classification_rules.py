@@ -0,0 +1,112 @@
+from classification_rules import ClassificationRule, ClassificationRuleException, load_classification_rules
+from classification_rules import normalize_account, TransactionClassifier
+from data_structures import Transaction, TransactionClassification as C
+from contextlib import redirect_stderr
+from io import StringIO
+import random
+import re
+import unittest
+
+
+def transaction(subject='', amount='100.00', account='', contractor_address=''):
+    return Transaction('2020-01-01', '', account, subject, contractor_address, amount, 'PLN', 'Credit')
+
+
+def naive_match(rules, t):
+    for rule in rules:
+        if rule.subject and not re.search(rule.subject, t.subject, re.IGNORECASE | re.DOTALL):
+            continue
+        if rule.amount_sign and rule.amount_sign != ('+' if t.amount > 0 else '-' if t.amount < 0 else ''):
+            continue
+        if rule.accounts and normalize_account(t.contractor_account_number) not in rule.accounts:
+            continue
+        if rule.contractor and not re.search(rule.contractor, t.contractor_address, re.IGNORECASE | re.DOTALL):
+            continue
+        return rule.classification
+    return None
+
+
+RULES_DSV = """rent_and_media;;-;PL 11 2222,PL993333
+donation;darowizna|wsparcie;+
+due;sk.adka?
+rent_and_media;energ;-;;tauron|pgnig
+other_outcome;;-
+other_income;;+
+"""
+
+
+class TestTransactionClassifier(unittest.TestCase):
+
+    def test_default_rules(self):
+        classifier = TransactionClassifier()
+        for t, classification in [
+            (transaction('Składka członkowska'), C.DUE),
+            (transaction('  SKLADKA  '), C.DUE),
+            (transaction('zwrot składki', '-10'), C.DUE),
+            (transaction('faktura', '-10'), C.OTHER_OUTCOME),
+            (transaction('przelew'), C.OTHER_INCOME),
+        ]:
+            with self.subTest(subject=t.subject, amount=t.amount):
+                self.assertEqual(classifier.classify(t), classification)
+        self.assertTrue(classifier.is_due(transaction('składka')))
+        self.assertFalse(classifier.is_due(transaction('faktura')))
+
+    def test_unknown(self):
+        warnings = StringIO()
+        with redirect_stderr(warnings):
+            self.assertEqual(TransactionClassifier().classify(transaction('przelew', '0')), C.UNKNOWN)
+        self.assertIn('cannot classify transaction', warnings.getvalue())
+        self.assertIsNone(TransactionClassifier().match(transaction('przelew', '0')))
+
+    def test_rules_file(self):
+        rules = load_classification_rules(StringIO(RULES_DSV))
+        self.assertEqual(rules[0].accounts, {'PL112222', 'PL993333'})
+        self.assertEqual(load_classification_rules(map(lambda r: ';'.join(r.as_dsv()), rules))[0].as_dsv(),
+                         rules[0].as_dsv())
+        classifier = TransactionClassifier(rules)
+        for t, classification in [
+            (transaction('czynsz 01/2020', '-2000', account='PL112222'), C.RENT_AND_MEDIA),
+            (transaction('składka', '-2000', account='PL 99 3333'), C.RENT_AND_MEDIA),
+            (transaction('Energia 01', '-100', contractor_address='TAURON Sprzedaż'), C.RENT_AND_MEDIA),
+            (transaction('Energia 01', '-100', contractor_address='Elektrownia'), C.OTHER_OUTCOME),
+            (transaction('Wsparcie hackerspace'), C.DONATION),
+            (transaction('składka i darowizna'), C.DONATION),
+            (transaction('składka'), C.DUE),
+            (transaction('czynsz', '-2000', account='PL000000'), C.OTHER_OUTCOME),
+        ]:
+            with self.subTest(subject=t.subject, account=t.contractor_account_number):
+                self.assertEqual(classifier.classify(t), classification)
+
+    def test_invalid_rules(self):
+        for record in [['due', '('], ['due', '', '*'], ['rent'], ['other_outcome', '', '', '', '[a-']]:
+            with self.subTest(record=record), self.assertRaises(ClassificationRuleException):
+                ClassificationRule.from_dsv(record)
+
+    def test_rules_breaking_combined_regex(self):
+        for rules, pattern in [([ClassificationRule(C.DUE, 'składka'),
+                                 ClassificationRule(C.OTHER_INCOME, '(?i)zwrot')], 'zwrot'),
+                               ([ClassificationRule(C.DUE, contractor='(?P<r0>tauron)'),
+                                 ClassificationRule(C.OTHER_OUTCOME, contractor='orange')], 'tauron')]:
+            with self.subTest(pattern=pattern), self.assertRaisesRegex(ClassificationRuleException, pattern):
+                TransactionClassifier(rules)
+
+    def test_random_rules(self):
+        generator = random.Random(18)
+        words = ['czynsz', 'składka', 'energia', 'darowizna', 'faktura', 'zwrot', 'internet']
+        accounts = ['PL1', 'PL2', 'PL3']
+        rules = [ClassificationRule(generator.choice(list(C)), generator.choice(['', *words, 'sk.adka?|zwrot']),
+                                    generator.choice(['', '+', '-']),
+                                    generator.sample(accounts, generator.randint(0, 2)),
+                                    generator.choice(['', 'tauron', 'orange|netia']))
+                 for _ in range(30)]
+        classifier = TransactionClassifier(rules)
+        for _ in range(1000):
+            t = transaction(' '.join(generator.sample(words, 2)).title(), generator.choice(['-1', '0', '1']),
+                            generator.choice(accounts), generator.choice(['TAURON', 'Netia SA', 'Jan Kowalski']))
+            with self.subTest(subject=t.subject, amount=t.amount, account=t.contractor_account_number,
+                              contractor_address=t.contractor_address):
+                self.assertEqual(classifier.match(t), naive_match(rules, t))
+
+
+if __name__ == '__main__':
+    unittest.main()
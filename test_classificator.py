@@ -0,0 +1,205 @@
+from classification_rules import ClassificationRule, TransactionClassifier
+from classificator import ClassificatorStateException, generate_monthly_report, incremental_monthly_report
+from classificator import MonthlyReportState, monthly_report_as_dsv
+from data_structures import TransactionClassification
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from monthly_totals import MonthlyTotals
+from unittest import mock
+import monthly_totals
+from transactions2dues import parse_transactions
+import os
+import random
+import tempfile
+import unittest
+
+
+def random_transaction_lines(generator: random.Random, count: int):
+    start = datetime(2019, 1, 1)
+    subjects = ['składka Jan Kowalski', 'czynsz', 'darowizna', 'faktura']
+    for i in range(count):
+        date = start + timedelta(days=generator.randint(0, 364))
+        amount = f"{generator.randint(-5000, 5000) / 100:.2f}"
+        yield f"{date.isoformat()};{i};PL{generator.randint(1, 3)};{generator.choice(subjects)};;{amount};PLN;Credit\n"
+
+
+class CountingClassifier(TransactionClassifier):
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.classified = 0
+
+    def classify(self, transaction):
+        self.classified += 1
+        return super().classify(transaction)
+
+
+def report_dsv(report):
+    return list(monthly_report_as_dsv(report))
+
+
+class TestIncrementalMonthlyReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.state_path = os.path.join(self.tmp_dir.name, 'state.dsv')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_random_history(self):
+        generator = random.Random(19)
+        lines = sorted(random_transaction_lines(generator, 500))
+        state = MonthlyReportState()
+        for end in (100, 250, 250, 500):
+            history = lines[:end]
+            state = incremental_monthly_report(history, state)
+            state.save(self.state_path)
+            state = MonthlyReportState.load(self.state_path)
+            with self.subTest(end=end):
+                self.assertEqual(report_dsv(state.report()), report_dsv(generate_monthly_report(
+                    parse_transactions(history))))
+                self.assertEqual(state.watermark, max(map(lambda t: t.date, parse_transactions(history))).date()
+                                 .replace(day=1))
+
+    def test_changed_months(self):
+        generator = random.Random(20)
+        lines = sorted(random_transaction_lines(generator, 300))
+        state = incremental_monthly_report(lines, MonthlyReportState())
+        self.assertEqual(state.watermark, date(2019, 12, 1))
+        classifier = CountingClassifier()
+        incremental_monthly_report(lines, state, classifier)
+        self.assertEqual(classifier.classified, 0)
+
+        # months before the watermark are skipped, a change of the watermark month and a new month are classified
+        december = list(filter(lambda line: line.startswith('2019-12'), lines))
+        changed_lines = [lines[0].replace('PLN', 'EUR')] + lines[1:-1] + [lines[-1].replace('PLN', 'EUR')]
+        new_line = "2020-01-10T00:00:00;300;PL1;składka;;100.00;PLN;Credit\n"
+        updated = incremental_monthly_report(changed_lines + [new_line], state, classifier)
+        self.assertEqual(classifier.classified, len(december) + 1)
+        self.assertEqual(updated.watermark, date(2020, 1, 1))
+        self.assertEqual(report_dsv(updated.report()), report_dsv(generate_monthly_report(
+            parse_transactions(lines + [new_line]))))
+
+    def test_unsorted_history(self):
+        lines = sorted(random_transaction_lines(random.Random(25), 100))
+        state = incremental_monthly_report(lines[:50], MonthlyReportState())
+        for history in (lines[50:] + lines[:50], lines[:50] + lines[-1:] + lines[50:-1]):
+            with self.subTest(), self.assertRaises(ClassificatorStateException):
+                incremental_monthly_report(history, state)
+
+    def test_changed_rules(self):
+        lines = sorted(random_transaction_lines(random.Random(21), 100))
+        state = incremental_monthly_report(lines, MonthlyReportState())
+        rules = [ClassificationRule(TransactionClassification.DONATION, subject='darowizna')]
+        classifier = CountingClassifier(rules + list(TransactionClassifier().rules))
+        updated = incremental_monthly_report(lines, state, classifier)
+        self.assertEqual(classifier.classified, len(lines))
+        self.assertEqual(report_dsv(updated.report()), report_dsv(generate_monthly_report(parse_transactions(lines),
+                                                                                          classifier)))
+
+    def test_invalid_state(self):
+        with open(self.state_path, 'w') as state_file:
+            state_file.write("skladkoinator checkpoint;1\n")
+        with self.assertRaises(ClassificatorStateException):
+            MonthlyReportState.load(self.state_path)
+
+
+def naive_totals(classified, start, end):
+    totals = {}
+    for month, classification, amount in classified:
+        if start <= (month.year, month.month) < end:
+            totals[classification] = totals.get(classification, 0) + amount
+    return totals
+
+
+def shift(year_month, months):
+    index = year_month[0] * 12 + year_month[1] - 1 + months
+    return index // 12, index % 12 + 1
+
+
+class TestMonthlyTotals(unittest.TestCase):
+
+    def random_classified(self, generator, count):
+        for _ in range(count):
+            month = date(generator.randint(2018, 2020), generator.randint(1, 12), 1)
+            amount = Decimal(generator.randint(-10000, 10000)).scaleb(-2)
+            yield month, generator.choice(list(TransactionClassification)), amount
+
+    def check_periods(self):
+        generator = random.Random(22)
+        classified = list(self.random_classified(generator, 300))
+        totals = MonthlyTotals(classified)
+        months = sorted(set((m.year, m.month) for m, _, _ in classified))
+        expected = {
+            'month': {date(y, m, 1): naive_totals(classified, (y, m), shift((y, m), 1)) for y, m in months},
+            'quarter': {f"{y}-Q{(m - 1) // 3 + 1}": naive_totals(classified, (y, m - (m - 1) % 3),
+                                                                 shift((y, m - (m - 1) % 3), 3)) for y, m in months},
+            'year': {str(y): naive_totals(classified, (y, 1), (y + 1, 1)) for y, m in months},
+            'rolling3': {date(y, m, 1): naive_totals(classified, shift((y, m), -2), shift((y, m), 1))
+                         for y, m in months},
+            'rolling12': {date(y, m, 1): naive_totals(classified, shift((y, m), -11), shift((y, m), 1))
+                          for y, m in months},
+        }
+        for period, report in expected.items():
+            with self.subTest(period=period):
+                self.assertEqual(dict(totals.report(period)), report)
+        self.assertEqual(totals.range_totals(date(2019, 1, 1), date(2020, 1, 1)),
+                         naive_totals(classified, (2019, 1), (2020, 1)))
+        self.assertEqual(totals.range_totals(date(2010, 1, 1), date(2011, 1, 1)), {})
+
+    @unittest.skipIf(monthly_totals.numpy is None, "numpy isn't installed")
+    def test_periods(self):
+        self.check_periods()
+
+    def test_periods_without_numpy(self):
+        with mock.patch.object(monthly_totals, 'numpy', None):
+            self.check_periods()
+
+    def test_empty(self):
+        self.assertEqual(MonthlyTotals([]).report('quarter'), {})
+
+    def check_exact_totals(self):
+        C = TransactionClassification
+        self.assertEqual(str(MonthlyTotals([(date(2020, 1, 1), C.DUE, Decimal('0.00'))]).report()[date(2020, 1, 1)][
+            C.DUE]), '0.00')
+        classified = [(date(2020, 1, 1), C.DUE, Decimal(amount)) for amount in ('0.001', '0.005', '0.015', '-0.125')]
+        classified += [(date(2020, 2, 1), C.DUE, Decimal('1.5')), (date(2020, 2, 1), C.OTHER_INCOME, Decimal('100'))]
+        totals = MonthlyTotals(classified)
+        self.assertEqual(list(map(lambda row: {c: str(amount) for c, amount in row.items()}, totals.report().values())),
+                         [{C.DUE: '-0.104'}, {C.DUE: '1.50', C.OTHER_INCOME: '100.00'}])
+        self.assertEqual(str(totals.report('quarter')['2020-Q1'][C.DUE]), '1.396')
+
+    def check_classifications_order(self):
+        C = TransactionClassification
+        classified = [(date(2020, 2, 1), C.OTHER_INCOME, Decimal('1')), (date(2020, 1, 1), C.UNKNOWN, Decimal('2')),
+                      (date(2020, 1, 1), C.DUE, Decimal('3')), (date(2020, 2, 1), C.DUE, Decimal('4'))]
+        totals = MonthlyTotals(classified)
+        self.assertEqual(list(map(list, totals.report().values())), [[C.UNKNOWN, C.DUE], [C.OTHER_INCOME, C.DUE]])
+        self.assertEqual(list(totals.report('quarter')['2020-Q1']), [C.OTHER_INCOME, C.UNKNOWN, C.DUE])
+
+    @unittest.skipIf(monthly_totals.numpy is None, "numpy isn't installed")
+    def test_exact_totals(self):
+        self.check_exact_totals()
+
+    def test_exact_totals_without_numpy(self):
+        with mock.patch.object(monthly_totals, 'numpy', None):
+            self.check_exact_totals()
+
+    @unittest.skipIf(monthly_totals.numpy is None, "numpy isn't installed")
+    def test_classifications_order(self):
+        self.check_classifications_order()
+
+    def test_classifications_order_without_numpy(self):
+        with mock.patch.object(monthly_totals, 'numpy', None):
+            self.check_classifications_order()
+
+    def test_last_periods(self):
+        report = {date(2020, m, 1): {TransactionClassification.DUE: Decimal(m)} for m in range(1, 6)}
+        self.assertEqual(list(map(lambda record: record[0], monthly_report_as_dsv(report, last=3))),
+                         ['2020-05-01', '2020-04-01', '2020-03-01'])
+        self.assertEqual(list(monthly_report_as_dsv(report, last=0)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+from data_structures import DuesHistoryRecord, Event, Hacker, HackerDues, Transaction
+from decimal import Decimal
+import pickle
+import unittest
+
+
+class TestCompactDataStructures(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.objects = [
+            Hacker('1', 'nick1', '2020-01-01', 'test@example.com', 'n1', 'sn1', 'g1'),
+            Event('2020-07-05', 'transaction', '100, adam@example.com', 'składka'),
+            Transaction('2019-09-27T00:00:00', '70001104', '21203000451110000002182130', 'Przelew własny',
+                        'Graffic Services', '-1100.00', 'PLN', 'Debit'),
+            DuesHistoryRecord('2020-07-05', Decimal(-4), Decimal(100)),
+            HackerDues(None, 'adam@example.com', Decimal(-4)),
+        ]
+
+    def test_no_instance_dict(self):
+        for o in self.objects:
+            with self.subTest(cls=o.__class__.__name__):
+                self.assertFalse(hasattr(o, '__dict__'))
+
+    def test_as_dsv(self):
+        hacker, event, _, history_record, hacker_dues = self.objects
+        hacker_dues.dues_history.append(history_record)
+        self.assertEqual(hacker.as_dsv(), '1;nick1;2020-01-01;test@example.com;n1;sn1;g1')
+        self.assertEqual(event.as_dsv(), '2020-07-05 00:00:00;transaction;100,adam@example.com;składka')
+        self.assertEqual(hacker_dues.as_dsv(), 'adam@example.com;-4;2020-07-05 00:00:00,100,-4')
+
+    def test_hacker_columns(self):
+        hacker = self.objects[0]
+        self.assertEqual(Hacker(*map(lambda column: getattr(hacker, column), Hacker.columns)).as_dsv(), hacker.as_dsv())
+
+    def test_pickle(self):
+        _, _, transaction, history_record, hacker_dues = self.objects
+        hacker_dues.dues_history.append(history_record)
+        self.assertEqual(pickle.loads(pickle.dumps(transaction)), transaction)
+        self.assertEqual(pickle.loads(pickle.dumps(history_record)), history_record)
+        self.assertEqual(pickle.loads(pickle.dumps(hacker_dues)).as_dsv(), hacker_dues.as_dsv())
+
+
+class TestLazyEvent(unittest.TestCase):
+
+    def test_same_as_eager(self):
+        fields = ('2020-07-05', 'transaction', '100, adam@example.com ', 'składka')
+        lazy_event, event = Event.lazy(*fields), Event(*fields)
+        self.assertEqual(lazy_event.as_dsv(), event.as_dsv())
+        self.assertEqual((lazy_event.date, lazy_event.type, lazy_event.args, lazy_event.comment),
+                         (event.date, event.type, event.args, event.comment))
+
+    def test_decoded_on_access(self):
+        event = Event.lazy('not a date', 'newMember', 'adam@example.com')
+        self.assertEqual(event.args.pop(), 'adam@example.com')
+        self.assertEqual(event.args, [])
+        with self.assertRaises(ValueError):
+            event.date
+
+    def test_dates_shared(self):
+        self.assertIs(Event.lazy('2020-07-01', 'nextMonth', '').date, Event('2020-07-01', 'nextMonth', '').date)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+from dsv import dsv_record_load, dsv_value_load, dsv_reader, dsv_record_dump, dsv_escape, dsv_chunks, DsvIndex, \
+    DsvWriter, parallel_dsv_reader, dsv_file_reader
+from unittest import mock
+from io import StringIO
+from pathlib import Path
+import os
+import tempfile
+import random
+import unittest
+
+
+def reference_dsv_record_load(line, delimiter=';'):
+    line = line.strip()
+    offset = 0
+    parsed = []
+    while offset < len(line):
+        value, parsed_chars = dsv_value_load(line[offset:], delimiter)
+        offset += parsed_chars
+        parsed.append(value)
+    return parsed
+
+
+test_lines = [
+    "",
+    "\n",
+    ";",
+    ";;",
+    "a",
+    "a;",
+    "a;;",
+    ";a",
+    "a;b;c\n",
+    "  a;b ;c  \n",
+    r"a\;b;c",
+    r"a\\;b",
+    r"a\nb;c\td;\q",
+    "a;\\",
+    "a\\",
+    "\\;",
+    r"2020-01-01;transaction;100,adam@example.com;komentarz\; z średnikiem",
+    r"""ffee998211;ziom1;2016-08-01;ziom@example.com;kowalski;jan;zarzad,benis""",
+]
+
+
+class TestDsvRecordLoad(unittest.TestCase):
+
+    def test_known_lines(self):
+        for delimiter in (';', ','):
+            for line in test_lines:
+                with self.subTest(line=line, delimiter=delimiter):
+                    self.assertEqual(dsv_record_load(line, delimiter), reference_dsv_record_load(line, delimiter))
+
+    def test_random_lines(self):
+        generator = random.Random(940)
+        alphabet = 'ab ;,\\ntq\t'
+        for _ in range(5000):
+            line = ''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 20)))
+            for delimiter in (';', ','):
+                with self.subTest(line=line, delimiter=delimiter):
+                    self.assertEqual(dsv_record_load(line, delimiter), reference_dsv_record_load(line, delimiter))
+
+    def test_dump_load_round_trip(self):
+        record = ['a;b', 'c\\d', 'e\nf', '', 'g']
+        self.assertEqual(dsv_record_load(dsv_record_dump(record)), record)
+
+    def test_reader(self):
+        self.assertEqual(list(dsv_reader(["a;b\n", "c\\;d;e\n"])), [['a', 'b'], ['c;d', 'e']])
+
+
+class TestDsvProjection(unittest.TestCase):
+
+    def assertProjectionEqual(self, line, columns, delimiter=';'):
+        record = reference_dsv_record_load(line, delimiter)
+        expected = [record[column] if column < len(record) else '' for column in columns]
+        self.assertEqual(dsv_record_load(line, delimiter, columns=columns), expected)
+
+    def test_known_lines(self):
+        for line in test_lines:
+            for columns in ([0], [1], [2, 0], [0, 1, 2, 3], [5]):
+                with self.subTest(line=line, columns=columns):
+                    self.assertProjectionEqual(line, columns)
+
+    def test_random_lines(self):
+        generator = random.Random(3)
+        alphabet = 'ab;;\\n'
+        for _ in range(5000):
+            line = ''.join(generator.choice(alphabet) for _ in range(generator.randint(0, 20)))
+            columns = generator.sample(range(5), generator.randint(1, 3))
+            with self.subTest(line=line, columns=columns):
+                self.assertProjectionEqual(line, columns)
+
+    def test_reader(self):
+        lines = ["a;b;c\\;d;e\n", "f;g\n", "\n"]
+        self.assertEqual(list(dsv_reader(lines, columns=[2, 0])), [['c;d', 'a'], ['', 'f'], ['', '']])
+
+
+class DsvRecord:
+    def __init__(self, *fields):
+        self.fields = fields
+
+    def as_dsv(self):
+        return dsv_record_dump(self.fields)
+
+
+class TestDsvWriter(unittest.TestCase):
+
+    def test_escape(self):
+        for value in ['a;b', 'a\\;b\nc', '\\n', ';;', 'a,b', 'zażółć']:
+            for delimiter in (';', ','):
+                with self.subTest(value=value, delimiter=delimiter):
+                    expected = value.replace('\\', '\\\\').replace('\n', '\\n').replace(delimiter, '\\' + delimiter)
+                    self.assertEqual(dsv_escape(value, delimiter), expected)
+
+    def test_records(self):
+        output = StringIO()
+        with DsvWriter(output) as writer:
+            writer.writerow(DsvRecord('a;b', 1))
+            writer.writerows([['c\nd', 2], 'e;f'])
+        self.assertEqual(output.getvalue(), 'a\\;b;1\nc\\nd;2\ne;f\n')
+
+    def test_chunks(self):
+        output = StringIO()
+        writes = []
+        output.write = lambda data: writes.append(data)
+        with DsvWriter(output, buffer_size=10) as writer:
+            writer.writerows([['abc', 'def']] * 5)
+        self.assertEqual(''.join(writes), 'abc;def\n' * 5)
+        self.assertEqual(len(writes), 3)
+
+    def test_empty(self):
+        output = StringIO()
+        with DsvWriter(output) as writer:
+            writer.writerows([])
+        self.assertEqual(output.getvalue(), '')
+
+
+class TestDsvIndex(unittest.TestCase):
+
+    lines = [
+        "1;ziom1;ziom@example.com\n",
+        "\n",
+        "2;zażółć;gęślą@example.com\n",
+        "3;a\\;b;semicolon@example.com\n",
+        "4;ziom1;other@example.com\n",
+    ]
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'hackers.dsv'
+        self.path.write_text(''.join(self.lines), encoding='utf-8')
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_lookup(self):
+        with DsvIndex(self.path, 1) as index:
+            self.assertEqual(index.records('zażółć'), [['2', 'zażółć', 'gęślą@example.com']])
+            self.assertEqual(index.records('a;b'), [['3', 'a;b', 'semicolon@example.com']])
+            self.assertEqual([r[0] for r in index.records('ziom1')], ['1', '4'])
+            self.assertEqual(index.records('nobody'), [])
+            self.assertEqual(index.records('zzz'), [])
+            self.assertNotIn('', index)
+        self.assertTrue(Path(f"{self.path}.1.idx").exists())
+
+    def test_every_key(self):
+        keys = [f"key{i}" for i in range(200)]
+        self.path.write_text(''.join(map(lambda key: f"{key};value\n", reversed(keys))))
+        with DsvIndex(self.path, 0) as index:
+            for key in keys:
+                self.assertEqual(index.records(key), [[key, 'value']])
+
+    def test_sidecar_invalidation(self):
+        with DsvIndex(self.path, 2) as index:
+            self.assertIn('ziom@example.com', index)
+        with open(self.path, 'a') as data_file:
+            data_file.write("5;new;new@example.com\n")
+        with DsvIndex(self.path, 2) as index:
+            self.assertEqual(index.records('new@example.com'), [['5', 'new', 'new@example.com']])
+
+    def test_sidecar_reuse(self):
+        DsvIndex(self.path, 0).close()
+        index_path = Path(f"{self.path}.0.idx")
+        index_mtime = os.stat(index_path).st_mtime_ns
+        with DsvIndex(self.path, 0) as index:
+            self.assertEqual(index.records('4')[0][2], 'other@example.com')
+        self.assertEqual(os.stat(index_path).st_mtime_ns, index_mtime)
+
+    def test_empty_file(self):
+        self.path.write_text('')
+        with DsvIndex(self.path, 0) as index:
+            self.assertEqual(index.records('1'), [])
+
+
+class TestParallelDsvReader(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = Path(self.tmp_dir.name) / 'events.dsv'
+        generator = random.Random(5)
+        lines = []
+        for i in range(300):
+            lines.append(dsv_record_dump([f"2020-01-{i % 28 + 1:02}", 'transaction', f"{i},zażółć;\\{i}"]))
+            lines.append(generator.choice(['', '\r', ' ']))
+        with open(self.path, 'w', newline='') as data_file:
+            data_file.write('\n'.join(lines))
+
+    def tearDown(self) -> None:
+        self.tmp_dir.cleanup()
+
+    def test_chunks(self):
+        size = self.path.stat().st_size
+        chunks = list(dsv_chunks(self.path, 100))
+        self.assertEqual(chunks[0][0], 0)
+        self.assertEqual(chunks[-1][1], size)
+        self.assertTrue(all(map(lambda a, b: a[1] == b[0], chunks, chunks[1:])))
+
+    def test_records_order(self):
+        with open(self.path) as data_file:
+            expected = list(dsv_reader(data_file))
+        self.assertEqual(list(parallel_dsv_reader(self.path, workers=2, chunk_size=100)), expected)
+        with open(self.path) as data_file:
+            expected = list(dsv_reader(data_file, columns=[2]))
+        self.assertEqual(list(parallel_dsv_reader(self.path, workers=2, columns=[2], chunk_size=1)), expected)
+
+    def test_file_reader_workers(self):
+        with open(self.path) as data_file:
+            expected = list(dsv_reader(data_file))
+        with open(self.path) as data_file, mock.patch('dsv.parallel_dsv_reader') as parallel_reader:
+            self.assertEqual(list(dsv_file_reader(data_file)), expected)
+        parallel_reader.assert_not_called()
+        with open(self.path) as data_file:
+            self.assertEqual(list(dsv_file_reader(data_file, workers=2)), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 from hacker import hacker_add, hacker_reader, hacker_remove, HackerNotFoundException, hacker_assign_to_groups, \
-     patter_matches, hacker_init, hacker_matches, hacker_remove_group, hacker_pattern
+     patter_matches, hacker_init, hacker_matches, hacker_remove_group, hacker_pattern, compile_pattern, HackerQuery, \
+     cached_hacker_query
+from fnmatch import fnmatchcase
+import random
 import secrets
 import unittest
 
@@ -32,6 +35,12 @@ class TestStringMethods(unittest.TestCase):
         except HackerNotFoundException:
             pass
     
+    def test_hacker_reader_fields(self):
+        hacker = next(hacker_reader(test_file_lines, fields=('email', 'hid')))
+        self.assertEqual((hacker.hid, hacker.email), (test_id1, "ziom@example.com"))
+        self.assertIsNone(hacker.name)
+        self.assertEqual(hacker.groups, set())
+
     def test_hacker_remove(self):
         edited_hackers = hacker_remove(hacker_reader(test_file_lines), hid=test_id1)
         self.assertTrue(len(list(edited_hackers)) == len(test_file_lines) - 1)
@@ -59,6 +68,14 @@ class TestStringMethods(unittest.TestCase):
         self.assertTrue(hacker_matches(h1, pattern1))
         self.assertFalse(hacker_matches(h2, pattern1))
         self.assertFalse(hacker_matches(h1, pattern2))
+
+    def test_hacker_matches_cached_query(self):
+        h1 = hacker_init('1', 'nick1', '2020-01-01', 'test@example.com', 'n1', 'sn1', 'g1,g2')
+        hits = cached_hacker_query.cache_info().hits
+        self.assertTrue(hacker_matches(h1, hacker_pattern(nick='n*1', groups='g2')))
+        self.assertFalse(hacker_matches(h1, hacker_pattern(nick='n*1', groups='g2,g3')))
+        self.assertTrue(hacker_matches(h1, hacker_pattern(nick='n*1', groups={'g2'})))
+        self.assertEqual(cached_hacker_query.cache_info().hits, hits + 1)
     
     def test_hacker_remove_group(self):
         test_groups = {"zarzad", "benis"}
@@ -66,6 +83,29 @@ class TestStringMethods(unittest.TestCase):
         hacker_found = next(filter(lambda h: hacker_matches(h, hacker_pattern(hid=test_id1)), edited_hackers))
         self.assertTrue(hacker_found.groups.isdisjoint(test_groups))
 
+    def test_compiled_patterns(self):
+        generator = random.Random(25)
+        for _ in range(2000):
+            pattern = ''.join(generator.choices('ab*', k=generator.randint(1, 6)))
+            val = ''.join(generator.choices('ab', k=generator.randint(0, 6)))
+            with self.subTest(pattern=pattern, val=val):
+                self.assertEqual(patter_matches(val, pattern), fnmatchcase(val, pattern))
+                self.assertFalse(patter_matches(None, pattern))
+        self.assertEqual([compile_pattern(p)[0] for p in ['dupa', 'd*', '*a', 'd*a', '**', '*up*', 'd*p*a']],
+                         [0, 1, 1, 1, 1, 2, 3])
+        self.assertTrue(patter_matches("papa", "*pa"))
+        self.assertTrue(patter_matches("d.pa", "d.*"))
+        self.assertFalse(patter_matches("dupa", "d.*"))
+
+    def test_hacker_query(self):
+        h1 = hacker_init('1', 'nick1', '2020-01-01', 'test@example.com', 'n1', 'sn1', 'g1,g2')
+        h2 = hacker_init('2', 'nick2', '2020-01-02', 'test@example.com', 'n2', 'sn2', '')
+        query = HackerQuery(hacker_pattern(nick='n*', email='test@example.com', name='*1'))
+        self.assertEqual(len(query.checks), 3)
+        self.assertEqual([query.matches(h1), query.matches(h2)], [True, False])
+        self.assertEqual([HackerQuery(hacker_pattern(groups='*')).matches(h) for h in (h1, h2)], [True, True])
+        self.assertEqual([HackerQuery(hacker_pattern(groups='g2,*')).matches(h) for h in (h1, h2)], [True, False])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,202 @@
+from bench_mt940 import synthetic_statement
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from dsv import dsv_record_dump
+from io import StringIO
+from unittest import mock
+import mt940_2_dsv
+from mt940_2_dsv import fix_bnp_statement_number, format_date, MT940Exception, mt940_to_dsv, mt940_transactions
+from mt940_2_dsv import deduplicated_dsv, FingerprintSet, parse_desc_tag, parse_mt940, transaction_fingerprint
+from mt940_2_dsv import StatementRecords, transaction_type
+import os
+import random
+import re
+import tempfile
+import unittest
+
+try:
+    import mt940
+except ImportError:
+    mt940 = None
+
+
+STATEMENT = """:20:1
+:25:/PL 98160011270000000022771234
+:28C:0668-2019/BPL
+:60F:C190927PLN000002623569,48
+:61:1909270927DN000000000000,80N240NONREF//CEN1909270001100
+:86:240^00OPŁATA ZA RACHUNEK/PAKIET ^34000
+:61:1909270927CN000000000100,00N240NONREF//CEN1909270001107
+:86:240^00PRZELEW OTRZYMANY
+^34000
+^20zwrot nadpłaty
+^32PL21203000451110000002182130^33GRAFFIC SERVICES SP. Z O.O.
+^62-SP.K. DULĘBY 9 40-800 KATO^63WICE
+:62F:C190927PLN000002623569,48
+-
+"""
+
+
+class TestParseDescTag(unittest.TestCase):
+
+    def test_fields(self):
+        desc = parse_desc_tag("225^00PRZELEW INTERNETOWY\n^34000\n^3020300045\n^20Przelew własny\n"
+                              "^32Graffic Services Sp. Z O.o.^33-Sp.k. DULĘBY 9 40-800 Kato\n"
+                              "^3821203000451110000002182130\n^62wice")
+        self.assertEqual(desc, {
+            'transaction_code': '225',
+            'description': '',
+            'additional_description': 'wice',
+            'subject': 'Przelew własny',
+            'contractors_bank_account': '20300045',
+            'contractors_account_number': '',
+            'contractors_full_account_number': '21203000451110000002182130',
+            'contractors_address': 'Graffic Services Sp. Z O.o.-Sp.k. DULĘBY 9 40-800 Kato',
+        })
+
+    def test_account_number(self):
+        desc = parse_desc_tag("225^00PRZELEW\n^30 1010 1049 \n^311234^20x\n^20/TI/1^21/TXT/y")
+        self.assertEqual(desc['contractors_full_account_number'], '1010 10491234^20x')
+        self.assertEqual(desc['subject'], '/TI/1/TXT/y')
+
+    def test_first_line(self):
+        self.assertEqual(parse_desc_tag("020^20składka^32Jan Kowalski")['subject'], 'składka')
+        self.assertEqual(parse_desc_tag("020^20składka\n\n^20Jan Kowalski")['subject'], 'składka')
+        self.assertEqual(parse_desc_tag("")['subject'], '')
+
+    def test_failed_to_parse(self):
+        with mock.patch.object(mt940_2_dsv, 'stderr', StringIO()) as stderr:
+            desc = parse_desc_tag("020^00PRZELEW\ncontinued\n^20x^99y^20z\n^20w")
+        self.assertEqual(desc['subject'], 'xw')
+        self.assertEqual(stderr.getvalue(), "failed to parse 'continued'\nfailed to parse '^99y^20z'\n")
+
+
+class TestMT940Transactions(unittest.TestCase):
+
+    def test_statement(self):
+        transactions = list(mt940_transactions(STATEMENT.splitlines(True)))
+        self.assertEqual([(t.date, t.extra_details, t.amount, t.currency, t.transaction_type) for t in transactions], [
+            (datetime(2019, 9, 27), '70001100', Decimal('-0.80'), 'PLN', 'Debit'),
+            (datetime(2019, 9, 27), '70001107', Decimal('100.00'), 'PLN', 'Credit'),
+        ])
+        self.assertEqual(transactions[1].subject, 'zwrot nadpłaty')
+        self.assertEqual(transactions[1].contractor_address, 'PL21203000451110000002182130GRAFFIC SERVICES SP. Z O.O.')
+
+    def test_statement_number(self):
+        self.assertEqual(fix_bnp_statement_number('0668-2019/BPL'), '0668/2019')
+        self.assertEqual(fix_bnp_statement_number('12/2020/M'), '12/2020')
+        self.assertEqual(fix_bnp_statement_number('00001/001'), '00001/001')
+        with self.assertRaises(MT940Exception):
+            list(mt940_transactions(STATEMENT.replace('0668-2019/BPL', 'BPL').splitlines()))
+
+    def test_details(self):
+        statement = STATEMENT.replace(":86:240^00OPŁATA", ":86:240^20" + "x" * 700 + "\n:86:^20y\n:99:^20z\n:86:^00")
+        with mock.patch.object(mt940_2_dsv, 'stderr', StringIO()) as stderr:
+            transactions = list(mt940_transactions(statement.splitlines()))
+        self.assertEqual(transactions[0].subject, "x" * 579 + "y")
+        self.assertEqual(stderr.getvalue(), "failed to parse ':99:^20z'\n")
+        with self.assertRaises(MT940Exception):
+            list(mt940_transactions(STATEMENT.replace(":20:1", ":20:1\n:99:x").splitlines()))
+
+    def test_without_details(self):
+        statement = STATEMENT.replace("0927DN", "DN").replace(":86:240^00OPŁATA ZA RACHUNEK/PAKIET ^34000\n", "")
+        transaction = next(iter(mt940_transactions(statement.splitlines())))
+        self.assertEqual((transaction.date, transaction.subject), (datetime(2019, 9, 27), ''))
+
+    @unittest.skipUnless(mt940, "the mt940 library is not installed")
+    def test_mt940_library(self):
+        generator = random.Random(22)
+        export = ''.join(synthetic_statement(i, date(2019, 1, 1), 20, generator) for i in range(20))
+        expected = []
+        for t in mt940.models.Transactions().parse(export):
+            desc = parse_desc_tag(t.data['transaction_details'])
+            expected.append(dsv_record_dump([
+                format_date(t.data.get('entry_date') or t.data['date']), t.data['extra_details'],
+                desc['contractors_full_account_number'], desc['subject'], desc['contractors_address'],
+                t.data['amount'].amount, t.data['amount'].currency, transaction_type(t.data['status'])]) + "\n")
+        self.assertEqual(list(mt940_to_dsv(mt940_transactions(export.splitlines(True)))), expected)
+
+
+class TestParseMT940(unittest.TestCase):
+
+    def test_parallel(self):
+        generator = random.Random(23)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = self.write_statements(tmp_dir, [synthetic_statement(i, date(2019, 1, 1), generator.randint(0, 30),
+                                                                        generator) for i in range(7)])
+            open(os.path.join(tmp_dir, 'empty.STA'), 'w').close()
+            paths.insert(3, os.path.join(tmp_dir, 'empty.STA'))
+            expected = list(mt940_to_dsv(parse_mt940(paths)))
+            self.assertEqual(list(mt940_to_dsv(parse_mt940(paths, workers=3))), expected)
+            head = len(list(parse_mt940(paths[:2])))
+            stdin = list(mt940_to_dsv(mt940_transactions(STATEMENT.splitlines())))
+            with mock.patch('sys.stdin', StringIO(STATEMENT)):
+                self.assertEqual(list(mt940_to_dsv(parse_mt940(paths[:2] + ['-'] + paths[2:], workers=2))),
+                                 expected[:head] + stdin + expected[head:])
+
+    def test_small_files_serial(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, mock.patch('mt940_2_dsv.stderr', StringIO()) as warnings, \
+                mock.patch.object(mt940_2_dsv, 'parallel_parse_mt940_files') as parallel_parse_mt940_files:
+            paths = self.write_statements(tmp_dir, [STATEMENT, STATEMENT])
+            self.assertEqual(len(list(parse_mt940(paths, workers=2, min_size=1 << 20))),
+                             2 * len(list(parse_mt940(paths[:1]))))
+            parallel_parse_mt940_files.assert_not_called()
+            self.assertIn("serially", warnings.getvalue())
+
+    def write_statements(self, tmp_dir, statements):
+        paths = []
+        for i, statement in enumerate(statements):
+            paths.append(os.path.join(tmp_dir, f"{i}.STA"))
+            with open(paths[-1], 'w', encoding='utf-8') as statement_file:
+                statement_file.write(statement)
+        return paths
+
+    def test_fingerprint(self):
+        transaction, = mt940_transactions(STATEMENT.splitlines()[:6])
+        other, = mt940_transactions(STATEMENT.replace("000000000000,80", "0,8").splitlines()[:6])
+        self.assertEqual(transaction_fingerprint(transaction), transaction_fingerprint(other))
+        self.assertEqual(transaction_fingerprint(transaction), "2019-09-27;70001100;-0.8;")
+
+    def test_dedup(self):
+        generator = random.Random(24)
+        statements = [synthetic_statement(i, date(2019, 1, 1) + timedelta(days=10 * i), 20, generator)
+                      for i in range(6)]
+        # a statement repeating the previous one with amounts and accounts formatted differently
+        statements.append(re.sub(r"(:61:[0-9]{10}[CD]N)0+", r"\1", statements[-1])
+                          .replace("^3821203000", "^38 21 2030 00"))
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = self.write_statements(tmp_dir, statements)
+            self.assertEqual(len(list(parse_mt940(paths))), 140)
+            self.assertEqual(list(deduplicated_dsv(paths[:-1])), sorted(mt940_to_dsv(parse_mt940(paths[:-1]))))
+            lines = list(deduplicated_dsv(reversed(paths)))
+            self.assertEqual(len(lines), 120)
+            self.assertEqual(lines, sorted(lines))
+            self.assertEqual(list(deduplicated_dsv(paths, workers=2, on_disk=True)), lines)
+
+    def test_dedup_equal_fees(self):
+        fees = [":20:1", ":25:/PL 98160011270000000022771234", ":28C:00001/001", ":60F:C190927PLN000002623569,48"]
+        for subject in ("OPŁATA ZA PRZELEW", "OPŁATA ZA RACHUNEK", "OPŁATA ZA PRZELEW"):
+            fees += [":61:1909270927DN000000000000,80N240NONREF", ":86:240^00OPŁATA", f"^20{subject}"]
+        fees = "\n".join(fees + [":62F:C190927PLN000002623567,08"]) + "\n"
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            paths = self.write_statements(tmp_dir, [fees, fees])
+            lines = list(deduplicated_dsv(paths))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(len(set(map(transaction_fingerprint, mt940_transactions(fees.splitlines())))), 2)
+
+    def test_statement_records(self):
+        statements = [[('2019-01-02;a', 'x'), ('2019-01-03;b', 'y')], [], [('2019-01-01;c', 'z'), ('2019-01-03;b', 'w')]]
+        for on_disk in (False, True):
+            with self.subTest(on_disk=on_disk), StatementRecords(on_disk) as records:
+                for statement in statements:
+                    records.add(statement)
+                self.assertEqual(list(map(tuple, records)), sorted(sum(statements, [])))
+
+    def test_fingerprint_set(self):
+        for on_disk in (False, True):
+            with self.subTest(on_disk=on_disk), FingerprintSet(on_disk) as seen:
+                self.assertEqual([seen.add(f) for f in ['a', 'b', 'a', 'c', 'b']], [True, True, False, True, False])
+
+
+if __name__ == '__main__':
+    unittest.main()
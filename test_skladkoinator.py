@@ -0,0 +1,307 @@
+from data_structures import AccountState, Event, HouseRules
+from decimal import Decimal
+from pathlib import Path
+from datetime import datetime, timedelta
+import random
+from skladkoinator import EventEngine, EventHandlingException, EventReaderException, event_handler, event_reader, \
+    handle_event, registered_event_handlers, checkpointed_replay, partitioned_replay, PARTITION_BATCH_SIZE, \
+    DuesLedger, LedgerException, query_rows
+from io import StringIO
+import tempfile
+import unittest
+
+
+class TestEventEngine(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.default_rate = HouseRules.default_rate
+
+    def tearDown(self) -> None:
+        HouseRules.default_rate = self.default_rate
+
+    def test_scenarios(self):
+        for path in sorted(Path('test/skladkoinator').glob('*.dsv')):
+            with self.subTest(path=path.name), open(path) as event_source:
+                EventEngine().run(event_reader(event_source))
+
+    def test_dues(self):
+        engine = EventEngine()
+        engine.run(event_reader([
+            "2000-01-01;setDefaultDue;100;\n",
+            "2000-01-02;newMember;adam@example.com;\n",
+            "2000-01-03;transaction;200,adam@example.com;\n",
+            "2000-03-01;nextMonth;;\n",
+        ]))
+        self.assertEqual(engine.dues['adam@example.com'].balance, Decimal(1))
+        self.assertEqual(engine.account_balance.get_balance(), Decimal(200))
+
+    def test_engine_handler(self):
+        engine = EventEngine()
+        welcomed = []
+
+        @engine.register('welcome')
+        def welcome_handler(event, *_):
+            welcomed.extend(event.args)
+
+        engine.run(event_reader(["2000-01-01;welcome;adam@example.com;\n"]))
+        self.assertEqual(welcomed, ['adam@example.com'])
+        with self.assertRaises(EventHandlingException):
+            EventEngine().run(event_reader(["2000-01-01;welcome;adam@example.com;\n"]))
+
+    def test_registered_handler(self):
+        @event_handler()
+        def resetAccount(event, dues, rates, account_balance):
+            account_balance.balance = Decimal(event.args[0])
+
+        try:
+            engine = EventEngine()
+            engine.run(event_reader(["2000-01-01;resetAccount;10;\n"]))
+            self.assertEqual(engine.account_balance.balance, Decimal(10))
+        finally:
+            del registered_event_handlers['resetAccount']
+
+    def test_unknown_event(self):
+        with self.assertRaisesRegex(EventHandlingException, 'UnknownEventException\\(foo\\)'):
+            EventEngine().run(event_reader(["2020-01-01;foo;;\n"]))
+
+    def test_lazy_accrual(self):
+        generator = random.Random(9)
+        for _ in range(50):
+            date = datetime(2000, 1, 1)
+            emails = [f"hacker{i}@example.com" for i in range(5)]
+            lines = ["2000-01-01;setDefaultDue;3;\n"] + [f"2000-01-01;newMember;{email};\n" for email in emails]
+            for _ in range(200):
+                date += timedelta(days=generator.choice([0, 1, 10, 31]))
+                email = generator.choice(emails)
+                event_date = date - timedelta(days=generator.choice([0, 0, 0, 45]))
+                lines.append(generator.choice([
+                    f"{date};newMember;{email};\n",
+                    f"{event_date};nextMonth;;\n",
+                    f"{date};transaction;{generator.randint(1, 1000)},{email};\n",
+                    f"{date};dueSet;{email},{generator.randint(-5, 5)};\n",
+                    f"{date};dueAdd;{email},0.{generator.randint(1, 9)};\n",
+                ]))
+            with self.subTest(lines=lines):
+                lazy, eager = EventEngine(lazy_accrual=True), EventEngine()
+                for engine in (lazy, eager):
+                    engine.run(event_reader(lines))
+                self.assertEqual(list(map(lambda d: d.as_dsv(), lazy.dues.values())),
+                                 list(map(lambda d: d.as_dsv(), eager.dues.values())))
+
+    def test_handle_event(self):
+        dues, rates, account_balance = {}, HouseRules(), AccountState()
+        handle_event(Event('2000-01-02', 'newMember', 'adam@example.com'), dues, rates, account_balance)
+        self.assertIn('adam@example.com', dues)
+        with self.assertRaisesRegex(EventHandlingException, 'UnknownEventException\\(foo\\)'):
+            handle_event(Event('2000-01-02', 'foo', ''), dues, rates, account_balance)
+
+    def test_event_source_errors(self):
+        engine = EventEngine()
+        with self.assertRaises(EventReaderException):
+            engine.run(event_reader(["2000-01-01;newMember;adam@example.com;\n", "2000-01-02\n"]))
+        self.assertIn('adam@example.com', engine.dues)
+
+
+class TestPartitionedReplay(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.default_rate = HouseRules.default_rate
+
+    def tearDown(self) -> None:
+        HouseRules.default_rate = self.default_rate
+        HouseRules.rates.clear()
+
+    def replay(self, lines, partitions, lazy_accrual=False, batch_size=PARTITION_BATCH_SIZE, more_lines=()):
+        HouseRules.default_rate = self.default_rate
+        HouseRules.rates.clear()
+        engine = EventEngine(lazy_accrual=lazy_accrual)
+        try:
+            if partitions is None:
+                engine.run(event_reader(lines))
+            else:
+                partitioned_replay(engine, event_reader(lines), partitions, batch_size)
+            engine.run(event_reader(more_lines))
+        except (EventHandlingException, EventReaderException) as exc:
+            # the state left by a failed replay isn't used
+            return str(exc)
+        return list(map(lambda hacker_dues: hacker_dues.as_dsv(), engine.dues.values())), \
+            engine.account_balance.get_balance(), HouseRules.default_rate, dict(HouseRules.rates), \
+            engine.rates.max_prepaid_dues_count, engine.last_event_date
+
+    def test_random_logs(self):
+        generator = random.Random(11)
+        for _ in range(10):
+            date = datetime(2000, 1, 1)
+            emails = [f"hacker{i}@example.com" for i in range(8)]
+            lines = [f"2000-01-01;newMember;{email};\n" for email in emails[:4]]
+            for _ in range(300):
+                date += timedelta(days=generator.choice([0, 1, 10, 31]))
+                email = generator.choice(emails)
+                lines.append(generator.choice([
+                    f"{date};newMember;{email};\n",
+                    f"{date};nextMonth;;\n",
+                    f"{date};transaction;{generator.randint(1, 1000)},{email};\n",
+                    f"{date};transaction;{generator.randint(1, 1000)},shop;\n",
+                    f"{date};dueAdd;{generator.choice(emails[:4])},0.{generator.randint(1, 9)};\n",
+                    f"{date};setDefaultDue;{generator.choice([3, 100])};\n",
+                    f"{date};setMaxPrepaidDuesCount;{generator.randint(1, 12)};\n",
+                    f"{date};setHackerDue;50,{email};\n",
+                    f"{date};assertHackersExist;{','.join(emails[:generator.randint(1, 4)])};not registered\n",
+                ]))
+            if generator.random() < 0.3:
+                lines.insert(generator.randrange(len(lines)), f"{date};dueAdd;{generator.choice(emails)},1;\n")
+                lines.insert(generator.randrange(len(lines)), f"{date};assertHackersExist;{','.join(emails)};\n")
+            with self.subTest(lines=lines):
+                expected = self.replay(lines, None)
+                self.assertEqual(self.replay(lines, 3), expected)
+                self.assertEqual(self.replay(lines, 3, batch_size=7), expected)
+
+    def test_accrual_clock(self):
+        lines = ["2000-01-01;newMember;adam@example.com;\n", "2000-01-01;newMember;ewa@example.com;\n"]
+        lines += [f"2000-{month:02}-01;nextMonth;;\n" for month in range(2, 13)]
+        lines += ["2000-12-02;transaction;300,ewa@example.com;\n"]
+        # months charged after the partitioned replay are counted from its last one
+        more_lines = ["2001-01-01;nextMonth;;\n", "2001-01-02;newMember;bob@example.com;\n", "2001-02-01;nextMonth;;\n",
+                      "2001-02-02;dueAdd;adam@example.com,1;\n", "2001-03-01;nextMonth;;\n"]
+        expected = self.replay(lines, None, more_lines=more_lines)
+        self.assertEqual(self.replay(lines, None, lazy_accrual=True, more_lines=more_lines), expected)
+        self.assertEqual(self.replay(lines, 2, lazy_accrual=True, batch_size=2, more_lines=more_lines), expected)
+        # so are months of the dues the engine had before
+        self.assertEqual(self.replay(lines[:6], 2, lazy_accrual=True, more_lines=lines[6:] + more_lines), expected)
+
+    def test_unknown_event(self):
+        lines = ["2000-01-01;newMember;adam@example.com;\n", "2000-01-02;foo;;\n"]
+        self.assertEqual(self.replay(lines, 2), self.replay(lines, None))
+
+    def test_reader_error(self):
+        lines = ["2000-01-01;newMember;adam@example.com;\n", "2000-01-02;nextMonth\n"]
+        self.assertEqual(self.replay(lines, 2), self.replay(lines, None))
+        lines.insert(1, "2000-01-02;dueAdd;ewa@example.com,1;\n")
+        self.assertEqual(self.replay(lines, 2), self.replay(lines, None))
+
+    def test_scenarios(self):
+        for path in sorted(Path('test/skladkoinator').glob('*.dsv')):
+            with self.subTest(path=path.name), open(path) as event_source:
+                lines = event_source.readlines()
+                self.assertEqual(self.replay(lines, 2), self.replay(lines, None))
+                self.assertEqual(self.replay(lines, 2, lazy_accrual=True), self.replay(lines, None))
+
+
+class TestDuesLedger(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.default_rate = HouseRules.default_rate
+        generator = random.Random(12)
+        date = datetime(2000, 1, 1)
+        self.emails = [f"hacker{i}@example.com" for i in range(4)]
+        self.lines = ["2000-01-01;setDefaultDue;3;\n"]
+        for _ in range(300):
+            date += timedelta(days=generator.choice([0, 1, 10, 31]))
+            email = generator.choice(self.emails)
+            self.lines.append(generator.choice([
+                f"{date};newMember;{email};\n",
+                f"{date};nextMonth;;\n",
+                f"{date};nextMonth;;\n",
+                f"{date};transaction;{generator.randint(1, 1000)},{email};\n",
+                f"{date};transaction;{generator.randint(1, 1000)},shop;\n",
+            ]))
+        self.ledger = DuesLedger()
+        engine = EventEngine()
+        engine.run(self.ledger.recorded(event_reader(self.lines), engine.dues))
+
+    def tearDown(self) -> None:
+        HouseRules.default_rate = self.default_rate
+
+    def replay(self, lines):
+        engine = EventEngine(lazy_accrual=False)
+        engine.run(event_reader(lines))
+        return {email: hacker_dues.balance for email, hacker_dues in engine.dues.items()}
+
+    def test_balances(self):
+        dates = sorted(set(map(lambda line: Event.lazy(*line.split(';')).date, self.lines)))
+        for date in dates + [date + timedelta(hours=1) for date in dates[::7]]:
+            with self.subTest(date=date):
+                expected = self.replay(filter(lambda line: Event.lazy(*line.split(';')).date <= date, self.lines))
+                self.assertEqual(self.ledger.balances(date), expected)
+                for email in self.emails:
+                    self.assertEqual(self.ledger.balance(email, date), expected.get(email))
+                self.assertEqual(self.ledger.arrears(date), {e: b for e, b in expected.items() if b < 0})
+
+    def test_snapshots(self):
+        ticks = [index for index, line in enumerate(self.lines) if ';nextMonth;' in line]
+        snapshots = list(self.ledger.snapshots())
+        self.assertEqual(len(snapshots), len(ticks))
+        for index, (date, balances) in zip(ticks, snapshots):
+            with self.subTest(index=index):
+                self.assertEqual(balances, self.replay(self.lines[:index + 1]))
+
+    def test_history(self):
+        email = self.emails[0]
+        history = self.ledger.history(email)
+        self.assertEqual(history, sorted(history, key=lambda record: record[0]))
+        start, end = history[len(history) // 3][0], history[2 * len(history) // 3][0]
+        self.assertEqual(self.ledger.history(email, start, end),
+                         [record for record in history if start <= record[0] <= end])
+        self.assertEqual(self.ledger.history('nobody@example.com'), [])
+
+    def test_query_rows(self):
+        date = datetime(2001, 1, 1)
+        rows = list(query_rows(self.ledger, emails=self.emails[:2], dates=[date], arrears=True))
+        expected = self.ledger.arrears(date)
+        self.assertEqual(rows, [[date, email, expected[email]] for email in self.emails[:2] if email in expected])
+
+    def test_unsorted_events(self):
+        ledger = DuesLedger()
+        engine = EventEngine()
+        with self.assertRaises(LedgerException):
+            engine.run(ledger.recorded(event_reader(["2000-02-01;nextMonth;;\n", "2000-01-01;nextMonth;;\n"]),
+                                       engine.dues))
+
+
+class TestCheckpointedReplay(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.default_rate = HouseRules.default_rate
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint_path = Path(self.tmp_dir.name) / 'checkpoint.dsv'
+        with open('test/skladkoinator/multiple_hackers.dsv') as event_source:
+            self.lines = event_source.readlines()
+        self.expected = self.replay(self.lines, None)
+
+    def tearDown(self) -> None:
+        HouseRules.default_rate = self.default_rate
+        HouseRules.rates.clear()
+        self.tmp_dir.cleanup()
+
+    def replay(self, lines, checkpoint_path, lazy_accrual=True):
+        engine = EventEngine(lazy_accrual=lazy_accrual)
+        if checkpoint_path is None:
+            engine.run(event_reader(lines))
+        else:
+            checkpointed_replay(engine, lines, checkpoint_path)
+        return list(map(lambda hacker_dues: hacker_dues.as_dsv(), engine.dues.values())), \
+            engine.account_balance.get_balance()
+
+    def test_resume(self):
+        for split in range(len(self.lines) + 1):
+            for lazy_accrual in (True, False):
+                with self.subTest(split=split, lazy_accrual=lazy_accrual):
+                    self.checkpoint_path.unlink(missing_ok=True)
+                    self.replay(self.lines[:split], self.checkpoint_path, lazy_accrual)
+                    self.assertEqual(self.replay(StringIO(''.join(self.lines)), self.checkpoint_path, lazy_accrual),
+                                     self.expected)
+
+    def test_changed_prefix(self):
+        self.replay(self.lines[:10], self.checkpoint_path)
+        changed_lines = ["2000-01-01;setDefaultDue;100;\n"] + self.lines
+        self.assertEqual(self.replay(iter(changed_lines), self.checkpoint_path), self.expected)
+        self.replay(self.lines[:10], self.checkpoint_path)
+        self.assertEqual(self.replay(StringIO(''.join(changed_lines)), self.checkpoint_path), self.expected)
+
+    def test_invalid_checkpoint(self):
+        self.checkpoint_path.write_text("not a checkpoint\n")
+        self.assertEqual(self.replay(iter(self.lines), self.checkpoint_path), self.expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+from sort_events import event_sort_key, merge_events, sort_events, SortEventsException
+from datetime import datetime, timedelta
+from io import StringIO
+import random
+import unittest
+
+
+def random_event_lines(generator: random.Random, count: int):
+    event_types = ['transaction', 'nextMonth', 'newMember', 'assertHackersExist', 'setDefaultDue', 'customEvent']
+    start = datetime(2020, 1, 1)
+    for i in range(count):
+        date = start + timedelta(days=generator.randint(0, 20))
+        date = date.date().isoformat() if generator.random() < 0.5 else date.isoformat()
+        yield f"{date};{generator.choice(event_types)};{i},adam@example.com;\n"
+
+
+class TestSortEvents(unittest.TestCase):
+
+    def test_ties(self):
+        lines = [
+            "2020-01-01;transaction;100,adam@example.com;\n",
+            "2020-01-01T00:00:00;assertHackersExist;adam@example.com;\n",
+            "2020-01-01;nextMonth;;\n",
+            "2019-12-31;customEvent;;\n",
+            "2020-01-01 00:00:00;setDefaultDue;100;\n",
+        ]
+        expected = [lines[3], lines[4], lines[2], lines[0], lines[1]]
+        self.assertEqual(list(sort_events([lines])), expected)
+        self.assertEqual(list(sort_events([lines], event_types=['assertHackersExist']))[1], lines[1])
+
+    def test_external_sort(self):
+        generator = random.Random(13)
+        sources = [list(random_event_lines(generator, 200)) for _ in range(3)]
+        expected = sorted(sum(sources, []), key=event_sort_key())
+        for buffer_lines in (1, 7, 600):
+            with self.subTest(buffer_lines=buffer_lines):
+                self.assertEqual(list(sort_events(sources, buffer_lines=buffer_lines)), expected)
+        shuffled = sum(sources, [])
+        generator.shuffle(shuffled)
+        self.assertEqual(list(sort_events([shuffled], buffer_lines=50)), expected)
+
+    def test_merge(self):
+        generator = random.Random(14)
+        sources = [list(sort_events([random_event_lines(generator, 100)])) for _ in range(4)]
+        self.assertEqual(list(merge_events(map(lambda lines: StringIO(''.join(lines)), sources))),
+                         list(sort_events(sources)))
+
+    def test_unsorted_merge(self):
+        with self.assertRaises(SortEventsException):
+            list(merge_events([["2020-01-02;nextMonth;;\n", "2020-01-01;nextMonth;;\n"]]))
+
+    def test_blank_lines(self):
+        self.assertEqual(list(sort_events([["\n", "2020-01-01;nextMonth;;", "  \n"]])), ["2020-01-01;nextMonth;;\n"])
+
+    def test_invalid_date(self):
+        with self.assertRaises(SortEventsException):
+            list(sort_events([["yesterday;nextMonth;;\n"]]))
+
+
+if __name__ == '__main__':
+    unittest.main()
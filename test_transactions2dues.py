@@ -0,0 +1,230 @@
+from data_structures import Event, Hacker, Transaction
+from datetime import datetime, timedelta
+from io import StringIO
+from sort_events import event_sort_key
+from transactions2dues import AccountCache, events_generator, EventsOrderException, find_hacker_email, HackerNameIndex
+from transactions2dues import dice, hacker_cli_argparse, HackerFuzzyIndex, normalize_name, transactios2dues_events, \
+    word_trigrams
+import os
+import random
+import tempfile
+import unittest
+from unittest import mock
+
+
+def event_dates(events, event_type):
+    return [e.date for e in events if e.type == event_type]
+
+
+class TestEventsGenerator(unittest.TestCase):
+
+    def test_ticks(self):
+        hacker_events = [Event('2019-11-15', 'newMember', 'adam@example.com')]
+        transaction_events = [
+            Event('2019-12-03', 'transaction', '100,adam@example.com'),
+            Event('2020-12-10', 'transaction', '100,adam@example.com'),
+            Event('2021-12-01', 'transaction', '100,adam@example.com'),
+        ]
+        events = list(events_generator(hacker_events, transaction_events))
+        expected_ticks = [datetime(2019, 11, 1), datetime(2019, 12, 1)]
+        expected_ticks += [datetime(2020 + m // 12, m % 12 + 1, 1) for m in range(23)]
+        self.assertEqual(event_dates(events, 'nextMonth'), expected_ticks)
+        self.assertEqual(event_dates(events, 'transaction'), list(map(lambda e: e.date, transaction_events)))
+        lines = list(map(lambda e: e.as_dsv() + '\n', events))
+        self.assertEqual(list(map(event_sort_key(), lines)), sorted(map(event_sort_key(), lines)))
+
+    def test_ties(self):
+        hacker_events = [Event('2020-02-01', 'newMember', 'adam@example.com')]
+        transaction_events = [
+            Event('2020-01-20', 'transaction', '100,adam@example.com'),
+            Event('2020-02-01', 'transaction', '100,adam@example.com'),
+        ]
+        self.assertEqual(list(map(lambda e: (e.date.month, e.type), events_generator(hacker_events,
+                                                                                      transaction_events))),
+                         [(1, 'nextMonth'), (1, 'transaction'), (2, 'newMember'), (2, 'transaction')])
+
+    def test_random(self):
+        generator = random.Random(14)
+        start = datetime(2015, 1, 1)
+        dates = sorted(start + timedelta(days=generator.randint(0, 3000)) for _ in range(200))
+        events = list(events_generator([], map(lambda d: Event(d, 'transaction', '1,a@example.com'), dates)))
+        months = sorted(set(map(lambda d: (d.year, d.month), dates)))
+        first, last = months[0], months[-1]
+        expected_ticks = [datetime(y, m, 1) for y in range(first[0], last[0] + 1) for m in range(1, 13)
+                          if first <= (y, m) < last]
+        self.assertEqual(event_dates(events, 'nextMonth'), expected_ticks)
+        self.assertEqual(event_dates(events, 'transaction'), dates)
+
+    def test_empty(self):
+        self.assertEqual(list(events_generator([], [])), [])
+        events = list(events_generator([Event('2020-01-01', 'newMember', 'adam@example.com')], []))
+        self.assertEqual(list(map(lambda e: e.type, events)), ['newMember'])
+
+    def test_unsorted(self):
+        transaction_events = [Event('2020-02-01', 'transaction', '1,a@example.com'),
+                              Event('2020-01-01', 'transaction', '1,a@example.com')]
+        with self.assertRaises(EventsOrderException):
+            list(events_generator([], transaction_events))
+
+    def test_sorted_by_default(self):
+        self.assertTrue(hacker_cli_argparse.parse_args(['--hackers', 'hackers.dsv']).sort)
+        self.assertFalse(hacker_cli_argparse.parse_args(['--hackers', 'hackers.dsv', '--presorted']).sort)
+
+
+def hacker(name, last_name, email):
+    return Hacker(None, None, None, email, name, last_name, None)
+
+
+def transaction(subject, contractor_address='', account=''):
+    return Transaction('2020-01-01', '', account, subject, contractor_address, '100.00', 'PLN', 'Credit')
+
+
+class TestHackerNameIndex(unittest.TestCase):
+
+    def test_known_names(self):
+        hackers = [
+            hacker('Jan', 'Kowalski', 'jan@example.com'),
+            hacker('Łucja', 'Żółć', 'lucja@example.com'),
+            hacker('Ola', 'Nowak', 'ola@example.com'),
+            hacker('Karola', 'Nowak', 'karola@example.com'),
+            hacker('Al', 'Bo', 'albo@example.com'),
+        ]
+        index = HackerNameIndex(hackers)
+        for t, email in [
+            (transaction('składka Jan Kowalski'), 'jan@example.com'),
+            (transaction('SKŁADKA LUCJA ZOLC'), 'lucja@example.com'),
+            (transaction('składka', 'Łucja Żółć, ul. Długa 1'), 'lucja@example.com'),
+            (transaction('składka karola nowak'), 'ola@example.com'),
+            (transaction('składka albo nie'), 'albo@example.com'),
+            (transaction('składka'), ''),
+        ]:
+            with self.subTest(subject=t.subject):
+                self.assertEqual(index.find_email(t), email)
+                self.assertEqual(find_hacker_email(t, hackers), email)
+
+    def test_random_names(self):
+        generator = random.Random(15)
+        syllables = ['ka', 'ro', 'la', 'ża', 'ło', 'no', 'wak', 'ski', 'a']
+        word = lambda least, most: ''.join(generator.choice(syllables) for _ in range(generator.randint(least, most)))
+        hackers = [hacker(word(1, 3).title(), word(2, 4).title(), f"hacker{i}@example.com") for i in range(100)]
+        index = HackerNameIndex(hackers)
+        for _ in range(1000):
+            t = transaction(f"składka {word(1, 3)} {word(1, 4)} {word(1, 3)}", f"{word(1, 3)} {word(1, 4)}")
+            with self.subTest(subject=t.subject, address=t.contractor_address):
+                self.assertEqual(index.find_email(t), find_hacker_email(t, hackers))
+
+
+class TestHackerFuzzyIndex(unittest.TestCase):
+
+    def test_misspelled_names(self):
+        hackers = [hacker('Jan', 'Kowalski', 'jan@example.com'), hacker('Anna', 'Kowalska', 'anna@example.com')]
+        index = HackerFuzzyIndex(hackers)
+        for t, email in [
+            (transaction('składka Jan Kowalki'), 'jan@example.com'),
+            (transaction('składka Kowalski Jn'), 'jan@example.com'),
+            (transaction('składka', 'ANNA KOWALSKI, UL. DŁUGA 1'), 'anna@example.com'),
+            (transaction('składka Piotr Kowalski'), ''),
+            (transaction('składka'), ''),
+        ]:
+            with self.subTest(subject=t.subject, address=t.contractor_address):
+                self.assertEqual(index.find(t)[0], email)
+
+    def test_random_names(self):
+        generator = random.Random(17)
+        syllables = ['ka', 'ro', 'la', 'ża', 'ło', 'no', 'wak', 'ski', 'a']
+        word = lambda least, most: ''.join(generator.choice(syllables) for _ in range(generator.randint(least, most)))
+        hackers = [hacker(word(1, 3).title(), word(2, 4).title(), f"hacker{i}@example.com") for i in range(100)]
+        hackers_words = [word_trigrams(normalize_name(f"{h.name} {h.last_name}")) for h in hackers]
+        for threshold in (0.3, 0.75, 0.9):
+            index = HackerFuzzyIndex(hackers, threshold)
+            for _ in range(300):
+                text = normalize_name(f"składka {word(1, 3)} {word(1, 4)}")
+                text_words = word_trigrams(text)
+                scores = [sum(len(w) * max(dice(w, t) for t in text_words) for w in words) / sum(map(len, words))
+                          for words in hackers_words]
+                best = max(scores)
+                expected = (best, -scores.index(best)) if best >= threshold else (0.0, 0)
+                with self.subTest(threshold=threshold, text=text):
+                    self.assertEqual(index.best_match(text), expected)
+
+    def test_fuzzy_events(self):
+        hackers = [hacker('Jan', 'Kowalski', 'jan@example.com')]
+        account_cache = AccountCache()
+        events = list(transactios2dues_events([transaction('składka Jan Kowalki', account='PL112222')], hackers,
+                                              account_cache))
+        self.assertEqual(list(map(lambda e: (e.args[1], e.comment), events)),
+                         [('jan@example.com', 'fuzzy name match 0.80')])
+        self.assertEqual(account_cache.accounts, {})
+        self.assertEqual(list(transactios2dues_events([transaction('składka Jan Kowalki')], hackers,
+                                                      fuzzy_threshold=None)), [])
+
+
+class TestAccountCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, 'accounts.dsv')
+        self.hackers = [hacker('Jan', 'Kowalski', 'jan@example.com'), hacker('Ola', 'Nowak', 'ola@example.com')]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def emails(self, transactions, account_cache, hackers=None):
+        events = transactios2dues_events(transactions, hackers or self.hackers, account_cache)
+        return list(map(lambda e: e.args[1], events))
+
+    def test_learned_accounts(self):
+        account_cache = AccountCache(self.path)
+        self.assertEqual(self.emails([transaction('składka Jan Kowalski', account='PL 11 2222'),
+                                      transaction('składka', account='PL112222'),
+                                      transaction('składka', account='PL993333')], account_cache),
+                         ['jan@example.com', 'jan@example.com'])
+        account_cache.save()
+        self.assertEqual(AccountCache(self.path).accounts, {'PL112222': ('jan@example.com', AccountCache.LEARNED)})
+        # the learned account naming its hacker isn't searched for by name
+        account_cache = AccountCache(self.path)
+        with mock.patch.object(HackerNameIndex, 'find_email') as find_email:
+            self.assertEqual(self.emails([transaction('składka Jan Kowalski', account='PL112222')], account_cache),
+                             ['jan@example.com'])
+        find_email.assert_not_called()
+        # a name of another hacker wins over the learned account, which becomes a shared one
+        self.assertEqual(self.emails([transaction('składka Ola Nowak', account='PL112222'),
+                                      transaction('składka', account='PL112222'),
+                                      transaction('składka Jan Kowalski', account='PL112222')], account_cache),
+                         ['ola@example.com', 'jan@example.com'])
+        account_cache.save()
+        self.assertEqual(AccountCache(self.path).accounts, {'PL112222': ('', AccountCache.LEARNED)})
+
+    def test_manual_accounts(self):
+        with open(self.path, 'w') as accounts_file:
+            accounts_file.write("PL112222;ola@example.com;manual\nPL993333\n")
+        account_cache = AccountCache(self.path)
+        self.assertEqual(self.emails([transaction('składka Jan Kowalski', account='PL112222'),
+                                      transaction('składka Jan Kowalski', account='PL993333'),
+                                      transaction('składka Ola Nowak', account='PL993333')], account_cache),
+                         ['ola@example.com', 'jan@example.com', 'ola@example.com'])
+        self.assertFalse(account_cache.changed)
+
+    def test_removed_hacker(self):
+        account_cache = AccountCache(self.path)
+        self.emails([transaction('składka Jan Kowalski', account='PL112222')], account_cache)
+        account_cache.save()
+        account_cache = AccountCache(self.path)
+        self.assertEqual(self.emails([transaction('składka', account='PL112222')], account_cache, self.hackers[1:]),
+                         [])
+        account_cache.save()
+        self.assertEqual(AccountCache(self.path).accounts, {})
+
+    def test_removed_hacker_manual_account(self):
+        with open(self.path, 'w') as accounts_file:
+            accounts_file.write("PL112222;adam@example.com;manual\nPL993333\n")
+        account_cache = AccountCache(self.path)
+        with mock.patch('sys.stderr', StringIO()) as warnings:
+            account_cache.invalidate({'jan@example.com'})
+        self.assertIn("PL112222", warnings.getvalue())
+        self.assertEqual(account_cache.accounts, {'PL993333': ('', AccountCache.MANUAL)})
+        self.assertTrue(account_cache.changed)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,31 +1,61 @@
 #!/usr/bin/env python3
 import argparse
+import os
+import sys
 from hacker import hacker_reader
-from typing import Iterable
-from dsv import dsv_reader, dsv_generator
+from collections import Counter
+from itertools import chain
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+from dsv import dsv_file_reader, dsv_reader, DsvWriter
 from data_structures import Hacker, Event
+import heapq
+import math
 import re
 from datetime import datetime
+from sort_events import event_priorities
+from classification_rules import DEFAULT_TRANSACTION_CLASSIFIER, normalize_account, transaction_classifier
+from classification_rules import TransactionClassifier
 from data_structures import Transaction
 
 hacker_cli_argparse = argparse.ArgumentParser()
 hacker_cli_argparse.add_argument("--hackers", action="store", dest="hackers_file", required=True)
 hacker_cli_argparse.add_argument("-if", action="store", dest="input_file",  default="-", required=False)
 hacker_cli_argparse.add_argument("-of", action="store", dest="output_file", default="-", required=False)
+hacker_cli_argparse.add_argument("-j", action="store", dest="workers", type=int, default=1, required=False,
+                                 help="processes parsing the input file, 0 for all cpus, 1 parses it serially")
+hacker_cli_argparse.add_argument("--sort", action="store_true", dest="sort", default=True, required=False,
+                                 help="sort transactions by date before writing any event (the default)")
+hacker_cli_argparse.add_argument("--presorted", action="store_false", dest="sort", required=False,
+                                 help="stream transactions already sorted by date, an out of order one stops the "
+                                      "output half way with EventsOrderException")
+hacker_cli_argparse.add_argument("--accounts", action="store", dest="accounts_file", default=None, required=False,
+                                 help="dsv file of bank accounts of hackers, learned from matched transactions")
+hacker_cli_argparse.add_argument("--fuzzy-threshold", action="store", dest="fuzzy_threshold", type=float,
+                                 default=0.75, required=False,
+                                 help="similarity of misspelled names matched to hackers, 0 turns it off")
+hacker_cli_argparse.add_argument("--rules", action="store", dest="rules_file", default=None, required=False,
+                                 help="dsv file of transaction classification rules, see ClassificationRule")
 
 
 def ERR(transaction: Transaction):
     sys.stderr.write(str(transaction))
     sys.stderr.write("\n")
 
-def parse_transactions(data_source: Iterable[list]):
-    return map(lambda record: Transaction(*record), dsv_reader(data_source))
+def parse_transactions(data_source: Iterable[str], fields: Sequence[str] = None,
+                       workers: int = 1) -> Iterable[Transaction]:
+    """
+    Read transactions from dsv records, with `fields` only those fields are decoded and the other ones are left as
+    None. A file on disk is parsed by `workers` processes (see dsv_file_reader).
+    """
+    if fields is None:
+        return map(lambda record: Transaction(*record), dsv_file_reader(data_source, workers=workers))
+    columns = list(map(Transaction.columns.index, fields))
+    return map(lambda record: Transaction(**dict(zip(fields, record))),
+               dsv_file_reader(data_source, columns=columns, workers=workers))
 
 
-def is_due(transaction: Transaction) -> bool:
-    subject = transaction.subject
-    subject = subject.lower().strip()
-    return bool(re.search('sk.adka?', subject))
+def is_due(transaction: Transaction, classifier: TransactionClassifier = None) -> bool:
+    return (classifier or DEFAULT_TRANSACTION_CLASSIFIER).is_due(transaction)
 
 
 polish_letters_translation_mapping = str.maketrans({
@@ -50,26 +80,270 @@ def find_hacker_email(transaction: Transaction, hackers: Iterable[Hacker]) -> st
     return ""
 
 
-def transactios2dues_events(transactions: Iterable[Transaction], hackers: Iterable[Hacker]) -> Iterable[Event]:
+def normalize_name(s: str) -> str:
+    return drop_polish_letters(s.lower())
+
+
+def ngrams(s: str, n: int) -> Set[str]:
+    return {s[i:i + n] for i in range(len(s) - n + 1)}
+
+
+def trigrams(s: str) -> Set[str]:
+    return ngrams(s, 3)
+
+
+# lengths of substrings hackers are indexed by, longer ones are rarer but short names have only the short ones
+NAME_INDEX_NGRAMS = (3, 4, 5)
+
+
+class HackerNameIndex:
+    """
+    find_hacker_email over hackers with names normalized once. A hacker matches a text containing both their name and
+    last name, so the text contains every substring of them, the rarest one too. Hackers are indexed under their
+    rarest substring of NAME_INDEX_NGRAMS lengths and only those indexed under substrings of the subject or the
+    address of a transaction are checked, along with hackers with names too short to be indexed. Candidates are
+    checked in the order of the hackers list.
+    """
+
+    def __init__(self, hackers: Iterable[Hacker]):
+        self.emails = []
+        self.names = []
+        self.positions: Dict[str, int] = {}
+        hackers_ngrams = []
+        for hacker in hackers:
+            name, last_name = normalize_name(hacker.name), normalize_name(hacker.last_name)
+            self.positions.setdefault(hacker.email, len(self.emails))
+            self.emails.append(hacker.email)
+            self.names.append((name, last_name))
+            hackers_ngrams.append(set().union(*(ngrams(s, n) for s in (name, last_name) for n in NAME_INDEX_NGRAMS)))
+
+        frequency = Counter(chain.from_iterable(hackers_ngrams))
+        self.index: Dict[str, List[int]] = {}
+        self.always_checked = []
+        for position, hacker_ngrams in enumerate(hackers_ngrams):
+            if hacker_ngrams:
+                rarest = min(hacker_ngrams, key=lambda ngram: (frequency[ngram], -len(ngram), ngram))
+                self.index.setdefault(rarest, []).append(position)
+            else:
+                self.always_checked.append(position)
+        self.ngram_lengths = sorted(set(map(len, self.index)))
+
+    def candidates(self, *texts: str) -> List[int]:
+        positions = set(self.always_checked)
+        for text in texts:
+            for n in self.ngram_lengths:
+                for ngram in self.index.keys() & ngrams(text, n):
+                    positions.update(self.index[ngram])
+        return sorted(positions)
+
+    def matches(self, position: int, subject: str, contractor_address: str) -> bool:
+        name, last_name = self.names[position]
+        return ((name in subject and last_name in subject)
+                or (name in contractor_address and last_name in contractor_address))
+
+    def find_email(self, transaction: Transaction) -> str:
+        subject = normalize_name(transaction.subject)
+        contractor_address = normalize_name(transaction.contractor_address)
+        for position in self.candidates(subject, contractor_address):
+            if self.matches(position, subject, contractor_address):
+                return self.emails[position]
+        return ""
+
+    def is_named(self, email: str, transaction: Transaction) -> bool:
+        """Whether the subject or the address of the transaction name the hacker of `email`, without searching"""
+        position = self.positions.get(email)
+        return position is not None and self.matches(position, normalize_name(transaction.subject),
+                                                     normalize_name(transaction.contractor_address))
+
+
+FUZZY_NAME_THRESHOLD = 0.75
+
+
+def word_trigrams(s: str) -> List[Set[str]]:
+    """Trigrams of each word of a normalized text, padded so the beginnings and the ends of words make trigrams too"""
+    return list(map(lambda word: trigrams(f"  {word} "), re.findall(r'\w+', s)))
+
+
+def dice(a: Set[str], b: Set[str]) -> float:
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+class HackerFuzzyIndex:
+    """
+    Hackers matching transactions with misspelled or reordered names. Every word of a hacker's name and last name is
+    scored by the Dice coefficient of its trigrams and trigrams of the most similar word of a text. The similarity of
+    the hacker is the average of the scores weighted by the numbers of trigrams of the words.
+
+    A word sharing c of its a trigrams with a text scores at most (a + c) / 2a, so a hacker needs to share about
+    (2 * threshold - 1) of their trigrams with a text to be similar enough. Then they share one of their rarest
+    trigrams as well, hackers are indexed only under those and hackers not sharing any of them are never scored.
+    The bound also orders scoring of the candidates, see best_match.
+    """
+
+    def __init__(self, hackers: Iterable[Hacker], threshold: float = FUZZY_NAME_THRESHOLD):
+        self.threshold = threshold
+        self.emails = []
+        self.words = []
+        for hacker in hackers:
+            self.emails.append(hacker.email)
+            self.words.append(word_trigrams(f"{normalize_name(hacker.name)} {normalize_name(hacker.last_name)}"))
+
+        self.trigrams = list(map(lambda words: set().union(*words), self.words))
+        # trigrams of words, those shared by many words of the name count once in self.trigrams
+        self.sizes = list(map(lambda words: sum(map(len, words)), self.words))
+        frequency = Counter(chain.from_iterable(self.trigrams))
+        self.index: Dict[str, List[int]] = {}
+        for position, hacker_trigrams in enumerate(self.trigrams):
+            size = self.sizes[position]
+            required = max(math.ceil((2 * threshold - 1) * size - (size - len(hacker_trigrams)) - 1e-9), 1)
+            rarest = sorted(hacker_trigrams, key=lambda trigram: (frequency[trigram], trigram))
+            for trigram in rarest[:len(hacker_trigrams) - required + 1]:
+                self.index.setdefault(trigram, []).append(position)
+
+    def similarity(self, position: int, text_words: List[Set[str]]) -> float:
+        return sum(len(word) * max(map(lambda text_word: dice(word, text_word), text_words), default=0.0)
+                   for word in self.words[position]) / self.sizes[position]
+
+    def upper_bound(self, position: int, text_trigrams: Set[str]) -> float:
+        hacker_trigrams, size = self.trigrams[position], self.sizes[position]
+        return min(2 * size - len(hacker_trigrams) + len(hacker_trigrams & text_trigrams), 2 * size) / (2 * size)
+
+    def best_match(self, text: str) -> Tuple[float, int]:
+        """
+        (similarity, -position) of the most similar hacker, hackers earlier on the list win ties. Candidates are scored
+        in the order of upper bounds of their similarity until the bound is lower than the best similarity found.
+        """
+        text_words = word_trigrams(text)
+        text_trigrams = set().union(*text_words)
+        candidates = set(chain.from_iterable(map(self.index.__getitem__, self.index.keys() & text_trigrams)))
+        bounds = sorted(((self.upper_bound(position, text_trigrams), -position) for position in candidates),
+                        reverse=True)
+        best = (0.0, 0)
+        for bound, negative_position in bounds:
+            if bound < self.threshold or (bound, negative_position) < best:
+                break
+            similarity = self.similarity(-negative_position, text_words)
+            if similarity >= self.threshold:
+                best = max(best, (similarity, negative_position))
+        return best
+
+    def find(self, transaction: Transaction) -> Tuple[str, float]:
+        """Email and similarity of the hacker most similar to the subject or the address, ("", 0.0) without one"""
+        similarity, negative_position = max(self.best_match(normalize_name(transaction.subject)),
+                                            self.best_match(normalize_name(transaction.contractor_address)))
+        return (self.emails[-negative_position], similarity) if similarity else ("", 0.0)
+
+
+class AccountCache:
+    """
+    Bank accounts hackers pay from, kept in a dsv file of `account;email;source` records. Accounts of transactions
+    matched by name are `learned`, `manual` records are written by hand and are never overwritten. A record without an
+    email is an account shared by many hackers, transactions from it are always matched by name. Learned accounts
+    become shared ones when a transaction from them names another hacker.
+    """
+    LEARNED = 'learned'
+    MANUAL = 'manual'
+
+    def __init__(self, path=None):
+        self.path = path
+        self.accounts: Dict[str, Tuple[str, str]] = {}
+        self.changed = False
+        if path is not None and os.path.exists(path):
+            with open(path, encoding='utf-8') as accounts_file:
+                for record in filter(None, dsv_reader(accounts_file)):
+                    account, email, source = (record + ['', ''])[:3]
+                    self.accounts[normalize_account(account)] = (email, source or self.MANUAL)
+
+    def get(self, account: str) -> Tuple[str, Optional[str]]:
+        """(email, source) of the record of `account`, ('', None) without one"""
+        return self.accounts.get(normalize_account(account), ('', None))
+
+    def learn(self, account: str, email: str):
+        account = normalize_account(account)
+        if account and account not in self.accounts:
+            self.accounts[account] = (email, self.LEARNED)
+            self.changed = True
+
+    def share(self, account: str):
+        """Make a learned account a shared one"""
+        account = normalize_account(account)
+        if self.accounts.get(account, ('', None))[1] == self.LEARNED:
+            self.accounts[account] = ('', self.LEARNED)
+            self.changed = True
+
+    def invalidate(self, emails: Set[str]):
+        """Forget accounts of hackers whose emails aren't in `emails` anymore, with a warning for manual records"""
+        removed = [account for account, (email, _) in self.accounts.items() if email and email not in emails]
+        for account in removed:
+            email, source = self.accounts.pop(account)
+            if source == self.MANUAL:
+                sys.stderr.write(f"removed the manual record of account {account} of {email}, not a member anymore\n")
+        self.changed = self.changed or bool(removed)
+
+    def save(self):
+        if self.path is None or not self.changed:
+            return
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as accounts_file, DsvWriter(accounts_file) as writer:
+                writer.writerows([account, email, source] for account, (email, source) in sorted(self.accounts.items()))
+            os.replace(temporary_path, self.path)
+            self.changed = False
+        finally:
+            if os.path.exists(temporary_path):
+                os.unlink(temporary_path)
+
+
+def transactios2dues_events(transactions: Iterable[Transaction], hackers: Iterable[Hacker],
+                            account_cache: AccountCache = None,
+                            fuzzy_threshold: Optional[float] = FUZZY_NAME_THRESHOLD,
+                            classifier: TransactionClassifier = None) -> Iterable[Event]:
+    """
+    Transaction events of dues, transactions classified as DUE by `classifier`. Hackers are found by the account a
+    transaction came from in `account_cache` and by name otherwise, accounts of hackers found by name are learned by
+    the cache. Hackers of learned accounts aren't searched for by name, unless the transaction doesn't name them. When
+    it names another hacker, they win and the account becomes a shared one. Transactions not matching any name are
+    matched to the most similar one when it's at least `fuzzy_threshold` similar, such events are commented and their
+    accounts aren't learned.
+    """
+    hackers = list(hackers)
+    hacker_name_index = HackerNameIndex(hackers)
+    hacker_fuzzy_index = HackerFuzzyIndex(hackers, fuzzy_threshold) if fuzzy_threshold else None
+    if account_cache is not None:
+        account_cache.invalidate(set(map(lambda h: h.email, hackers)))
     for t in transactions:
-        if is_due(t):
-            hacker_email = find_hacker_email(t, hackers)
+        if is_due(t, classifier):
+            account = t.contractor_account_number
+            hacker_email, source = account_cache.get(account) if account_cache is not None else ('', None)
+            if hacker_email and source == AccountCache.LEARNED and not hacker_name_index.is_named(hacker_email, t):
+                named_email = hacker_name_index.find_email(t)
+                if named_email:
+                    account_cache.share(account)
+                    hacker_email = named_email
+            if not hacker_email:
+                hacker_email = hacker_name_index.find_email(t)
+                if hacker_email and account_cache is not None:
+                    account_cache.learn(account, hacker_email)
+            comment = ''
+            if not hacker_email and hacker_fuzzy_index is not None:
+                hacker_email, similarity = hacker_fuzzy_index.find(t)
+                comment = f"fuzzy name match {similarity:.2f}" if hacker_email else ''
             if hacker_email:
-                yield Event(t.date, 'transaction', f"{t.amount},{hacker_email}", '')
+                yield Event(t.date, 'transaction', f"{t.amount},{hacker_email}", comment)
             else:
                 ERR(t)
         else:
             ERR(t)
 
 
-def first_of_the_month_event_generator(start_date: datetime) -> Iterable[Event]:
-    first_of_the_month = datetime(year=start_date.year, month=start_date.month, day=1)
-    while True:
-        yield Event(first_of_the_month.isoformat(), "nextMonth", '')
-        if first_of_the_month.month == 12:
-            first_of_the_month = datetime(year=first_of_the_month.year + 1, month=1, day=1)
-        else:
-            first_of_the_month = datetime(year=first_of_the_month.year, month=first_of_the_month.month + 1, day=1)
+def first_of_the_month_event(month_start: datetime) -> Event:
+    return Event(month_start.isoformat(), "nextMonth", '')
+
+
+def next_month_start(month_start: datetime) -> datetime:
+    if month_start.month == 12:
+        return datetime(year=month_start.year + 1, month=1, day=1)
+    return datetime(year=month_start.year, month=month_start.month + 1, day=1)
 
 
 def hackers2events(hackers: Iterable[Hacker]) -> Iterable[Event]:
@@ -77,29 +351,62 @@ def hackers2events(hackers: Iterable[Hacker]) -> Iterable[Event]:
         yield Event(h.entry_date, "newMember", h.email)
 
 
-def events_generator(hacker_events: Iterable[Hacker], transaction_events: Iterable[Hacker]) -> Iterable[Event]:
-    first_date = min(transaction_events[0].date, hacker_events[0].date)
-    first_of_the_month_events = iter(first_of_the_month_event_generator(first_date))
-    current_month_event = next(first_of_the_month_events)
+class EventsOrderException(Exception):
+    pass
+
+
+def sorted_events(events: Iterable[Event], name: str) -> Iterable[Event]:
+    """Events of an iterator already sorted by date, checking it really is sorted"""
+    previous = None
+    for event in events:
+        if previous is not None and event.date < previous.date:
+            raise EventsOrderException(f"{name} events aren't sorted by date, {event.as_dsv()} is after "
+                                       f"{previous.as_dsv()}")
+        previous = event
+        yield event
+
 
-    for e in sorted(transaction_events + hacker_events, key=lambda e: e.date):
-        while e.date.month != current_month_event.date.month:
-            yield current_month_event
-            current_month_event = next(first_of_the_month_events)
-        yield e
+def events_generator(hacker_events: Iterable[Event], transaction_events: Iterable[Event]) -> Iterable[Event]:
+    """
+    Hacker and transaction events, each already sorted by date, merged into events sorted as sort_events sorts
+    them. A nextMonth event starts every month from the month of the first event to the month before the one of the
+    last event. Events of the current month are held back until an event of a later month shows up, they are the
+    only events kept in memory.
+    """
+    priorities = event_priorities()
+    sort_key = lambda e: (e.date, priorities.get(e.type, len(priorities)))
+    events = heapq.merge(sorted_events(hacker_events, 'hacker'), sorted_events(transaction_events, 'transaction'),
+                         key=sort_key)
+    month_start, month_events = None, []
+    for e in events:
+        event_month_start = datetime(year=e.date.year, month=e.date.month, day=1)
+        if month_start is None:
+            month_start = event_month_start
+        while month_start < event_month_start:
+            yield from heapq.merge([first_of_the_month_event(month_start)], month_events, key=sort_key)
+            month_events = []
+            month_start = next_month_start(month_start)
+        month_events.append(e)
+    yield from month_events
 
 
 if __name__ == "__main__":
-    import sys
     args = hacker_cli_argparse.parse_args()
     input_file = sys.stdin if args.input_file == '-' else open(args.input_file)
     output_file = sys.stdout if args.output_file == '-' else open(args.output_file, 'w')
     hackers_file = open(args.hackers_file)
 
-    hackers = list(hacker_reader(hackers_file))
-    transactions = parse_transactions(input_file)
+    hackers = list(hacker_reader(hackers_file, fields=('entry_date', 'email', 'name', 'last_name')))
+    transactions = parse_transactions(input_file, workers=args.workers)
 
-    transaction_events = sorted(transactios2dues_events(transactions, hackers), key=lambda e: e.date)
+    account_cache = AccountCache(args.accounts_file) if args.accounts_file else None
+    transaction_events = transactios2dues_events(transactions, hackers, account_cache, args.fuzzy_threshold,
+                                                 transaction_classifier(args.rules_file))
+    if args.sort:
+        transaction_events = sorted(transaction_events, key=lambda e: e.date)
     hacker_events = sorted(hackers2events(hackers), key=lambda e: e.date)
 
-    output_file.writelines(dsv_generator(events_generator(hacker_events, transaction_events)))
+    with DsvWriter(output_file) as writer:
+        writer.writerows(events_generator(hacker_events, transaction_events))
+    if account_cache is not None:
+        account_cache.save()